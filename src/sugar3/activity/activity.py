@@ -81,6 +81,7 @@ from sugar3.graphics.window import Window
 from sugar3.graphics.alert import Alert
 from sugar3.graphics.icon import Icon
 from sugar3.datastore import datastore
+from sugar3.bundle.activitybundle import ActivityBundle
 from gi.repository import SugarExt
 
 _ = lambda msg: gettext.dgettext('sugar-toolkit-gtk3', msg)
@@ -258,7 +259,12 @@ class Activity(Window, Gtk.Container):
         """
         # Stuff that needs to be done early
         icons_path = os.path.join(get_bundle_path(), 'icons')
-        Gtk.IconTheme.get_default().append_search_path(icons_path)
+        if not os.path.isdir(get_bundle_path()):
+            # Running from a zipped bundle
+            icons_path = ActivityBundle(get_bundle_path()).get_real_path(
+                'icons')
+        if icons_path is not None:
+            Gtk.IconTheme.get_default().append_search_path(icons_path)
 
         sugar_theme = 'sugar-72'
         if 'SUGAR_SCALING' in os.environ:
@@ -366,7 +372,7 @@ class Activity(Window, Gtk.Container):
             self._jobject.metadata['icon-color'] = \
                 self.shared_activity.props.color
         else:
-            self._jobject.metadata.connect('updated',
+            self._jobject.metadata.connect('properties-updated',
                                            self.__jobject_updated_cb)
         self.set_title(self._jobject.metadata['title'])
 
@@ -397,7 +403,9 @@ class Activity(Window, Gtk.Container):
 
         return jobject
 
-    def __jobject_updated_cb(self, jobject):
+    def __jobject_updated_cb(self, jobject, keys):
+        if 'title' not in keys:
+            return
         if self.get_title() == jobject['title']:
             return
         self.set_title(jobject['title'])
@@ -608,7 +616,10 @@ class Activity(Window, Gtk.Container):
 
     def __save_cb(self):
         logging.debug('Activity.__save_cb')
-        self._updating_jobject = False
+        self._updating_jobject = datastore.has_pending_writes(self._jobject)
+        if self._updating_jobject:
+            # A later save is still queued
+            return
         if self._quit_requested:
             self._session.will_quit(self, True)
         elif self._closing:
@@ -717,10 +728,6 @@ class Activity(Window, Gtk.Container):
 
         logging.debug('Activity.save: %r' % self._jobject.object_id)
 
-        if self._updating_jobject:
-            logging.info('Activity.save: still processing a previous request.')
-            return
-
         buddies_dict = self._get_buddies()
         if buddies_dict:
             self.metadata['buddies_id'] = json.dumps(buddies_dict.keys())
@@ -749,11 +756,13 @@ class Activity(Window, Gtk.Container):
         if self._jobject.object_id is None:
             datastore.write(self._jobject, transfer_ownership=True)
         else:
+            # Queued writes to the same entry are merged, so a save made
+            # while a previous one is still being processed is not lost
             self._updating_jobject = True
-            datastore.write(self._jobject,
-                            transfer_ownership=True,
-                            reply_handler=self.__save_cb,
-                            error_handler=self.__save_error_cb)
+            datastore.write_behind(self._jobject,
+                                   transfer_ownership=True,
+                                   reply_handler=self.__save_cb,
+                                   error_handler=self.__save_error_cb)
 
     def copy(self):
         """Request that the activity 'Keep in Journal' the current state
@@ -70,7 +70,10 @@ def create_activity_id():
 def get_environment(activity):
     environ = os.environ.copy()
 
-    bin_path = os.path.join(activity.get_path(), 'bin')
+    # Bundles installed without being extracted provide the files that
+    # need to be on the file system from their cache
+    bin_path = activity.get_real_path('bin') or \
+        os.path.join(activity.get_path(), 'bin')
 
     activity_root = env.get_profile_path(activity.get_bundle_id())
     if not os.path.exists(activity_root):
@@ -94,8 +97,8 @@ def get_environment(activity):
     environ['PATH'] = bin_path + ':' + environ['PATH']
 
     if activity.get_path().startswith(env.get_user_activities_path()):
-        environ['SUGAR_LOCALEDIR'] = os.path.join(activity.get_path(),
-                                                  'locale')
+        environ['SUGAR_LOCALEDIR'] = activity.get_real_path('locale') or \
+            os.path.join(activity.get_path(), 'locale')
 
     return environ
 
@@ -119,10 +122,9 @@ def get_command(activity, activity_id=None, object_id=None, uri=None,
     # if the command is in $BUNDLE_ROOT/bin, execute the absolute path so there
     # is no need to mangle with the shell's PATH
     if '/' not in command[0]:
-        bin_path = os.path.join(activity.get_path(), 'bin')
-        absolute_path = os.path.join(bin_path, command[0])
-        if os.path.exists(absolute_path):
-            command[0] = absolute_path
+        if activity.is_file(os.path.join('bin', command[0])):
+            command[0] = activity.get_real_path(
+                os.path.join('bin', command[0]))
 
     logging.debug('launching: %r' % command)
 
@@ -250,7 +252,7 @@ class ActivityCreationHandler(GObject.GObject):
         dev_null = file('/dev/null', 'r')
         child = subprocess.Popen([str(s) for s in command],
                                  env=environ,
-                                 cwd=str(self._bundle.get_path()),
+                                 cwd=str(self._bundle.get_cache_path()),
                                  close_fds=True,
                                  stdin=dev_null.fileno(),
                                  stdout=log_file.fileno(),
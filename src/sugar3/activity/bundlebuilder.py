@@ -35,6 +35,7 @@ from fnmatch import fnmatch
 
 from sugar3 import env
 from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle import bundledelta
 
 
 IGNORE_DIRS = ['dist', '.git']
@@ -197,14 +198,28 @@ class XOPackager(Packager):
         bundle_zip = zipfile.ZipFile(self.package_path, 'w',
                                      zipfile.ZIP_DEFLATED)
 
+        # Manifest of the files of the bundle, for delta updates
+        contents = {}
+
         for f in self.get_files_in_git():
-            bundle_zip.write(os.path.join(self.config.source_dir, f),
+            if f == bundledelta.CONTENTS_PATH:
+                continue
+            path = os.path.join(self.config.source_dir, f)
+            bundle_zip.write(path,
                              os.path.join(self.config.bundle_root_dir, f))
+            contents[f] = bundledelta.get_file_info(path)
 
         for f in self.builder.get_locale_files():
-            bundle_zip.write(os.path.join(self.builder.locale_dir, f),
+            path = os.path.join(self.builder.locale_dir, f)
+            bundle_zip.write(path,
                              os.path.join(self.config.bundle_root_dir,
                                           'locale', f))
+            contents[os.path.join('locale', f)] = \
+                bundledelta.get_file_info(path)
+
+        bundle_zip.writestr(os.path.join(self.config.bundle_root_dir,
+                                         bundledelta.CONTENTS_PATH),
+                            bundledelta.dump_contents(contents))
 
         bundle_zip.close()
 
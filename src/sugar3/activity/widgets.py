@@ -44,7 +44,7 @@ def _create_activity_icon(metadata):
 
     from sugar3.activity.activity import get_bundle_path
     bundle = ActivityBundle(get_bundle_path())
-    icon = Icon(file=bundle.get_icon(), xo_color=color)
+    icon = Icon(file_data=bundle.get_icon_data(), xo_color=color)
 
     return icon
 
@@ -61,10 +61,12 @@ class ActivityButton(ToolButton):
         self.props.hide_tooltip_on_click = False
         self.palette_invoker.props.toggle_palette = True
         self.props.tooltip = activity.metadata['title']
-        activity.metadata.connect('updated', self.__jobject_updated_cb)
+        activity.metadata.connect('properties-updated',
+                                  self.__jobject_updated_cb)
 
-    def __jobject_updated_cb(self, jobject):
-        self.props.tooltip = jobject['title']
+    def __jobject_updated_cb(self, jobject, keys):
+        if 'title' in keys:
+            self.props.tooltip = jobject['title']
 
 
 class ActivityToolbarButton(ToolbarButton):
@@ -180,14 +182,17 @@ class TitleEntry(Gtk.ToolItem):
         self.entry.show()
         self.add(self.entry)
 
-        activity.metadata.connect('updated', self.__jobject_updated_cb)
+        activity.metadata.connect('properties-updated',
+                                  self.__jobject_updated_cb)
         activity.connect('_closing', self.__closing_cb)
 
     def modify_bg(self, state, color):
         Gtk.ToolItem.modify_bg(self, state, color)
         self.entry.modify_bg(state, color)
 
-    def __jobject_updated_cb(self, jobject):
+    def __jobject_updated_cb(self, jobject, keys):
+        if 'title' not in keys:
+            return
         if self.entry.has_focus():
             return
         if self.entry.get_text() == jobject['title']:
@@ -215,8 +220,9 @@ class TitleEntry(Gtk.ToolItem):
         if title == activity.metadata['title']:
             return
 
-        activity.metadata['title'] = title
-        activity.metadata['title_set_by_user'] = '1'
+        with activity.metadata.batch():
+            activity.metadata['title'] = title
+            activity.metadata['title_set_by_user'] = '1'
         activity.save()
 
         activity.set_title(title)
@@ -256,7 +262,8 @@ class DescriptionItem(ToolButton):
         self._palette.set_content(description_box)
         description_box.show_all()
 
-        activity.metadata.connect('updated', self.__jobject_updated_cb)
+        activity.metadata.connect('properties-updated',
+                                  self.__jobject_updated_cb)
 
     def set_expanded(self, expanded):
         box = self.toolbar_box
@@ -287,7 +294,9 @@ class DescriptionItem(ToolButton):
         end_iter = buf.get_end_iter()
         return buf.get_text(start_iter, end_iter, False)
 
-    def __jobject_updated_cb(self, jobject):
+    def __jobject_updated_cb(self, jobject, keys):
+        if 'description' not in keys:
+            return
         if self._text_view.has_focus():
             return
         if 'description' not in jobject:
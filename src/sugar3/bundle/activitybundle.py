@@ -21,19 +21,32 @@ UNSTABLE.
 """
 
 from ConfigParser import ConfigParser
+from contextlib import contextmanager
 from locale import normalize
 import os
-import shutil
-import tempfile
+import json
+import hashlib
 import logging
 
 from sugar3 import env
+from sugar3.bundle import bundlestore
 from sugar3.bundle.bundle import Bundle, \
-    MalformedBundleException, NotInstalledException
+    MalformedBundleException, NotInstalledException, move_to_trash
 from sugar3.bundle.bundleversion import NormalizedVersion
 from sugar3.bundle.bundleversion import InvalidVersionError
 
 
+# Hash of the MIME packages the database was last generated from
+_MIME_HASH_FILE_NAME = '.sugar-packages-hash'
+# Directory of the lists of the MIME icon links installed by each bundle
+_MIME_ICONS_DIR_NAME = 'mime-icons'
+
+_mime_batch_depth = 0
+_mime_batch_deferred = False
+# MIME directories whose database needs to be generated again
+_pending_mime_dirs = set()
+
+
 def _expand_lang(locale):
     # Private method from gettext.py
     locale = normalize(locale)
@@ -83,6 +96,126 @@ def _expand_lang(locale):
     return ret
 
 
+def _get_languages():
+    # Using method from gettext.py, first find languages from environ
+    languages = []
+    for envar in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG'):
+        val = os.environ.get(envar)
+        if val:
+            languages = val.split(':')
+            break
+
+    # Next, normalize and expand the languages
+    nelangs = []
+    for lang in languages:
+        for nelang in _expand_lang(lang):
+            if nelang not in nelangs:
+                nelangs.append(nelang)
+    return nelangs
+
+
+def _get_mime_packages_hash(mime_dir):
+    packages_dir = os.path.join(mime_dir, 'packages')
+    try:
+        names = sorted(os.listdir(packages_dir))
+    except OSError:
+        names = []
+
+    packages_hash = hashlib.sha1()
+    for name in names:
+        if not name.endswith('.xml'):
+            continue
+        try:
+            with open(os.path.join(packages_dir, name), 'rb') as f:
+                content = f.read()
+        except IOError:
+            # Dangling link of a removed bundle
+            continue
+        packages_hash.update(name + '\0')
+        packages_hash.update(hashlib.sha1(content).digest())
+    return packages_hash.hexdigest()
+
+
+def _update_mime_database(mime_dir):
+    packages_hash = _get_mime_packages_hash(mime_dir)
+    hash_path = os.path.join(mime_dir, _MIME_HASH_FILE_NAME)
+    try:
+        with open(hash_path) as f:
+            old_hash = f.read().strip()
+    except IOError:
+        old_hash = None
+
+    if old_hash == packages_hash and \
+            os.path.exists(os.path.join(mime_dir, 'mime.cache')):
+        logging.debug('MIME packages of %s did not change', mime_dir)
+        return
+
+    status = os.spawnlp(os.P_WAIT, 'update-mime-database',
+                        'update-mime-database', mime_dir)
+    if status != 0:
+        # Leave the hash alone so that the next update tries again
+        logging.error('update-mime-database %s failed with status %d',
+                      mime_dir, status)
+        return
+
+    temp_path = hash_path + '.tmp'
+    try:
+        with open(temp_path, 'w') as f:
+            f.write(packages_hash)
+        os.rename(temp_path, hash_path)
+    except (IOError, OSError):
+        logging.exception('Cannot write %s', hash_path)
+
+
+def _flush_mime_updates():
+    mime_dirs = sorted(_pending_mime_dirs)
+    _pending_mime_dirs.clear()
+    for mime_dir in mime_dirs:
+        _update_mime_database(mime_dir)
+    return False
+
+
+def _request_mime_update(mime_dir):
+    _pending_mime_dirs.add(mime_dir)
+    if _mime_batch_depth == 0:
+        _flush_mime_updates()
+
+
+@contextmanager
+def mime_update_batch(deferred=False):
+    """Group the installation and removal of several bundles so that the
+    MIME database is generated only once, when the outermost batch exits.
+
+    with mime_update_batch():
+        for path in bundle_paths:
+            ActivityBundle(path).install()
+
+    The database is not generated again if the MIME types of the installed
+    bundles did not change.
+
+    Keyword arguments:
+    deferred -- if True, generate the database from the main loop when it
+        is idle instead of when the batch exits
+    """
+    global _mime_batch_depth
+    global _mime_batch_deferred
+
+    _mime_batch_depth += 1
+    _mime_batch_deferred = _mime_batch_deferred or deferred
+    try:
+        yield
+    finally:
+        _mime_batch_depth -= 1
+        if _mime_batch_depth == 0:
+            deferred = _mime_batch_deferred
+            _mime_batch_deferred = False
+            if not deferred:
+                _flush_mime_updates()
+            elif _pending_mime_dirs:
+                from gi.repository import GObject
+                GObject.idle_add(_flush_mime_updates)
+
+
 class ActivityBundle(Bundle):
     """A Sugar activity bundle
 
@@ -95,7 +228,15 @@ class ActivityBundle(Bundle):
     _unzipped_extension = '.activity'
     _infodir = 'activity'
 
-    def __init__(self, path, translated=True):
+    def __init__(self, path, translated=True, info=None):
+        """
+        Keyword arguments:
+        path -- path of the bundle directory or .xo file
+        translated -- whether to use the translated name, summary and tags
+            of the current locale
+        info -- metadata returned by get_info() for the same bundle, used
+            instead of parsing activity.info again
+        """
         Bundle.__init__(self, path)
         self.activity_class = None
         self.bundle_exec = None
@@ -110,6 +251,17 @@ class ActivityBundle(Bundle):
         self._summary = None
         self._single_instance = False
 
+        self._translations = None
+
+        if info is not None:
+            self._set_info(info)
+            if translated:
+                for lang in _get_languages():
+                    if lang in self._translations:
+                        self._apply_linfo(self._translations[lang])
+                        break
+            return
+
         info_file = self.get_file('activity/activity.info')
         if info_file is None:
             raise MalformedBundleException('No activity.info file')
@@ -120,6 +272,51 @@ class ActivityBundle(Bundle):
             if linfo_file:
                 self._parse_linfo(linfo_file)
 
+    def get_info(self):
+        """Get the metadata parsed from activity.info, along with the
+        translations found in the bundle, in a form that can be stored as
+        JSON and passed back to the constructor"""
+        if self._translations is None:
+            self._translations = {}
+            for lang in self.list_dir('locale') or []:
+                linfo_file = self.get_file(
+                    os.path.join('locale', lang, 'activity.linfo'))
+                if linfo_file is not None:
+                    self._translations[lang] = self._read_linfo(linfo_file)
+
+        return {
+            'bundle_id': self._bundle_id,
+            'name': self._untranslated_name,
+            'exec': self.bundle_exec,
+            'icon': self._icon,
+            'mime_types': self._mime_types,
+            'show_launcher': self._show_launcher,
+            'tags': self._untranslated_tags,
+            'activity_version': self._activity_version,
+            'summary': self._untranslated_summary,
+            'single_instance': self._single_instance,
+            'translations': self._translations,
+        }
+
+    def _set_info(self, info):
+        self._bundle_id = info['bundle_id']
+        self._name = info['name']
+        self.bundle_exec = info['exec']
+        self._icon = info['icon']
+        self._mime_types = info['mime_types']
+        self._show_launcher = info['show_launcher']
+        self._tags = info['tags']
+        self._activity_version = info['activity_version']
+        self._summary = info['summary']
+        self._single_instance = info['single_instance']
+        self._translations = info['translations']
+        self._save_untranslated()
+
+    def _save_untranslated(self):
+        self._untranslated_name = self._name
+        self._untranslated_summary = self._summary
+        self._untranslated_tags = self._tags
+
     def _parse_info(self, info_file):
         cp = ConfigParser()
         cp.readfp(info_file)
@@ -187,45 +384,42 @@ class ActivityBundle(Bundle):
             if cp.get(section, 'single_instance') == 'yes':
                 self._single_instance = True
 
+        self._save_untranslated()
+
     def _get_linfo_file(self):
-        # Using method from gettext.py, first find languages from environ
-        languages = []
-        for envar in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG'):
-            val = os.environ.get(envar)
-            if val:
-                languages = val.split(':')
-                break
-
-        # Next, normalize and expand the languages
-        nelangs = []
-        for lang in languages:
-            for nelang in _expand_lang(lang):
-                if nelang not in nelangs:
-                    nelangs.append(nelang)
-
-        # Finally, select a language
-        for lang in nelangs:
+        for lang in _get_languages():
             linfo_path = os.path.join('locale', lang, 'activity.linfo')
             linfo_file = self.get_file(linfo_path)
             if linfo_file is not None:
                 return linfo_file
         return None
 
-    def _parse_linfo(self, linfo_file):
+    def _read_linfo(self, linfo_file):
         cp = ConfigParser()
         cp.readfp(linfo_file)
 
         section = 'Activity'
+        linfo = {}
 
         if cp.has_option(section, 'name'):
-            self._name = cp.get(section, 'name')
+            linfo['name'] = cp.get(section, 'name')
 
         if cp.has_option(section, 'summary'):
-            self._summary = cp.get(section, 'summary')
+            linfo['summary'] = cp.get(section, 'summary')
 
         if cp.has_option(section, 'tags'):
             tag_list = cp.get(section, 'tags').strip(';')
-            self._tags = [tag.strip() for tag in tag_list.split(';')]
+            linfo['tags'] = [tag.strip() for tag in tag_list.split(';')]
+
+        return linfo
+
+    def _apply_linfo(self, linfo):
+        self._name = linfo.get('name', self._name)
+        self._summary = linfo.get('summary', self._summary)
+        self._tags = linfo.get('tags', self._tags)
+
+    def _parse_linfo(self, linfo_file):
+        self._apply_linfo(self._read_linfo(linfo_file))
 
     def get_locale_path(self):
         """Get the locale path inside the (installed) activity bundle."""
@@ -247,20 +441,20 @@ class ActivityBundle(Bundle):
         """Get the activity bundle id"""
         return self._bundle_id
 
+    def _get_icon_file_name(self):
+        return os.path.join('activity', self._icon + '.svg')
+
     def get_icon(self):
-        """Get the activity icon name"""
-        # FIXME: this should return the icon data, not a filename, so that
-        # we don't need to create a temp file in the zip case
-        icon_path = os.path.join('activity', self._icon + '.svg')
+        """Get the path of the activity icon file
+
+        The icon of a zipped bundle is extracted into its cache directory;
+        use get_icon_data() to avoid touching the disk.
+        """
+        icon_path = self._get_icon_file_name()
         if self._zip_file is None:
             return os.path.join(self._path, icon_path)
         else:
-            icon_data = self.get_file(icon_path).read()
-            temp_file, temp_file_path = tempfile.mkstemp(prefix=self._icon,
-                                                         suffix='.svg')
-            os.write(temp_file, icon_data)
-            os.close(temp_file)
-            return temp_file_path
+            return self.get_real_path(icon_path)
 
     def get_activity_version(self):
         """Get the activity version"""
@@ -295,24 +489,67 @@ class ActivityBundle(Bundle):
         """Get whether there should be a visible launcher for the activity"""
         return self._show_launcher
 
-    def install(self):
-        install_dir = env.get_user_activities_path()
+    def install(self, progress_cb=None, extract=True, share_files=False):
+        """Install the bundle in the user activities directory
 
-        self._unzip(install_dir)
+        Keyword arguments:
+        progress_cb -- called after each extracted file, with its name, the
+            number of files extracted so far and the total number of files
+        extract -- whether to extract the bundle; if False the .xo file is
+            installed as is and the activity runs from it, extracting
+            only the files that are needed on the file system
+        share_files -- whether to add the extracted files to the bundle
+            store, replacing those other bundles ship too by links to a
+            single read only copy
+
+        Returns the path of the installed bundle.
+        """
+        install_dir = env.get_user_activities_path()
+        extracted_path = os.path.join(install_dir, self._zip_root_dir)
+        zipped_path = extracted_path + self._zipped_extension
+
+        if extract:
+            self._unzip(install_dir, progress_cb)
+            install_path = extracted_path
+            if share_files:
+                saved = bundlestore.get_store().add_tree(install_path)
+                logging.debug('Sharing files of %s saved %d bytes',
+                              self._bundle_id, saved)
+            if os.path.isfile(zipped_path):
+                os.remove(zipped_path)
+        else:
+            install_path = self._copy_zip(install_dir)
+            if os.path.isdir(extracted_path) and \
+                    not os.path.islink(extracted_path):
+                move_to_trash(extracted_path)
 
-        install_path = os.path.join(install_dir, self._zip_root_dir)
         self.install_mime_type(install_path)
 
+        if extract:
+            self._trash_stale_caches()
+        else:
+            self._trash_stale_caches(install_path)
+
         return install_path
 
+    def _get_installed_file(self, install_path, file_name):
+        if os.path.isdir(install_path):
+            return os.path.join(install_path, file_name)
+        # Installed without being extracted, as a copy of this bundle
+        return self.get_real_path(file_name)
+
     def install_mime_type(self, install_path):
         """ Update the mime type database and install the mime type icon
+
+        Within mime_update_batch(), the database is only generated when the
+        batch exits.
         """
         xdg_data_home = os.getenv('XDG_DATA_HOME',
                                   os.path.expanduser('~/.local/share'))
 
-        mime_path = os.path.join(install_path, 'activity', 'mimetypes.xml')
-        if os.path.isfile(mime_path):
+        mime_path = self._get_installed_file(
+            install_path, os.path.join('activity', 'mimetypes.xml'))
+        if mime_path is not None and os.path.isfile(mime_path):
             mime_dir = os.path.join(xdg_data_home, 'mime')
             mime_pkg_dir = os.path.join(mime_dir, 'packages')
             if not os.path.isdir(mime_pkg_dir):
@@ -320,9 +557,9 @@ class ActivityBundle(Bundle):
             installed_mime_path = os.path.join(mime_pkg_dir,
                                                '%s.xml' % self._bundle_id)
             self._symlink(mime_path, installed_mime_path)
-            os.spawnlp(os.P_WAIT, 'update-mime-database',
-                       'update-mime-database', mime_dir)
+            _request_mime_update(mime_dir)
 
+        links = []
         mime_types = self.get_mime_types()
         if mime_types is not None:
             installed_icons_dir = \
@@ -332,20 +569,72 @@ class ActivityBundle(Bundle):
                 os.makedirs(installed_icons_dir)
 
             for mime_type in mime_types:
-                mime_icon_base = os.path.join(install_path, 'activity',
+                mime_icon_base = os.path.join('activity',
                                               mime_type.replace('/', '-'))
-                svg_file = mime_icon_base + '.svg'
-                info_file = mime_icon_base + '.icon'
-                self._symlink(svg_file,
-                              os.path.join(installed_icons_dir,
-                                           os.path.basename(svg_file)))
-                self._symlink(info_file,
-                              os.path.join(installed_icons_dir,
-                                           os.path.basename(info_file)))
+                for extension in ['.svg', '.icon']:
+                    icon_file = self._get_installed_file(
+                        install_path, mime_icon_base + extension)
+                    link = os.path.join(installed_icons_dir,
+                                        os.path.basename(mime_icon_base +
+                                                         extension))
+                    if self._symlink(icon_file, link):
+                        links.append(link)
+
+        # Links of a previous version that this one does not install
+        old_links = self._read_mime_icons_manifest() or []
+        self._remove_mime_icons([old_link for old_link in old_links
+                                 if old_link not in links], install_path)
+        self._write_mime_icons_manifest(links)
+
+    def _get_mime_icons_manifest_path(self):
+        return os.path.join(env.get_profile_path(_MIME_ICONS_DIR_NAME),
+                            self._bundle_id + '.json')
+
+    def _read_mime_icons_manifest(self):
+        """Get the MIME icon links installed for the bundle, or None if
+        they were not recorded"""
+        try:
+            with open(self._get_mime_icons_manifest_path()) as f:
+                return [link.encode('utf-8') for link in json.load(f)]
+        except IOError:
+            return None
+        except ValueError:
+            logging.exception('Invalid MIME icons manifest of %s',
+                              self._bundle_id)
+            return None
+
+    def _write_mime_icons_manifest(self, links):
+        manifest_path = self._get_mime_icons_manifest_path()
+        if not links:
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            return
+
+        manifest_dir = os.path.dirname(manifest_path)
+        if not os.path.isdir(manifest_dir):
+            os.makedirs(manifest_dir)
+        temp_path = manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(links, f)
+        os.rename(temp_path, manifest_path)
+
+    def _remove_mime_icons(self, links, install_path=None):
+        # Only the links to this bundle, others may have replaced them.
+        # The icons of bundles installed without being extracted are
+        # linked from the cache.
+        icons_source_paths = [install_path or self.get_path()]
+        if self._zip_file is not None:
+            # Not created if no file was extracted
+            icons_source_paths.append(self._get_cache_path())
+        prefixes = tuple(os.path.join(path, '') for path in icons_source_paths)
+        for link in links:
+            if os.path.islink(link) and \
+                    os.readlink(link).startswith(prefixes):
+                os.remove(link)
 
     def _symlink(self, src, dst):
-        if not os.path.isfile(src):
-            return
+        if src is None or not os.path.isfile(src):
+            return False
         if not os.path.islink(dst) and os.path.exists(dst):
             raise RuntimeError('Do not remove %s if it was not '
                                'installed by sugar' % dst)
@@ -354,6 +643,7 @@ class ActivityBundle(Bundle):
             logging.debug('Relink %s', dst)
             os.unlink(dst)
         os.symlink(src, dst)
+        return True
 
     def uninstall(self, force=False, delete_profile=False):
         install_path = self.get_path()
@@ -372,26 +662,27 @@ class ActivityBundle(Bundle):
                                            '%s.xml' % self._bundle_id)
         if os.path.exists(installed_mime_path):
             os.remove(installed_mime_path)
-            os.spawnlp(os.P_WAIT, 'update-mime-database',
-                       'update-mime-database', mime_dir)
-
-        mime_types = self.get_mime_types()
-        if mime_types is not None:
+            _request_mime_update(mime_dir)
+
+        links = self._read_mime_icons_manifest()
+        if links is not None:
+            self._remove_mime_icons(links)
+            self._write_mime_icons_manifest([])
+        elif self.get_mime_types() is not None:
+            # Installed before the links were recorded
             installed_icons_dir = \
                 os.path.join(xdg_data_home,
                              'icons/sugar/scalable/mimetypes')
             if os.path.isdir(installed_icons_dir):
-                for f in os.listdir(installed_icons_dir):
-                    path = os.path.join(installed_icons_dir, f)
-                    if os.path.islink(path) and \
-                       os.readlink(path).startswith(install_path):
-                        os.remove(path)
+                self._remove_mime_icons(
+                    [os.path.join(installed_icons_dir, f)
+                     for f in os.listdir(installed_icons_dir)])
 
         if delete_profile:
             bundle_profile_path = env.get_profile_path(self._bundle_id)
             if os.path.exists(bundle_profile_path):
                 os.chmod(bundle_profile_path, 0775)
-                shutil.rmtree(bundle_profile_path, ignore_errors=True)
+                move_to_trash(bundle_profile_path)
 
         self._uninstall(install_path)
 
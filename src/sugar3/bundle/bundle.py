@@ -21,10 +21,39 @@ UNSTABLE.
 """
 
 import os
+import stat
+import errno
 import logging
 import shutil
-import StringIO
+import tempfile
+import threading
 import zipfile
+import Queue
+
+from sugar3 import env
+from sugar3.util import LRU
+from sugar3.bundle import bundlestore
+
+
+# Number of threads extracting the files of a zipped bundle
+EXTRACT_WORKERS = 4
+
+# Number of bundle icons kept in memory
+ICON_CACHE_SIZE = 100
+
+_EXTRACT_BUFFER_SIZE = 1024 * 1024
+_CACHE_DIR_NAME = 'bundle-cache'
+_TRASH_DIR_NAME = '.trash'
+
+# (path, mtime, icon path) -> content of the icon file
+_icon_cache = LRU(ICON_CACHE_SIZE)
+_icon_cache_lock = threading.Lock()
+
+# Paths in the trash, deleted one after the other by the trash thread
+_trash_queue = Queue.Queue()
+_trash_thread = None
+_trash_dirs = set()
+_trash_lock = threading.Lock()
 
 
 class AlreadyInstalledException(Exception):
@@ -51,6 +80,173 @@ class MalformedBundleException(Exception):
     pass
 
 
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _get_cache_name(zip_root_dir, path):
+    # Installing another version of the bundle changes the key
+    file_stat = os.stat(path)
+    return '%s-%d-%d' % (zip_root_dir, file_stat.st_size, file_stat.st_mtime)
+
+
+def _is_cache_name(zip_root_dir, name):
+    if not name.startswith(zip_root_dir + '-'):
+        return False
+    key = name[len(zip_root_dir) + 1:].split('-')
+    return len(key) == 2 and key[0].isdigit() and key[1].isdigit()
+
+
+def _extract_member(zip_file, info, path):
+    # ZipExtFile checks the CRC once the member is fully read
+    source = zip_file.open(info)
+    try:
+        with open(path, 'wb') as destination:
+            shutil.copyfileobj(source, destination, _EXTRACT_BUFFER_SIZE)
+    finally:
+        source.close()
+    mode = info.external_attr >> 16
+    if mode & 0777:
+        os.chmod(path, mode & 0777)
+
+
+def _extract_worker(zip_path, pending, results, cancelled):
+    # Each thread reads the bundle through its own ZipFile
+    try:
+        zip_file = zipfile.ZipFile(zip_path)
+    except Exception, e:
+        zip_file = None
+        error = e
+
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            info, path = item
+            if zip_file is None:
+                results.put((info, error))
+                continue
+            if cancelled.is_set():
+                results.put((info, None))
+                continue
+
+            # Any error has to be reported, corrupted members raise
+            # zlib.error, encrypted ones RuntimeError, and unsupported
+            # compression methods NotImplementedError
+            try:
+                _extract_member(zip_file, info, path)
+            except Exception, e:
+                results.put((info, e))
+                continue
+            results.put((info, None))
+    finally:
+        if zip_file is not None:
+            zip_file.close()
+
+
+def _remove_tree_error_cb(function, path, excinfo):
+    # The directories of a bundle can be read only
+    if function not in (os.remove, os.rmdir):
+        return
+    try:
+        os.chmod(os.path.dirname(path), 0700)
+        function(path)
+    except OSError:
+        logging.warning('Cannot delete %s', path)
+
+
+def _collect_shared_files():
+    # The deleted bundles may have been the last users of shared files
+    try:
+        freed = bundlestore.get_store().gc()
+    except Exception:
+        logging.exception('Error while collecting the bundle store')
+        return
+    if freed:
+        logging.debug('Bundle store collection freed %d bytes', freed)
+
+
+def _trash_worker():
+    while True:
+        path = _trash_queue.get()
+        shutil.rmtree(path, onerror=_remove_tree_error_cb)
+        if _trash_queue.empty():
+            _collect_shared_files()
+        _trash_queue.task_done()
+
+
+def replace_dir(source, destination):
+    """Rename a directory over another one, which is moved to the trash
+
+    The old directory is first renamed aside, and renamed back if the new
+    one cannot be renamed into place, so that one of them is always there.
+    """
+    if not os.path.lexists(destination):
+        os.rename(source, destination)
+        return
+
+    backup_dir = tempfile.mkdtemp(prefix='.backup-',
+                                  dir=os.path.dirname(destination))
+    backup_path = os.path.join(backup_dir, os.path.basename(destination))
+    try:
+        os.rename(destination, backup_path)
+    except OSError:
+        os.rmdir(backup_dir)
+        raise
+    try:
+        os.rename(source, destination)
+    except OSError:
+        os.rename(backup_path, destination)
+        os.rmdir(backup_dir)
+        raise
+    move_to_trash(backup_dir)
+
+
+def move_to_trash(path):
+    """Remove a directory from its location at once and delete it in the
+    background
+
+    The directory is renamed into a trash directory next to it, and its
+    files are deleted by a background thread. What a previous process left
+    in the trash is deleted too. Once the trash is empty, the bundle store
+    contents no bundle links to anymore are deleted.
+    """
+    global _trash_thread
+
+    trash_dir = os.path.join(os.path.dirname(os.path.normpath(path)),
+                             _TRASH_DIR_NAME)
+    _makedirs(trash_dir)
+    trash_path = tempfile.mkdtemp(dir=trash_dir)
+    try:
+        os.rename(path, os.path.join(trash_path, os.path.basename(path)))
+    except OSError:
+        os.rmdir(trash_path)
+        raise
+
+    with _trash_lock:
+        if trash_dir in _trash_dirs:
+            _trash_queue.put(trash_path)
+        else:
+            _trash_dirs.add(trash_dir)
+            for name in os.listdir(trash_dir):
+                _trash_queue.put(os.path.join(trash_dir, name))
+
+        if _trash_thread is None:
+            _trash_thread = threading.Thread(target=_trash_worker)
+            _trash_thread.daemon = True
+            _trash_thread.start()
+
+
+def wait_for_trash():
+    """Wait until the directories moved to the trash are deleted"""
+    _trash_queue.join()
+
+
 class Bundle(object):
     """A Sugar activity, content module, etc.
 
@@ -69,6 +265,7 @@ class Bundle(object):
         self._path = path
         self._zip_root_dir = None
         self._zip_file = None
+        self._zip_index = None
         self._installation_time = os.stat(path).st_mtime
 
         if not os.path.isdir(self._path):
@@ -109,7 +306,47 @@ class Bundle(object):
                     'All files in the bundle must be inside a single ' +
                     'top-level directory')
 
+    def _get_zip_index(self):
+        """Get the tree of the members of the zip file, made of nested
+        dictionaries for directories and ZipInfo objects for files"""
+        if self._zip_index is None:
+            self._zip_index = {}
+            for info in self._zip_file.infolist():
+                parts = info.filename.split('/')
+                if parts[0] != self._zip_root_dir:
+                    continue
+
+                node = self._zip_index
+                for part in parts[1:-1]:
+                    child = node.get(part)
+                    if not isinstance(child, dict):
+                        child = node[part] = {}
+                    node = child
+
+                name = parts[-1]
+                if len(parts) == 1 or not name:
+                    continue
+                if name not in node:
+                    node[name] = info
+        return self._zip_index
+
+    def _lookup_zip_member(self, filename):
+        node = self._get_zip_index()
+        for part in filename.split('/'):
+            if part in ('', '.'):
+                continue
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
     def get_file(self, filename):
+        """Open a file of the bundle for reading
+
+        Files of zipped bundles are decompressed as they are read.
+
+        Returns None if the file does not exist.
+        """
         f = None
 
         if self._zip_file is None:
@@ -119,11 +356,10 @@ class Bundle(object):
             except IOError:
                 return None
         else:
-            path = os.path.join(self._zip_root_dir, filename)
-            try:
-                data = self._zip_file.read(path)
-                f = StringIO.StringIO(data)
-            except KeyError:
+            info = self._lookup_zip_member(filename)
+            if isinstance(info, zipfile.ZipInfo):
+                f = self._zip_file.open(info)
+            else:
                 logging.debug('%s not found.' % filename)
 
         return f
@@ -133,29 +369,155 @@ class Bundle(object):
             path = os.path.join(self._path, filename)
             return os.path.isfile(path)
         else:
-            path = os.path.join(self._zip_root_dir, filename)
-            try:
-                self._zip_file.getinfo(path)
-            except KeyError:
-                return False
-
-            return True
+            info = self._lookup_zip_member(filename)
+            return isinstance(info, zipfile.ZipInfo)
 
     def is_dir(self, filename):
         if self._zip_file is None:
             path = os.path.join(self._path, filename)
             return os.path.isdir(path)
         else:
-            path = os.path.join(self._zip_root_dir, filename, "")
-            for f in self._zip_file.namelist():
-                if f.startswith(path):
-                    return True
-            return False
+            return isinstance(self._lookup_zip_member(filename), dict)
+
+    def list_dir(self, dirname=''):
+        """Get the names of the entries of a directory of the bundle, or
+        None if the directory does not exist"""
+        if self._zip_file is None:
+            path = os.path.join(self._path, dirname)
+            if not os.path.isdir(path):
+                return None
+            return sorted(os.listdir(path))
+        else:
+            node = self._lookup_zip_member(dirname)
+            if not isinstance(node, dict):
+                return None
+            return sorted(node.keys())
 
     def get_path(self):
         """Get the bundle path."""
         return self._path
 
+    def get_import_path(self):
+        """Get the entry of sys.path to import the Python modules of the
+        bundle from"""
+        if self._zip_file is None:
+            return self._path
+        return os.path.join(self._path, self._zip_root_dir)
+
+    def get_cache_path(self):
+        """Get the directory the files of a zipped bundle are extracted into
+        when they are needed on the file system, or the bundle directory"""
+        if self._zip_file is None:
+            return self._path
+
+        path = self._get_cache_path()
+        _makedirs(path)
+        return path
+
+    def _get_cache_path(self):
+        return os.path.join(env.get_profile_path(_CACHE_DIR_NAME),
+                            _get_cache_name(self._zip_root_dir, self._path))
+
+    def _trash_stale_caches(self, install_path=None):
+        """Move to the trash the cache directories of the other versions
+        of the bundle, all of them if it was installed extracted"""
+        cache_dir = env.get_profile_path(_CACHE_DIR_NAME)
+        if not os.path.isdir(cache_dir):
+            return
+        current_name = None
+        if install_path is not None:
+            current_name = _get_cache_name(self._zip_root_dir, install_path)
+        for name in os.listdir(cache_dir):
+            if name != current_name and \
+                    _is_cache_name(self._zip_root_dir, name):
+                move_to_trash(os.path.join(cache_dir, name))
+
+    def get_real_path(self, filename):
+        """Get a path on the file system for a file or directory of the bundle
+
+        The files of zipped bundles are extracted into get_cache_path() the
+        first time they are asked for; all of them, for a directory.
+
+        Returns None if the bundle has no such file or directory.
+        """
+        if self._zip_file is None:
+            path = os.path.join(self._path, filename)
+            if not os.path.lexists(path):
+                return None
+            return path
+
+        node = self._lookup_zip_member(filename)
+        if node is None:
+            return None
+
+        cache_path = self.get_cache_path()
+        path = os.path.normpath(os.path.join(cache_path, filename))
+        if path != cache_path and not path.startswith(cache_path + os.sep):
+            return None
+        self._extract_node(node, path)
+        return path
+
+    def _extract_node(self, node, path):
+        if isinstance(node, dict):
+            _makedirs(path)
+            for name, child in node.iteritems():
+                self._extract_node(child, os.path.join(path, name))
+            return
+
+        if os.path.lexists(path):
+            return
+        _makedirs(os.path.dirname(path))
+
+        # Renamed into place, as other processes may extract it too
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        if stat.S_ISLNK(node.external_attr >> 16):
+            os.symlink(self._zip_file.read(node), temp_path)
+        else:
+            _extract_member(self._zip_file, node, temp_path)
+        os.rename(temp_path, path)
+
+    def _get_icon_file_name(self):
+        """Get the path of the icon inside the bundle, or None"""
+        return None
+
+    def get_icon_data(self):
+        """Get the content of the icon file of the bundle
+
+        It is read from the bundle, without extracting anything for zipped
+        bundles, and kept in memory until the bundle or the icon changes.
+
+        Returns None if the bundle has no icon.
+        """
+        icon_file_name = self._get_icon_file_name()
+        if icon_file_name is None:
+            return None
+
+        if self._zip_file is None:
+            stat_path = os.path.join(self._path, icon_file_name)
+        else:
+            stat_path = self._path
+        try:
+            mtime = os.stat(stat_path).st_mtime
+        except OSError:
+            return None
+
+        key = (self._path, mtime, icon_file_name)
+        with _icon_cache_lock:
+            if key in _icon_cache:
+                return _icon_cache[key]
+
+        f = self.get_file(icon_file_name)
+        if f is None:
+            return None
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        with _icon_cache_lock:
+            _icon_cache[key] = data
+        return data
+
     def get_installation_time(self):
         """Get a timestamp representing the time at which this activity was
         installed."""
@@ -164,24 +526,131 @@ class Bundle(object):
     def get_show_launcher(self):
         return True
 
-    def _unzip(self, install_dir):
+    def _unzip(self, install_dir, progress_cb=None):
+        """Extract the bundle into a directory
+
+        The files are extracted in parallel into a hidden staging directory
+        and the bundle directory is then renamed into place, replacing any
+        previous one, so an interrupted installation leaves no partially
+        extracted bundle behind.
+
+        Keyword arguments:
+        install_dir -- the directory to install the bundle into
+        progress_cb -- called, from the calling thread, with the name of
+            each extracted file, the number of files extracted so far and
+            the total number of files
+        """
         if self._zip_file is None:
             raise AlreadyInstalledException
 
         if not os.path.isdir(install_dir):
             os.mkdir(install_dir, 0775)
 
-        # zipfile provides API that in theory would let us do this
-        # correctly by hand, but handling all the oddities of
-        # Windows/UNIX mappings, extension attributes, deprecated
-        # features, etc makes it impractical.
-        if os.spawnlp(os.P_WAIT, 'unzip', 'unzip', '-o', self._path,
-                      '-x', 'mimetype', '-d', install_dir):
-            # clean up install dir after failure
-            shutil.rmtree(os.path.join(install_dir, self._zip_root_dir),
-                          ignore_errors=True)
-            # indicate failure.
-            raise ZipExtractException
+        staging_dir = tempfile.mkdtemp(prefix='.install-', dir=install_dir)
+        try:
+            self._extract(staging_dir, progress_cb)
+            replace_dir(os.path.join(staging_dir, self._zip_root_dir),
+                        os.path.join(install_dir, self._zip_root_dir))
+        except (zipfile.BadZipfile, IOError, OSError), e:
+            logging.error('Error extracting %s: %s', self._path, e)
+            raise ZipExtractException(str(e))
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _get_member_path(self, staging_dir, file_name):
+        path = os.path.normpath(os.path.join(staging_dir, file_name))
+        if not path.startswith(staging_dir + os.sep):
+            raise ZipExtractException('Invalid file name %r' % file_name)
+        return path
+
+    def _extract(self, staging_dir, progress_cb):
+        dirs = []
+        files = []
+        links = []
+        for info in self._zip_file.infolist():
+            if info.filename == 'mimetype':
+                continue
+            path = self._get_member_path(staging_dir, info.filename)
+            mode = info.external_attr >> 16
+            if info.filename.endswith('/'):
+                dirs.append((path, mode))
+            elif stat.S_ISLNK(mode):
+                links.append((info, path))
+            else:
+                files.append((info, path))
+
+        for path, mode_ in dirs:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        for info_, path in files + links:
+            parent = os.path.dirname(path)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+
+        pending = Queue.Queue()
+        results = Queue.Queue()
+        cancelled = threading.Event()
+        for info, path in files:
+            pending.put((info, path))
+        workers = max(1, min(EXTRACT_WORKERS, len(files)))
+        for i in range(workers):
+            pending.put(None)
+            thread = threading.Thread(target=_extract_worker,
+                                      args=(self._path, pending, results,
+                                            cancelled))
+            thread.daemon = True
+            thread.start()
+
+        error = None
+        for i in range(len(files)):
+            info, member_error = results.get()
+            if member_error is not None:
+                if error is None:
+                    error = member_error
+                    cancelled.set()
+            elif progress_cb is not None and error is None:
+                progress_cb(info.filename, i + 1, len(files))
+        if isinstance(error, (IOError, OSError)):
+            raise error
+        elif error is not None:
+            raise MalformedBundleException('Corrupted bundle %s: %s' %
+                                           (self._path, error))
+
+        for info, path in links:
+            os.symlink(self._zip_file.read(info), path)
+
+        # Deepest first, in case a directory is read only
+        for path, mode in sorted(dirs, reverse=True):
+            if mode & 0777:
+                os.chmod(path, mode & 0777)
+
+    def _copy_zip(self, install_dir):
+        """Install a zipped bundle as is, to be used without extracting it
+
+        Returns the path of the installed zip file.
+        """
+        if self._zip_file is None:
+            raise AlreadyInstalledException
+
+        if not os.path.isdir(install_dir):
+            os.mkdir(install_dir, 0775)
+
+        destination = os.path.join(install_dir,
+                                   self._zip_root_dir + self._zipped_extension)
+        fd, temp_path = tempfile.mkstemp(prefix='.install-', dir=install_dir)
+        os.close(fd)
+        os.remove(temp_path)
+        try:
+            try:
+                os.link(self._path, temp_path)
+            except OSError:
+                shutil.copy2(self._path, temp_path)
+            os.rename(temp_path, destination)
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return destination
 
     def _zip(self, bundle_path):
         if self._zip_file is not None:
@@ -190,6 +659,13 @@ class Bundle(object):
         raise NotImplementedError
 
     def _uninstall(self, install_path):
+        if self._zip_file is not None and install_path == self._path:
+            # Installed without being extracted
+            cache_path = self.get_cache_path()
+            os.remove(install_path)
+            move_to_trash(cache_path)
+            return
+
         if not os.path.isdir(install_path):
             raise InvalidPathException
         if self._unzipped_extension is not None:
@@ -197,13 +673,4 @@ class Bundle(object):
             if ext != self._unzipped_extension:
                 raise InvalidPathException
 
-        for root, dirs, files in os.walk(install_path, topdown=False):
-            for name in files:
-                os.remove(os.path.join(root, name))
-            for name in dirs:
-                path = os.path.join(root, name)
-                if os.path.islink(path):
-                    os.remove(path)
-                else:
-                    os.rmdir(path)
-        os.rmdir(install_path)
+        move_to_trash(install_path)
@@ -0,0 +1,335 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Content manifests of bundles and delta updates between their versions
+
+A bundle built by bundlebuilder contains a manifest, CONTENTS_PATH, with
+the SHA-256 hash and size of each of its files:
+
+    {"version": 1,
+     "files": {"activity/activity.info": ["<sha256>", 160], ...}}
+
+A delta is a zip file holding what changed between two versions of an
+activity bundle: delta.json, with the bundle id, both versions, and the
+removed and changed files, the manifest of the new version and, under
+files/, the changed files themselves.
+
+UNSTABLE.
+"""
+
+import os
+import json
+import errno
+import hashlib
+import logging
+import shutil
+import tempfile
+import zipfile
+
+from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle.bundle import NotInstalledException, replace_dir
+
+
+CONTENTS_PATH = 'activity/contents.json'
+
+_CONTENTS_VERSION = 1
+_DELTA_VERSION = 1
+_DELTA_INFO_PATH = 'delta.json'
+_DELTA_CONTENTS_PATH = 'contents.json'
+_DELTA_FILES_DIR = 'files/'
+_READ_SIZE = 1024 * 1024
+
+
+class InvalidDeltaException(Exception):
+    pass
+
+
+def _hash_file(f):
+    file_hash = hashlib.sha256()
+    size = 0
+    while True:
+        data = f.read(_READ_SIZE)
+        if not data:
+            break
+        file_hash.update(data)
+        size += len(data)
+    return file_hash.hexdigest(), size
+
+
+def get_file_info(path):
+    """Get the manifest entry of a file, [sha256, size]"""
+    with open(path, 'rb') as f:
+        return list(_hash_file(f))
+
+
+def dump_contents(files):
+    """Serialize a manifest
+
+    Keyword arguments:
+    files -- dictionary of the file names, relative to the bundle root
+        directory, to their manifest entry
+    """
+    return json.dumps({'version': _CONTENTS_VERSION, 'files': files},
+                      sort_keys=True, separators=(',', ':'))
+
+
+def _load_contents(f):
+    try:
+        contents = json.load(f)
+    except ValueError:
+        return None
+    if contents.get('version') != _CONTENTS_VERSION:
+        return None
+    return dict([(name.encode('utf-8'), info)
+                 for name, info in contents['files'].iteritems()])
+
+
+def read_contents(bundle):
+    """Get the manifest of a bundle, or None if it has none"""
+    f = bundle.get_file(CONTENTS_PATH)
+    if f is None:
+        return None
+    try:
+        return _load_contents(f)
+    finally:
+        f.close()
+
+
+def _compute_contents(zip_file):
+    # For bundles built without a manifest
+    files = {}
+    for info in zip_file.infolist():
+        name = info.filename.split('/', 1)[-1]
+        if info.filename.endswith('/') or name == CONTENTS_PATH or \
+                '/' not in info.filename:
+            continue
+        f = zip_file.open(info)
+        try:
+            files[name] = list(_hash_file(f))
+        finally:
+            f.close()
+    return files
+
+
+def _get_zip_contents(zip_file, bundle):
+    contents = read_contents(bundle)
+    if contents is None:
+        contents = _compute_contents(zip_file)
+    return contents
+
+
+def create_delta(old_path, new_path, delta_path):
+    """Create the delta updating an activity from a version to another
+
+    Keyword arguments:
+    old_path -- path of the .xo file of the old version
+    new_path -- path of the .xo file of the new version
+    delta_path -- path of the delta file to write
+    """
+    old_bundle = ActivityBundle(old_path, translated=False)
+    new_bundle = ActivityBundle(new_path, translated=False)
+    if old_bundle.get_bundle_id() != new_bundle.get_bundle_id():
+        raise InvalidDeltaException('%s and %s are different activities' %
+                                    (old_path, new_path))
+
+    old_zip = zipfile.ZipFile(old_path)
+    new_zip = zipfile.ZipFile(new_path)
+    try:
+        old_contents = _get_zip_contents(old_zip, old_bundle)
+        new_contents = _get_zip_contents(new_zip, new_bundle)
+
+        changed = sorted([name for name, info in new_contents.iteritems()
+                          if old_contents.get(name) != info])
+        removed = sorted([name for name in old_contents
+                          if name not in new_contents])
+
+        new_members = {}
+        for info in new_zip.infolist():
+            new_members[info.filename.split('/', 1)[-1]] = info
+
+        delta_info = {'version': _DELTA_VERSION,
+                      'bundle_id': new_bundle.get_bundle_id(),
+                      'old_version': old_bundle.get_activity_version(),
+                      'new_version': new_bundle.get_activity_version(),
+                      'changed': changed,
+                      'removed': removed}
+
+        delta_zip = zipfile.ZipFile(delta_path, 'w', zipfile.ZIP_DEFLATED)
+        try:
+            delta_zip.writestr(_DELTA_INFO_PATH, json.dumps(delta_info))
+            delta_zip.writestr(_DELTA_CONTENTS_PATH,
+                               dump_contents(new_contents))
+            for name in changed:
+                member = new_members[name]
+                info = zipfile.ZipInfo(_DELTA_FILES_DIR + name,
+                                       member.date_time)
+                info.external_attr = member.external_attr
+                info.compress_type = zipfile.ZIP_DEFLATED
+                delta_zip.writestr(info, new_zip.read(member))
+        finally:
+            delta_zip.close()
+    finally:
+        old_zip.close()
+        new_zip.close()
+
+
+def _get_member_path(root, name):
+    path = os.path.normpath(os.path.join(root, name))
+    if not path.startswith(root + os.sep):
+        raise InvalidDeltaException('Invalid file name %r' % name)
+    return path
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class _DeltaApplier(object):
+
+    def __init__(self, bundle, delta_zip):
+        self._bundle = bundle
+        self._install_path = bundle.get_path()
+        self._delta_zip = delta_zip
+
+        self._info = json.loads(delta_zip.read(_DELTA_INFO_PATH))
+        self._contents = _load_contents(
+            delta_zip.open(_DELTA_CONTENTS_PATH))
+        if self._info.get('version') != _DELTA_VERSION or \
+                self._contents is None:
+            raise InvalidDeltaException('Unsupported delta format')
+
+        self._changed = set([name.encode('utf-8')
+                             for name in self._info['changed']])
+
+    def check(self):
+        if self._info['bundle_id'] != self._bundle.get_bundle_id():
+            raise InvalidDeltaException('The delta is for %s' %
+                                        self._info['bundle_id'])
+        if self._info['old_version'] != \
+                self._bundle.get_activity_version():
+            raise InvalidDeltaException(
+                'The delta applies to version %s, not %s' %
+                (self._info['old_version'],
+                 self._bundle.get_activity_version()))
+
+        # The files that did not change must be those of the old version,
+        # even if modified in place without changing their size
+        for name, info in self._contents.iteritems():
+            if name in self._changed:
+                continue
+            path = os.path.join(self._install_path, name)
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                raise InvalidDeltaException('%s is missing' % name)
+            if size != info[1] or get_file_info(path) != info:
+                raise InvalidDeltaException('%s was modified' % name)
+
+    def stage(self, staging_path):
+        """Create the new version of the bundle in a directory, linking
+        the files that did not change from the installed version"""
+        for name in sorted(self._contents):
+            path = _get_member_path(staging_path, name)
+            _makedirs(os.path.dirname(path))
+            if name in self._changed:
+                self._extract(name, path)
+            else:
+                _link_or_copy(os.path.join(self._install_path, name), path)
+
+        contents_path = os.path.join(staging_path, CONTENTS_PATH)
+        _makedirs(os.path.dirname(contents_path))
+        with open(contents_path, 'w') as f:
+            f.write(dump_contents(self._contents))
+
+    def _extract(self, name, path):
+        member = self._delta_zip.getinfo(_DELTA_FILES_DIR + name)
+        source = self._delta_zip.open(member)
+        file_hash = hashlib.sha256()
+        try:
+            with open(path, 'wb') as destination:
+                while True:
+                    data = source.read(_READ_SIZE)
+                    if not data:
+                        break
+                    file_hash.update(data)
+                    destination.write(data)
+        finally:
+            source.close()
+
+        if file_hash.hexdigest() != self._contents[name][0]:
+            raise InvalidDeltaException('Corrupted file %s' % name)
+        mode = member.external_attr >> 16
+        if mode & 0777:
+            os.chmod(path, mode & 0777)
+
+
+def apply_delta(bundle, delta_path):
+    """Update an installed activity bundle with a delta
+
+    Only the changed files are written; the files that did not change are
+    first checked against the manifest of the new version, then the new
+    version is staged next to the installed one, sharing them, and renamed
+    into place once complete.
+
+    Keyword arguments:
+    bundle -- the installed ActivityBundle, as a directory
+    delta_path -- path of the delta file
+
+    Returns the updated ActivityBundle. Raises InvalidDeltaException if the
+    delta does not apply to the installed bundle.
+    """
+    install_path = os.path.normpath(bundle.get_path())
+    if not os.path.isdir(install_path) or os.path.islink(install_path):
+        raise NotInstalledException
+
+    try:
+        delta_zip = zipfile.ZipFile(delta_path)
+    except zipfile.error, e:
+        raise InvalidDeltaException('Error accessing delta file %r: %s' %
+                                    (delta_path, e))
+
+    staging_dir = tempfile.mkdtemp(prefix='.install-',
+                                   dir=os.path.dirname(install_path))
+    try:
+        applier = _DeltaApplier(bundle, delta_zip)
+        applier.check()
+
+        staging_path = os.path.join(staging_dir,
+                                    os.path.basename(install_path))
+        applier.stage(staging_path)
+        replace_dir(staging_path, install_path)
+    except (IOError, OSError, KeyError, ValueError, zipfile.error), e:
+        logging.error('Error applying %s: %s', delta_path, e)
+        raise InvalidDeltaException(str(e))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        delta_zip.close()
+
+    new_bundle = ActivityBundle(install_path)
+    new_bundle.install_mime_type(install_path)
+    return new_bundle
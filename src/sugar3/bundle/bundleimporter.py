@@ -0,0 +1,85 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Import of the Python modules of bundles
+
+The Python modules of a zipped bundle are imported from the zip file by
+zipimport. Extension modules can only be loaded from the file system, so
+they are found by an importer that extracts them into the bundle cache.
+
+UNSTABLE.
+"""
+
+import os
+import sys
+import imp
+
+
+class ExtensionImporter(object):
+    """PEP 302 finder and loader of the extension modules of a zipped
+    bundle"""
+
+    def __init__(self, bundle):
+        self._bundle = bundle
+        self._import_path = bundle.get_import_path()
+        # module name -> path of its file in the bundle
+        self._found = {}
+
+    def _get_bundle_dir(self, path_entry):
+        if path_entry == self._import_path:
+            return ''
+        if path_entry.startswith(self._import_path + os.sep):
+            return path_entry[len(self._import_path) + 1:]
+        return None
+
+    def find_module(self, fullname, path=None):
+        if path is None:
+            path = [self._import_path]
+
+        name = fullname.rpartition('.')[2]
+        for path_entry in path:
+            bundle_dir = self._get_bundle_dir(path_entry)
+            if bundle_dir is None:
+                continue
+            for suffix, mode_, module_type in imp.get_suffixes():
+                if module_type != imp.C_EXTENSION:
+                    continue
+                file_name = os.path.join(bundle_dir, name + suffix)
+                if self._bundle.is_file(file_name):
+                    self._found[fullname] = file_name
+                    return self
+        return None
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+
+        file_name = self._found.pop(fullname)
+        real_path = self._bundle.get_real_path(file_name)
+        if real_path is None:
+            raise ImportError('Cannot extract %s' % file_name)
+        return imp.load_dynamic(fullname, real_path)
+
+
+def install(bundle):
+    """Make the Python modules of a bundle importable"""
+    import_path = bundle.get_import_path()
+    if import_path not in sys.path:
+        sys.path.append(import_path)
+
+    if not os.path.isdir(bundle.get_path()):
+        sys.meta_path.append(ExtensionImporter(bundle))
@@ -0,0 +1,275 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Persistent index of the installed activity bundles
+
+The metadata of every bundle found by a scan is stored in a single file in
+the profile, keyed by the bundle path and modification times, so that the
+next scan only parses the bundles that were installed or changed since.
+
+UNSTABLE.
+"""
+
+import os
+import json
+import logging
+import threading
+import Queue
+
+from sugar3 import env
+from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle.activitybundle import _get_languages
+from sugar3.bundle.bundle import MalformedBundleException
+
+
+# Number of threads that parse changed bundles
+SCAN_WORKERS = 4
+
+_INDEX_FILE_NAME = 'bundle-index.json'
+# Bumped when the layout of the cached metadata changes
+_INDEX_VERSION = 1
+
+
+def _decode_json_strings(value):
+    # json loads unicode strings, while paths and activity.info values are
+    # byte strings everywhere else
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_decode_json_strings(item) for item in value]
+    if isinstance(value, dict):
+        return dict([(_decode_json_strings(key), _decode_json_strings(item))
+                     for key, item in value.iteritems()])
+    return value
+
+
+def _get_timestamps(path):
+    """Get the modification times the cached metadata of a bundle depends
+    on, or None if the bundle does not exist"""
+    try:
+        bundle_mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    # The translations are cached too: a language can be added, and the
+    # linfo file of the current language edited in place
+    relative_paths = [os.path.join('activity', 'activity.info'), 'locale']
+    relative_paths.extend([os.path.join('locale', lang, 'activity.linfo')
+                           for lang in _get_languages()])
+
+    timestamps = [bundle_mtime]
+    for relative_path in relative_paths:
+        try:
+            timestamps.append(os.stat(os.path.join(path,
+                                                   relative_path)).st_mtime)
+        except OSError:
+            timestamps.append(0)
+    return timestamps
+
+
+def _parse_worker(pending, results):
+    while True:
+        path = pending.get()
+        if path is None:
+            return
+
+        info = None
+        error = None
+        try:
+            info = ActivityBundle(path, translated=False).get_info()
+        except MalformedBundleException, e:
+            error = str(e)
+        except Exception, e:
+            logging.exception('Error while reading bundle %s', path)
+            error = str(e)
+        results.put((path, info, error))
+
+
+class BundleIndex(object):
+    """Cache of the metadata of activity bundles"""
+
+    def __init__(self, index_path=None):
+        if index_path is None:
+            index_path = env.get_profile_path(_INDEX_FILE_NAME)
+        self._index_path = index_path
+        self._entries = {}
+        self._modified = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._index_path):
+            return
+        try:
+            with open(self._index_path) as f:
+                index = _decode_json_strings(json.load(f))
+        except (IOError, ValueError):
+            logging.exception('Cannot read the bundle index')
+            return
+
+        if index.get('version') == _INDEX_VERSION:
+            self._entries = index['bundles']
+
+    def save(self):
+        """Write the index back to disk, if it was modified"""
+        if not self._modified:
+            return
+
+        temp_path = self._index_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump({'version': _INDEX_VERSION,
+                           'bundles': self._entries},
+                          f, separators=(',', ':'))
+            os.rename(temp_path, self._index_path)
+        except (IOError, OSError):
+            logging.exception('Cannot write the bundle index')
+            return
+        self._modified = False
+
+    def _get_fresh_entry(self, path, timestamps):
+        entry = self._entries.get(path)
+        if entry is not None and entry['timestamps'] == timestamps:
+            return entry
+        return None
+
+    def _create_bundle(self, path, entry):
+        if entry['info'] is None:
+            logging.debug('Skipping bundle %s: %s', path, entry['error'])
+            return None
+        try:
+            return ActivityBundle(path, info=entry['info'])
+        except (OSError, KeyError), e:
+            logging.warning('Cannot load bundle %s: %s', path, e)
+            return None
+
+    def get_bundles(self, paths, workers=None):
+        """Get the activity bundles of some directories
+
+        Only the bundles that changed since they were last indexed are
+        parsed, in parallel.
+
+        Keyword arguments:
+        paths -- the paths of the bundle directories
+        workers -- number of parsing threads, SCAN_WORKERS by default
+
+        Returns a list of ActivityBundle objects, skipping the paths that
+        do not hold a valid bundle.
+        """
+        timestamps = {}
+        stale_paths = []
+        for path in paths:
+            timestamps[path] = _get_timestamps(path)
+            if timestamps[path] is None:
+                continue
+            if self._get_fresh_entry(path, timestamps[path]) is None:
+                stale_paths.append(path)
+
+        if stale_paths:
+            self._parse(stale_paths, timestamps, workers)
+
+        bundles = []
+        for path in paths:
+            entry = self._get_fresh_entry(path, timestamps[path])
+            if entry is not None:
+                bundle = self._create_bundle(path, entry)
+                if bundle is not None:
+                    bundles.append(bundle)
+        return bundles
+
+    def _parse(self, paths, timestamps, workers):
+        if workers is None:
+            workers = SCAN_WORKERS
+        workers = max(1, min(workers, len(paths)))
+
+        pending = Queue.Queue()
+        results = Queue.Queue()
+        for path in paths:
+            pending.put(path)
+        for i in range(workers):
+            pending.put(None)
+
+        for i in range(workers):
+            thread = threading.Thread(target=_parse_worker,
+                                      args=(pending, results))
+            thread.daemon = True
+            thread.start()
+
+        for i in range(len(paths)):
+            path, info, error = results.get()
+            self._entries[path] = {'timestamps': timestamps[path],
+                                   'info': info,
+                                   'error': error}
+            self._modified = True
+
+    def get_bundle(self, path):
+        """Get the activity bundle of a directory, or None if it does not
+        hold a valid bundle"""
+        bundles = self.get_bundles([path], workers=1)
+        if bundles:
+            return bundles[0]
+        return None
+
+    def remove(self, path):
+        """Forget the metadata of a bundle"""
+        if self._entries.pop(path, None) is not None:
+            self._modified = True
+
+    def scan(self, directories=None):
+        """Get the activity bundles found in some directories
+
+        The index is pruned from the bundles of these directories that
+        disappeared, and saved.
+
+        Keyword arguments:
+        directories -- the directories to scan, the user activities
+            directory by default
+        """
+        if directories is None:
+            directories = [env.get_user_activities_path()]
+        directories = [os.path.normpath(directory)
+                       for directory in directories]
+
+        paths = []
+        for directory in directories:
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError:
+                continue
+            paths.extend([os.path.join(directory, name) for name in names
+                          if not name.startswith('.')])
+
+        bundles = self.get_bundles(paths)
+
+        scanned = set(paths)
+        for path in self._entries.keys():
+            if os.path.dirname(path) in directories and path not in scanned:
+                self.remove(path)
+
+        self.save()
+        return bundles
+
+
+_index = None
+
+
+def get_index():
+    """Get the BundleIndex stored in the profile"""
+    global _index
+
+    if _index is None:
+        _index = BundleIndex()
+    return _index
@@ -0,0 +1,202 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Sharing of the identical files of installed bundles
+
+The store keeps one copy of each file content, named after its SHA-256
+hash, and the files of the bundles added to it are hard links to these
+copies. Identical icons, libraries or translations shipped by several
+activities then use the disk space and the page cache only once.
+
+Shared files are made read only: they must be replaced, never modified in
+place, see unshare(). Contents no bundle links to anymore are deleted by
+BundleStore.gc(), which runs once the bundles moved to the trash are
+deleted.
+
+UNSTABLE.
+"""
+
+import os
+import stat
+import errno
+import hashlib
+import logging
+import shutil
+
+from sugar3 import env
+
+
+_STORE_DIR_NAME = 'bundle-store'
+_READ_SIZE = 1024 * 1024
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _hash_file(path):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(_READ_SIZE)
+            if not data:
+                break
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+def _replace_with_link(source, path):
+    # Renamed over the file, which is never missing
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    os.link(source, temp_path)
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+
+
+def unshare(path):
+    """Replace a shared file of a bundle by a writable copy of its own"""
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        shutil.copy2(path, temp_path)
+        os.chmod(temp_path,
+                 stat.S_IMODE(os.stat(path).st_mode) | stat.S_IWUSR)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class BundleStore(object):
+    """Content addressed store of the files of bundles"""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = env.get_profile_path(_STORE_DIR_NAME)
+        self._path = path
+
+    def _get_object_path(self, digest, executable):
+        # Hard links share their mode, so executable files are kept apart
+        name = digest
+        if executable:
+            name += '-x'
+        return os.path.join(self._path, digest[:2], name)
+
+    def add_file(self, path):
+        """Share the content of a file
+
+        Returns True if the file was replaced by a link to a content
+        already in the store.
+        """
+        file_stat = os.lstat(path)
+        if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_size == 0:
+            return False
+
+        mode = stat.S_IMODE(file_stat.st_mode)
+        executable = bool(mode & 0111)
+        object_path = self._get_object_path(_hash_file(path), executable)
+        try:
+            object_stat = os.stat(object_path)
+        except OSError:
+            object_stat = None
+
+        if object_stat is None:
+            # The file becomes the shared copy
+            _makedirs(os.path.dirname(object_path))
+            os.chmod(path, mode & ~0222)
+            _replace_with_link(path, object_path)
+            return False
+
+        if object_stat.st_ino == file_stat.st_ino or \
+                object_stat.st_size != file_stat.st_size:
+            return False
+        _replace_with_link(object_path, path)
+        return True
+
+    def add_tree(self, root):
+        """Share the contents of the files of a directory, typically an
+        installed bundle
+
+        Returns the number of bytes saved.
+        """
+        saved = 0
+        for dir_path, dir_names_, file_names in os.walk(root):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    if self.add_file(path):
+                        saved += os.stat(path).st_size
+                except (IOError, OSError), e:
+                    if getattr(e, 'errno', None) == errno.EXDEV:
+                        logging.warning('%s and the bundle store are not on '
+                                        'the same file system', root)
+                        return saved
+                    logging.warning('Cannot share %s: %s', path, e)
+        return saved
+
+    def gc(self):
+        """Delete the contents no bundle uses anymore
+
+        Returns the number of bytes freed.
+        """
+        freed = 0
+        try:
+            dir_names = os.listdir(self._path)
+        except OSError:
+            return freed
+
+        for dir_name in dir_names:
+            dir_path = os.path.join(self._path, dir_name)
+            try:
+                names = os.listdir(dir_path)
+            except OSError:
+                continue
+            for name in names:
+                object_path = os.path.join(dir_path, name)
+                try:
+                    object_stat = os.lstat(object_path)
+                    # Only linked from the store
+                    if object_stat.st_nlink == 1:
+                        os.remove(object_path)
+                        freed += object_stat.st_size
+                except OSError, e:
+                    logging.warning('Cannot delete %s: %s', object_path, e)
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                # Not empty
+                pass
+        return freed
+
+
+_store = None
+
+
+def get_store():
+    """Get the BundleStore of the profile"""
+    global _store
+
+    if _store is None:
+        _store = BundleStore()
+    return _store
@@ -0,0 +1,223 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Updates of the installed bundles from a local catalog
+
+A catalog lists the bundles available for installation, as a JSON array
+of objects (or a sequence of JSON objects, one per line):
+
+    [{"bundle_id": "org.laptop.Chat", "version": "80",
+      "url": "http://example.org/Chat-80.xo"}, ...]
+
+or as XML, with a bundle element per bundle anywhere in the document:
+
+    <catalog>
+      <bundle bundle_id="org.laptop.Chat" version="80"
+              url="http://example.org/Chat-80.xo"/>
+    </catalog>
+
+Catalogs are read as a stream, and only the newest version of each bundle
+is kept in memory.
+
+UNSTABLE.
+"""
+
+import codecs
+import logging
+from xml.etree import cElementTree
+import json
+
+from sugar3.bundle import bundleindex
+from sugar3.bundle.bundleversion import get_sort_key
+from sugar3.bundle.bundleversion import InvalidVersionError
+
+
+_READ_SIZE = 64 * 1024
+_JSON_SEPARATORS = ' \t\r\n[],'
+
+
+def _read_json_entries(f):
+    # Decodes characters split across chunks too
+    reader = codecs.getreader('utf-8')(f)
+    decoder = json.JSONDecoder()
+    buf = u''
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in _JSON_SEPARATORS:
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            buf = reader.read(_READ_SIZE)
+            pos = 0
+            eof = not buf
+            continue
+
+        try:
+            entry, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # The entry continues in the next chunk
+            if eof:
+                raise
+            chunk = reader.read(_READ_SIZE)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+
+        if isinstance(entry, dict):
+            yield entry
+
+
+def _read_xml_entries(f):
+    for event_, element in cElementTree.iterparse(f):
+        if element.tag == 'bundle':
+            yield element.attrib
+            element.clear()
+
+
+def read_catalog(f):
+    """Iterate over the entries of a catalog
+
+    Keyword arguments:
+    f -- the catalog, as a file object
+
+    Yields (bundle_id, version, url) tuples, skipping the incomplete
+    entries.
+    """
+    start = f.read(1)
+    while start.isspace():
+        start = f.read(1)
+    f.seek(-len(start), 1)
+
+    if start == '<':
+        entries = _read_xml_entries(f)
+    else:
+        entries = _read_json_entries(f)
+
+    for entry in entries:
+        try:
+            bundle_id = entry['bundle_id']
+            version = entry['version']
+            url = entry.get('url')
+        except KeyError:
+            logging.warning('Incomplete catalog entry %r', entry)
+            continue
+        if isinstance(bundle_id, unicode):
+            bundle_id = bundle_id.encode('utf-8')
+        if isinstance(version, unicode):
+            version = version.encode('utf-8')
+        elif not isinstance(version, str):
+            version = str(version)
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        yield bundle_id, version, url
+
+
+class BundleUpdate(object):
+    """An update available for an installed bundle"""
+
+    def __init__(self, bundle, version, url):
+        self.bundle = bundle
+        self.bundle_id = bundle.get_bundle_id()
+        self.version = version
+        self.url = url
+
+    def __repr__(self):
+        return '<BundleUpdate %s %s -> %s>' % (
+            self.bundle_id, self.bundle.get_activity_version(), self.version)
+
+
+class Catalog(object):
+    """The newest version of each bundle of a catalog
+
+    A catalog is parsed once, and can then resolve the updates of any
+    number of sets of installed bundles, for example those of every laptop
+    of a school.
+    """
+
+    def __init__(self, path, bundle_ids=None):
+        """
+        Keyword arguments:
+        path -- path of the catalog file
+        bundle_ids -- if not None, only keep the entries of these bundles
+        """
+        # bundle id -> (version sort key, version, url)
+        self._newest = {}
+        with open(path, 'rb') as f:
+            for bundle_id, version, url in read_catalog(f):
+                if bundle_ids is not None and bundle_id not in bundle_ids:
+                    continue
+                try:
+                    key = get_sort_key(version)
+                except InvalidVersionError:
+                    logging.warning('Invalid version %r of %s in the catalog',
+                                    version, bundle_id)
+                    continue
+
+                newest = self._newest.get(bundle_id)
+                if newest is None or key > newest[0]:
+                    self._newest[bundle_id] = (key, version, url)
+
+    def get_newest(self, bundle_id):
+        """Get the newest version of a bundle and its URL, or None if the
+        catalog does not have the bundle"""
+        newest = self._newest.get(bundle_id)
+        if newest is None:
+            return None
+        return newest[1:]
+
+    def get_updates(self, bundles):
+        """Get the updates of some installed bundles
+
+        Keyword arguments:
+        bundles -- the installed bundles, as ActivityBundle objects
+
+        Returns a list of BundleUpdate objects, sorted by bundle id.
+        """
+        updates = []
+        for bundle in bundles:
+            newest = self._newest.get(bundle.get_bundle_id())
+            if newest is None:
+                continue
+            try:
+                installed_key = get_sort_key(bundle.get_activity_version())
+            except InvalidVersionError:
+                continue
+            if newest[0] > installed_key:
+                updates.append(BundleUpdate(bundle, newest[1], newest[2]))
+
+        updates.sort(key=lambda update: update.bundle_id)
+        return updates
+
+
+def get_updates(catalog_path, bundles=None):
+    """Get the updates of the installed bundles available in a catalog
+
+    Keyword arguments:
+    catalog_path -- path of the catalog file
+    bundles -- the installed bundles, those of the user activities
+        directory by default
+
+    Returns a list of BundleUpdate objects, sorted by bundle id.
+    """
+    if bundles is None:
+        bundles = bundleindex.get_index().scan()
+
+    bundle_ids = set([bundle.get_bundle_id() for bundle in bundles])
+    return Catalog(catalog_path, bundle_ids).get_updates(bundles)
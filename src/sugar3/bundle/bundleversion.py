@@ -23,6 +23,12 @@
 import re
 
 
+# Number of version strings whose sort key is kept
+SORT_KEY_CACHE_SIZE = 65536
+
+_sort_keys = {}
+
+
 class InvalidVersionError(Exception):
     """The passed activity version can not be normalized."""
     pass
@@ -155,3 +161,27 @@ class NormalizedVersion(object):
 
     def __ge__(self, other):
         return self.__eq__(other) or self.__gt__(other)
+
+    def get_sort_key(self):
+        """Get a tuple ordered like this version"""
+        return tuple(self.parts)
+
+
+def get_sort_key(activity_version):
+    """Get a key ordering version strings like NormalizedVersion does
+
+    The keys are tuples, which are much cheaper to compare than
+    NormalizedVersion objects, and are cached by version string.
+
+    Keyword arguments:
+    activity_version -- The version string
+
+    Raises InvalidVersionError if the version is not valid.
+    """
+    key = _sort_keys.get(activity_version)
+    if key is None:
+        key = NormalizedVersion(activity_version).get_sort_key()
+        if len(_sort_keys) >= SORT_KEY_CACHE_SIZE:
+            _sort_keys.clear()
+        _sort_keys[activity_version] = key
+    return key
@@ -0,0 +1,275 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Incremental discovery of the bundles installed by the user
+
+UNSTABLE.
+"""
+
+import os
+import logging
+
+from gi.repository import GObject
+from gi.repository import GLib
+from gi.repository import Gio
+
+from sugar3 import env
+from sugar3.bundle import bundleindex
+from sugar3.bundle.contentbundle import ContentBundle
+from sugar3.bundle.bundle import MalformedBundleException
+
+
+# Milliseconds without changes to a bundle before it is read again
+DEBOUNCE_DELAY = 500
+
+_ACTIVITY_INFO_PATH = os.path.join('activity', 'activity.info')
+_LIBRARY_INFO_PATH = os.path.join('library', 'library.info')
+
+_WATCHED_EVENTS = [Gio.FileMonitorEvent.CREATED,
+                   Gio.FileMonitorEvent.DELETED,
+                   Gio.FileMonitorEvent.CHANGED,
+                   Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                   Gio.FileMonitorEvent.ATTRIBUTE_CHANGED]
+
+
+class BundleWatcher(GObject.GObject):
+    """Keeps the list of the activity and content bundles installed in the
+    user activities and library directories.
+
+    The directories are scanned once, through the bundle index, and then
+    watched with Gio.FileMonitor. Changes to a bundle are only processed
+    once no more changes happened to it for DEBOUNCE_DELAY milliseconds, so
+    an installation in progress produces a single event.
+
+    'bundle-added', 'bundle-updated' and 'bundle-removed' are emitted with
+    the ActivityBundle or ContentBundle; for removals, the last one read.
+    'bundle-updated' is only emitted when the version of the bundle, or the
+    modification time of its directory or info file, changed.
+    """
+    __gsignals__ = {
+        'bundle-added': (GObject.SignalFlags.RUN_FIRST, None, ([object])),
+        'bundle-updated': (GObject.SignalFlags.RUN_FIRST, None, ([object])),
+        'bundle-removed': (GObject.SignalFlags.RUN_FIRST, None, ([object])),
+    }
+
+    def __init__(self, activities_path=None, library_path=None):
+        GObject.GObject.__init__(self)
+
+        if activities_path is None:
+            activities_path = env.get_user_activities_path()
+        if library_path is None:
+            library_path = env.get_user_library_path()
+        self._activities_path = os.path.normpath(activities_path)
+        self._library_path = os.path.normpath(library_path)
+
+        self._index = bundleindex.get_index()
+        # path -> bundle
+        self._bundles = {}
+        # path -> what tells whether the bundle was updated, see _get_stamp
+        self._stamps = {}
+        # path -> Gio.FileMonitor of the info file of the bundle
+        self._bundle_monitors = {}
+        self._directory_monitors = []
+        self._pending_paths = set()
+        self._flush_sid = None
+        self._started = False
+
+    def start(self):
+        """Scan the directories and start watching them"""
+        if self._started:
+            return
+        self._started = True
+
+        for directory in [self._activities_path, self._library_path]:
+            monitor = self._monitor(directory, directory=True)
+            if monitor is not None:
+                self._directory_monitors.append(monitor)
+
+        for bundle in self._index.scan([self._activities_path]):
+            self._add_bundle(bundle)
+
+        for path in self._list_directory(self._library_path):
+            bundle = self._read_content_bundle(path)
+            if bundle is not None:
+                self._add_bundle(bundle)
+
+    def stop(self):
+        if self._flush_sid is not None:
+            GObject.source_remove(self._flush_sid)
+            self._flush_sid = None
+        for monitor in self._directory_monitors:
+            monitor.cancel()
+        self._directory_monitors = []
+        for path in self._bundle_monitors.keys():
+            self._unmonitor_bundle(path)
+        self._started = False
+
+    def get_bundles(self):
+        """Get the bundles currently installed"""
+        return self._bundles.values()
+
+    def get_bundle(self, path):
+        return self._bundles.get(os.path.normpath(path))
+
+    def _list_directory(self, directory):
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            return []
+        return [os.path.join(directory, name) for name in names
+                if not name.startswith('.')]
+
+    def _monitor(self, path, directory=False):
+        gio_file = Gio.File.new_for_path(path)
+        try:
+            if directory:
+                monitor = gio_file.monitor_directory(
+                    Gio.FileMonitorFlags.NONE, None)
+            else:
+                monitor = gio_file.monitor_file(
+                    Gio.FileMonitorFlags.NONE, None)
+        except GLib.GError:
+            logging.exception('Cannot monitor %s', path)
+            return None
+        monitor.connect('changed', self.__changed_cb)
+        return monitor
+
+    def _get_info_path(self, path):
+        if os.path.dirname(path) == self._activities_path:
+            return os.path.join(path, _ACTIVITY_INFO_PATH)
+        else:
+            return os.path.join(path, _LIBRARY_INFO_PATH)
+
+    def _get_stamp(self, bundle):
+        path = os.path.normpath(bundle.get_path())
+        mtimes = []
+        for stat_path in [path, self._get_info_path(path)]:
+            try:
+                mtimes.append(os.stat(stat_path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return bundle.get_activity_version(), mtimes
+
+    def _monitor_bundle(self, bundle):
+        # The directories only report their own entries, so the info file
+        # of each bundle is watched too, to notice updates in place
+        path = bundle.get_path()
+        monitor = self._monitor(self._get_info_path(path))
+        if monitor is not None:
+            self._bundle_monitors[path] = monitor
+
+    def _unmonitor_bundle(self, path):
+        monitor = self._bundle_monitors.pop(path, None)
+        if monitor is not None:
+            monitor.cancel()
+
+    def _add_bundle(self, bundle):
+        path = os.path.normpath(bundle.get_path())
+        self._bundles[path] = bundle
+        self._stamps[path] = self._get_stamp(bundle)
+        if path not in self._bundle_monitors:
+            self._monitor_bundle(bundle)
+
+    def _get_bundle_path(self, changed_path):
+        """Get the path of the bundle a changed file belongs to"""
+        for directory in [self._activities_path, self._library_path]:
+            if changed_path.startswith(directory + os.sep):
+                relative_path = changed_path[len(directory) + 1:]
+                return os.path.join(directory, relative_path.split(os.sep)[0])
+        return None
+
+    def __changed_cb(self, monitor, changed_file, other_file, event_type):
+        if event_type not in _WATCHED_EVENTS:
+            return
+        path = self._get_bundle_path(changed_file.get_path())
+        if path is None or os.path.basename(path).startswith('.'):
+            return
+
+        self._pending_paths.add(path)
+        if self._flush_sid is not None:
+            GObject.source_remove(self._flush_sid)
+        self._flush_sid = GObject.timeout_add(DEBOUNCE_DELAY,
+                                              self.__flush_cb)
+
+    def _read_content_bundle(self, path):
+        if not os.path.exists(os.path.join(path, _LIBRARY_INFO_PATH)):
+            return None
+        try:
+            return ContentBundle(path)
+        except MalformedBundleException, e:
+            logging.warning('Invalid content bundle %s: %s', path, e)
+            return None
+
+    def __flush_cb(self):
+        self._flush_sid = None
+        pending_paths = sorted(self._pending_paths)
+        self._pending_paths = set()
+
+        activity_paths = [path for path in pending_paths
+                          if os.path.dirname(path) == self._activities_path]
+        bundles = {}
+        for bundle in self._index.get_bundles(activity_paths):
+            bundles[os.path.normpath(bundle.get_path())] = bundle
+        for path in activity_paths:
+            if path not in bundles:
+                self._index.remove(path)
+        self._index.save()
+
+        for path in pending_paths:
+            if path not in activity_paths:
+                bundle = self._read_content_bundle(path)
+                if bundle is not None:
+                    bundles[path] = bundle
+
+        for path in pending_paths:
+            old_bundle = self._bundles.get(path)
+            bundle = bundles.get(path)
+            if bundle is None:
+                if old_bundle is not None:
+                    del self._bundles[path]
+                    del self._stamps[path]
+                    self._unmonitor_bundle(path)
+                    self.emit('bundle-removed', old_bundle)
+                continue
+
+            if old_bundle is not None and \
+                    self._get_stamp(bundle) == self._stamps[path]:
+                # Only touched, e.g. by a change of permissions
+                continue
+
+            # The info file may have been replaced, dropping its watch
+            self._unmonitor_bundle(path)
+            self._add_bundle(bundle)
+            if old_bundle is None:
+                self.emit('bundle-added', bundle)
+            else:
+                self.emit('bundle-updated', bundle)
+
+        return False
+
+
+_watcher = None
+
+
+def get_watcher():
+    """Get the BundleWatcher of the user directories, started"""
+    global _watcher
+
+    if _watcher is None:
+        _watcher = BundleWatcher()
+        _watcher.start()
+    return _watcher
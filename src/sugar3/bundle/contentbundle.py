@@ -22,7 +22,6 @@ UNSTABLE.
 """
 
 from ConfigParser import ConfigParser
-import tempfile
 import os
 import urllib
 
@@ -60,7 +59,7 @@ class ContentBundle(Bundle):
             raise MalformedBundleException('No library.info file')
         self._parse_info(info_file)
 
-        if self.get_file(self._activity_start) is None:
+        if not self.is_file(self._activity_start):
             raise MalformedBundleException(
                 'Content bundle %s does not have start page %s' %
                 (self._path, self._activity_start))
@@ -120,25 +119,24 @@ class ContentBundle(Bundle):
     def get_activity_start(self):
         return self._activity_start
 
-    def get_icon(self):
+    def _get_icon_file_name(self):
         if not self._icon:
             return None
 
         icon_path = os.path.join('library', self._icon)
-        ext = os.path.splitext(icon_path)[1]
-        if ext == '':
-            ext = '.svg'
-            icon_path += ext
+        if os.path.splitext(icon_path)[1] == '':
+            icon_path += '.svg'
+        return icon_path
+
+    def get_icon(self):
+        icon_path = self._get_icon_file_name()
+        if icon_path is None:
+            return None
 
         if self._zip_file is None:
             return os.path.join(self._path, icon_path)
         else:
-            icon_data = self.get_file(icon_path).read()
-            temp_file, temp_file_path = tempfile.mkstemp(prefix=self._icon,
-                                                         suffix=ext)
-            os.write(temp_file, icon_data)
-            os.close(temp_file)
-            return temp_file_path
+            return self.get_real_path(icon_path)
 
     def get_start_uri(self):
         path = os.path.join(self.get_path(), self._activity_start)
@@ -153,9 +151,9 @@ class ContentBundle(Bundle):
     def get_tags(self):
         return None
 
-    def install(self):
+    def install(self, progress_cb=None):
         install_path = env.get_user_library_path()
-        self._unzip(install_path)
+        self._unzip(install_path, progress_cb)
         return os.path.join(install_path, self._zip_root_dir)
 
     def uninstall(self, force=False, delete_profile=False):
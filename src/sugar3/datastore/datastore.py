@@ -20,11 +20,21 @@
 STABLE
 """
 
+import base64
+import errno
+import fcntl
+import json
 import logging
+import shutil
 import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
 import os
 import tempfile
+import threading
+from xml.etree import ElementTree
 from gi.repository import GObject
 from gi.repository import Gio
 import dbus
@@ -32,11 +42,73 @@ import dbus
 from sugar3 import env
 from sugar3 import mime
 from sugar3 import dispatch
+from sugar3.util import LRU
+from sugar3.datastore import localstore
 
 DS_DBUS_SERVICE = 'org.laptop.sugar.DataStore'
 DS_DBUS_INTERFACE = 'org.laptop.sugar.DataStore'
 DS_DBUS_PATH = '/org/laptop/sugar/DataStore'
 
+# Number of asynchronous calls the batch functions keep in flight
+DEFAULT_BATCH_WINDOW = 8
+
+# Upper bound, in bytes, of the lazily loaded property values kept around
+LAZY_PROPERTIES_CACHE_SIZE = 512 * 1024
+
+_lazy_properties = ['preview']
+
+# Keys fetched by get(), get_many() and for the Created/Updated signals,
+# except the lazy ones; the other keys are only fetched before a write
+STANDARD_PROPERTIES = ['uid', 'activity', 'activity_id', 'buddies',
+                       'creation_time', 'ctime', 'description', 'filesize',
+                       'icon-color', 'keep', 'launch-times', 'mime_type',
+                       'mountpoint', 'mtime', 'preview', 'share-scope',
+                       'tags', 'timestamp', 'title', 'title_set_by_user']
+
+# Size of the chunks used when a file descriptor has to be copied to disk
+_FD_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Number of RawObject metadata entries reported at once by the scanner
+RAW_SCAN_PAGE_SIZE = 256
+
+# Number of content types of scanned files kept around, keyed by (device,
+# inode, mtime), so that volumes that are browsed again are not guessed
+# twice
+RAW_CONTENT_TYPES_CACHE_SIZE = 4096
+
+_raw_content_types = LRU(RAW_CONTENT_TYPES_CACHE_SIZE)
+_raw_content_types_lock = threading.Lock()
+
+_user_settings = None
+
+# Size of the reads and writes of copy jobs
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Minimum time, in seconds, between two 'progress' emissions of a copy job
+COPY_PROGRESS_INTERVAL = 0.25
+
+# Number of copy jobs that run at the same time
+MAX_CONCURRENT_COPIES = 2
+
+# ioctl cloning a file on filesystems that support reflinks (btrfs, xfs)
+_FICLONE = 0x40049409
+
+_METADATA_DIR_NAME = '.Sugar-Metadata'
+
+# Number of times a queued write is retried before it is left on disk for
+# the next process to pick up, and the initial delay between retries
+WRITE_BEHIND_RETRIES = 4
+WRITE_BEHIND_RETRY_DELAY = 1000
+
+_WRITE_QUEUE_DIR_NAME = 'datastore-queue'
+
+_FD_METHODS = ['get_file_descriptor', 'create_from_file_descriptor',
+               'update_from_file_descriptor']
+
+# Whether the service implements the file descriptor methods, None until
+# the first call tells us
+_fd_passing_supported = None
+
 _data_store = None
 
 
@@ -44,10 +116,15 @@ def _get_data_store():
     global _data_store
 
     if not _data_store:
-        _bus = dbus.SessionBus()
-        _data_store = dbus.Interface(_bus.get_object(DS_DBUS_SERVICE,
-                                                     DS_DBUS_PATH),
-                                     DS_DBUS_INTERFACE)
+        local_path = os.environ.get('SUGAR_LOCAL_DATASTORE')
+        if local_path:
+            logging.debug('Using the local datastore in %s', local_path)
+            _data_store = localstore.LocalDataStore(local_path)
+        else:
+            _bus = dbus.SessionBus()
+            _data_store = dbus.Interface(_bus.get_object(DS_DBUS_SERVICE,
+                                                         DS_DBUS_PATH),
+                                         DS_DBUS_INTERFACE)
         _data_store.connect_to_signal('Created', __datastore_created_cb)
         _data_store.connect_to_signal('Deleted', __datastore_deleted_cb)
         _data_store.connect_to_signal('Updated', __datastore_updated_cb)
@@ -56,16 +133,18 @@ def _get_data_store():
 
 
 def __datastore_created_cb(object_id):
-    metadata = _get_data_store().get_properties(object_id, byte_arrays=True)
+    metadata = _get_light_properties(object_id)
     updated.send(None, object_id=object_id, metadata=metadata)
 
 
 def __datastore_updated_cb(object_id):
-    metadata = _get_data_store().get_properties(object_id, byte_arrays=True)
+    _lazy_cache.invalidate(object_id)
+    metadata = _get_light_properties(object_id)
     updated.send(None, object_id=object_id, metadata=metadata)
 
 
 def __datastore_deleted_cb(object_id):
+    _lazy_cache.invalidate(object_id)
     deleted.send(None, object_id=object_id)
 
 created = dispatch.Signal()
@@ -75,18 +154,178 @@ updated = dispatch.Signal()
 _get_data_store()
 
 
+def get_lazy_properties():
+    """Return the list of metadata keys that get(), get_many() and the
+    Created/Updated signals leave out, and that the metadata they return
+    fetches on first access.
+
+    """
+    return list(_lazy_properties)
+
+
+def set_lazy_properties(keys):
+    """Set the metadata keys that get(), get_many() and the Created/Updated
+    signals leave out, and that the metadata they return fetches on first
+    access.
+
+    Keyword arguments:
+    keys -- list of keys, by default only 'preview'
+
+    """
+    global _lazy_properties
+    _lazy_properties = list(keys)
+    _lazy_cache.clear()
+
+
+def _get_light_keys():
+    return [key for key in STANDARD_PROPERTIES if key not in _lazy_properties]
+
+
+def _find_entry(object_id, entries):
+    if not entries:
+        raise dbus.DBusException('No entry %s in the datastore' % object_id)
+    return entries[0]
+
+
+def _get_light_properties(object_id, keys=None):
+    """Get the STANDARD_PROPERTIES of an entry but the lazy ones, or only
+    the keys given"""
+    if keys is None:
+        keys = _get_light_keys()
+    entries, count_ = _get_data_store().find({'uid': object_id}, keys,
+                                             byte_arrays=True)
+    return _find_entry(object_id, entries)
+
+
+class _LazyPropertiesCache(object):
+    """Least recently used cache of lazily loaded property values, bounded
+    by the total size in bytes of the values it holds.
+    """
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._size = 0
+        self._entries = OrderedDict()
+
+    def get(self, object_id, key):
+        cache_key = (object_id, key)
+        if cache_key not in self._entries:
+            raise KeyError(cache_key)
+        value = self._entries.pop(cache_key)
+        self._entries[cache_key] = value
+        return value
+
+    def put(self, object_id, key, value):
+        cache_key = (object_id, key)
+        if cache_key in self._entries:
+            self._size -= self._get_value_size(self._entries.pop(cache_key))
+
+        value_size = self._get_value_size(value)
+        if value_size > self._max_size:
+            return
+
+        self._entries[cache_key] = value
+        self._size += value_size
+        while self._size > self._max_size:
+            old_key_, old_value = self._entries.popitem(last=False)
+            self._size -= self._get_value_size(old_value)
+
+    def invalidate(self, object_id):
+        for cache_key in self._entries.keys():
+            if cache_key[0] == object_id:
+                self._size -= self._get_value_size(
+                    self._entries.pop(cache_key))
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def _get_value_size(self, value):
+        if value is None:
+            return 0
+        try:
+            return len(value)
+        except TypeError:
+            return 0
+
+
+_lazy_cache = _LazyPropertiesCache(LAZY_PROPERTIES_CACHE_SIZE)
+
+
+def _fetch_lazy_property(object_id, key):
+    try:
+        return _lazy_cache.get(object_id, key)
+    except KeyError:
+        pass
+
+    entries, count_ = _get_data_store().find({'uid': object_id}, [key],
+                                             byte_arrays=True)
+    value = None
+    if entries:
+        value = entries[0].get(key, None)
+    _lazy_cache.put(object_id, key, value)
+    return value
+
+
+def _intern_key(key):
+    # Every entry repeats the same few keys: the metadata of a whole
+    # listing share a single copy of each of them
+    if isinstance(key, unicode):
+        try:
+            key = key.encode('ascii')
+        except UnicodeEncodeError:
+            return key
+    if isinstance(key, str):
+        return intern(str(key))
+    return key
+
+
 class DSMetadata(GObject.GObject):
-    """A representation of the metadata associated with a DS entry."""
+    """A representation of the metadata associated with a DS entry.
+
+    When created with an object_id and lazy_keys, by get(), get_many()
+    and DSObject, the properties only hold some of the keys of the entry.
+    The lazy keys are fetched from the datastore the first time they are
+    accessed, 'in' included, and the entry is reported as not having them
+    if it does not. The other keys of the entry are fetched once, before
+    the metadata is first written back, so that the service does not
+    delete them.
+
+    Changes made through update() or inside a batch() block are notified
+    once, with 'updated' and with 'properties-updated', which receives the
+    set of keys that changed.
+
+    The keys are stored as interned strings, shared by the metadata of all
+    the entries.
+    """
     __gsignals__ = {
         'updated': (GObject.SignalFlags.RUN_FIRST, None, ([])),
+        'properties-updated': (GObject.SignalFlags.RUN_FIRST, None,
+                               ([object])),
     }
 
-    def __init__(self, properties=None):
+    def __init__(self, properties=None, object_id=None, lazy_keys=None):
         GObject.GObject.__init__(self)
         if not properties:
             self._properties = {}
         else:
             self._properties = properties
+            for key in self._properties.keys():
+                compact_key = _intern_key(key)
+                if compact_key is not key:
+                    self._properties[compact_key] = \
+                        self._properties.pop(key)
+
+        self._object_id = object_id
+        self._lazy_keys = set()
+        # Whether keys of the entry were not fetched
+        self._partial = object_id is not None and lazy_keys is not None
+        self._deleted_keys = set()
+        if self._partial:
+            self._lazy_keys = set(lazy_keys) - set(self._properties)
+
+        self._batch_depth = 0
+        self._changed_keys = set()
 
         default_keys = ['activity', 'activity_id',
                         'mime_type', 'title_set_by_user']
@@ -94,43 +333,142 @@ class DSMetadata(GObject.GObject):
             if key not in self._properties:
                 self._properties[key] = ''
 
+    def _is_partial(self):
+        return self._partial
+
+    def _reload(self, properties, lazy_keys):
+        # The entry was updated, the lazy keys have to be fetched again
+        with self.batch():
+            for key in lazy_keys:
+                if key in self._properties and key not in properties:
+                    del self._properties[key]
+            self._lazy_keys = set(lazy_keys) - set(properties)
+            self._partial = True
+            self.update(properties)
+
+    def _load_missing_properties(self):
+        if not self._partial:
+            return
+        properties = _get_data_store().get_properties(self._object_id,
+                                                      byte_arrays=True)
+        for key, value in properties.iteritems():
+            key = _intern_key(key)
+            # Changes made here take precedence
+            if key not in self._properties and \
+                    key not in self._deleted_keys:
+                self._properties[key] = value
+        self._lazy_keys = set()
+        self._deleted_keys = set()
+        self._partial = False
+
+    def _get_lazy_value(self, key):
+        value = _fetch_lazy_property(self._object_id, key)
+        if value is None:
+            # The entry does not have this property at all
+            self._lazy_keys.discard(key)
+        return value
+
+    def _load_cached_lazy_properties(self):
+        for key in list(self._lazy_keys):
+            try:
+                value = _lazy_cache.get(self._object_id, key)
+            except KeyError:
+                continue
+            if value is not None:
+                self._properties[key] = value
+            self._lazy_keys.discard(key)
+
     def __getitem__(self, key):
+        if key in self._lazy_keys:
+            value = self._get_lazy_value(key)
+            if value is not None:
+                return value
         return self._properties[key]
 
     def __setitem__(self, key, value):
+        key = _intern_key(key)
+        self._lazy_keys.discard(key)
         if key not in self._properties or self._properties[key] != value:
             self._properties[key] = value
-            self.emit('updated')
+            self._changed_keys.add(key)
+            if self._batch_depth == 0:
+                self._emit_updated()
+
+    def _emit_updated(self):
+        if not self._changed_keys:
+            return
+        changed_keys = self._changed_keys
+        self._changed_keys = set()
+        self.emit('updated')
+        self.emit('properties-updated', changed_keys)
+
+    @contextmanager
+    def batch(self):
+        """Group several changes so that they are notified only once, when
+        the outermost batch() block exits.
+
+        with metadata.batch():
+            metadata['title'] = title
+            metadata['title_set_by_user'] = '1'
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._emit_updated()
 
     def __delitem__(self, key):
+        if self._partial:
+            self._deleted_keys.add(_intern_key(key))
+        if key in self._lazy_keys:
+            self._lazy_keys.discard(key)
+            if key not in self._properties:
+                return
         del self._properties[key]
 
     def __contains__(self, key):
+        if key in self._lazy_keys:
+            return self._get_lazy_value(key) is not None
         return self._properties.__contains__(key)
 
     def has_key(self, key):
         logging.warning(".has_key() is deprecated, use 'in'")
-        return key in self._properties
+        return key in self
 
     def keys(self):
-        return self._properties.keys()
+        return self._properties.keys() + \
+            [key for key in list(self._lazy_keys) if key in self and
+             key not in self._properties]
 
     def get_dictionary(self):
+        """Return the dictionary of the properties held. The lazily loaded
+        keys are only included once fetched; nothing is fetched from
+        here."""
+        self._load_cached_lazy_properties()
         return self._properties
 
+    def get_complete_dictionary(self):
+        """Return the dictionary of all the properties of the entry,
+        fetching those that were left out, as needed to write it back."""
+        self._load_missing_properties()
+        return self.get_dictionary()
+
     def copy(self):
-        return DSMetadata(self._properties.copy())
+        return DSMetadata(self.get_complete_dictionary().copy())
 
     def get(self, key, default=None):
-        if key in self._properties:
-            return self._properties[key]
-        else:
+        try:
+            return self[key]
+        except KeyError:
             return default
 
     def update(self, properties):
-        """Update all of the metadata"""
-        for (key, value) in properties.items():
-            self[key] = value
+        """Update all of the metadata, notifying the changes once"""
+        with self.batch():
+            for (key, value) in properties.items():
+                self[key] = value
 
 
 class DSObject(object):
@@ -162,14 +500,20 @@ class DSObject(object):
     object_id = property(get_object_id, set_object_id)
 
     def __object_updated_cb(self, object_id):
-        properties = _get_data_store().get_properties(self._object_id,
-                                                      byte_arrays=True)
-        self._metadata.update(properties)
+        _lazy_cache.invalidate(self._object_id)
+        if self._metadata._is_partial():
+            properties = _get_light_properties(self._object_id)
+            self._metadata._reload(properties, _lazy_properties)
+        else:
+            properties = _get_data_store().get_properties(self._object_id,
+                                                          byte_arrays=True)
+            self._metadata.update(properties)
 
     def get_metadata(self):
         if self._metadata is None and not self.object_id is None:
-            properties = _get_data_store().get_properties(self.object_id)
-            metadata = DSMetadata(properties)
+            properties = _get_light_properties(self.object_id)
+            metadata = DSMetadata(properties, self.object_id,
+                                  _lazy_properties)
             self._metadata = metadata
         return self._metadata
 
@@ -195,6 +539,19 @@ class DSObject(object):
 
     file_path = property(get_file_path, set_file_path)
 
+    def get_file_descriptor(self):
+        """Return a new read-only file descriptor on the entry content.
+        The caller is responsible for closing it.
+
+        See open_file(): with the current DataStore service the content is
+        still copied out of the datastore, as with get_file_path().
+        """
+        if self._file_path:
+            return os.open(self._file_path, os.O_RDONLY)
+        if self.object_id is None:
+            return None
+        return open_file(self.object_id)
+
     def destroy(self):
         if self._destroyed:
             logging.warning('This DSObject has already been destroyed!.')
@@ -216,25 +573,42 @@ class DSObject(object):
         return DSObject(None, self._metadata.copy(), self._file_path)
 
 
+def _get_icon_color():
+    global _user_settings
+
+    if _user_settings is None:
+        _user_settings = Gio.Settings('org.sugarlabs.user')
+    return _user_settings.get_string('color')
+
+
+def _get_raw_metadata(file_path, stat, mime_type, icon_color):
+    return {
+        'uid': file_path,
+        'title': os.path.basename(file_path),
+        'timestamp': stat.st_mtime,
+        'mime_type': mime_type,
+        'activity': '',
+        'activity_id': '',
+        'icon-color': icon_color,
+        'description': file_path,
+    }
+
+
 class RawObject(object):
     """A representation for objects not in the DS but
     in the file system.
 
+    metadata can be given to avoid looking it up, as reported by
+    RawObjectScanner.
+
     """
 
-    def __init__(self, file_path):
-        stat = os.stat(file_path)
-        settings = Gio.Settings('org.sugarlabs.user')
-        metadata = {
-            'uid': file_path,
-            'title': os.path.basename(file_path),
-            'timestamp': stat.st_mtime,
-            'mime_type': Gio.content_type_guess(file_path, None)[0],
-            'activity': '',
-            'activity_id': '',
-            'icon-color': settings.get_string('color'),
-            'description': file_path,
-        }
+    def __init__(self, file_path, metadata=None):
+        if metadata is None:
+            metadata = _get_raw_metadata(
+                file_path, os.stat(file_path),
+                Gio.content_type_guess(file_path, None)[0],
+                _get_icon_color())
 
         self.object_id = file_path
         self._metadata = DSMetadata(metadata)
@@ -278,11 +652,109 @@ class RawObject(object):
             self.destroy()
 
 
-def get(object_id):
+class RawObjectScanner(GObject.GObject):
+    """Walk a directory tree, usually a mount point, in a worker thread
+    and report the metadata of the RawObjects for the files found.
+
+    Metadata is emitted in lists of up to page_size entries through the
+    'page-ready' signal, in the main loop; 'finished' is emitted once the
+    walk is done or has been cancelled. Each entry can be handed to
+    RawObject(entry['uid'], entry) without touching the file again.
+
+    """
+    __gsignals__ = {
+        'page-ready': (GObject.SignalFlags.RUN_FIRST, None, ([object])),
+        'finished': (GObject.SignalFlags.RUN_FIRST, None, ([])),
+    }
+
+    def __init__(self, path, page_size=RAW_SCAN_PAGE_SIZE):
+        GObject.GObject.__init__(self)
+        self._path = path
+        self._page_size = page_size
+        self._cancelled = False
+        self._thread = None
+
+    def start(self):
+        # Gio.Settings has to be used from the main thread
+        icon_color = _get_icon_color()
+        GObject.threads_init()
+        self._thread = threading.Thread(target=self._scan,
+                                        args=(icon_color,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _guess_content_type(self, file_path, stat, guesses):
+        cache_key = (stat.st_dev, stat.st_ino, stat.st_mtime)
+        with _raw_content_types_lock:
+            if cache_key in _raw_content_types:
+                return _raw_content_types[cache_key]
+
+        # The guess only depends on the name, so files sharing a simple
+        # extension can share it
+        file_name = os.path.basename(file_path)
+        guess_key = None
+        if file_name.count('.') == 1 and not file_name.startswith('.'):
+            guess_key = os.path.splitext(file_name)[1]
+        if guess_key is not None and guess_key in guesses:
+            content_type = guesses[guess_key]
+        else:
+            content_type = Gio.content_type_guess(file_name, None)[0]
+            if guess_key is not None:
+                guesses[guess_key] = content_type
+
+        with _raw_content_types_lock:
+            _raw_content_types[cache_key] = content_type
+        return content_type
+
+    def _scan(self, icon_color):
+        guesses = {}
+        page = []
+        try:
+            for root, dirs_, files in os.walk(self._path):
+                for file_name in files:
+                    if self._cancelled:
+                        return
+                    file_path = os.path.join(root, file_name)
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        logging.debug('Could not stat %s', file_path)
+                        continue
+                    content_type = self._guess_content_type(file_path, stat,
+                                                            guesses)
+                    page.append(_get_raw_metadata(file_path, stat,
+                                                  content_type, icon_color))
+                    if len(page) >= self._page_size:
+                        GObject.idle_add(self.__page_ready_cb, page)
+                        page = []
+            if page:
+                GObject.idle_add(self.__page_ready_cb, page)
+        finally:
+            GObject.idle_add(self.__finished_cb)
+
+    def __page_ready_cb(self, page):
+        if not self._cancelled:
+            self.emit('page-ready', page)
+        return False
+
+    def __finished_cb(self):
+        self.emit('finished')
+        return False
+
+
+def get(object_id, properties=None):
     """Get the properties of the object with the ID given.
 
+    Only the STANDARD_PROPERTIES are fetched, except the lazy ones, such
+    as the preview, that are fetched on first access. The other keys of
+    the entry are fetched before the object is first written back.
+
     Keyword arguments:
     object_id -- unique identifier of the object
+    properties -- list of the keys to fetch instead (default None)
 
     Return: a DSObject
 
@@ -292,13 +764,97 @@ def get(object_id):
     if object_id.startswith('/'):
         return RawObject(object_id)
 
-    metadata = _get_data_store().get_properties(object_id, byte_arrays=True)
+    if properties is None:
+        lazy_keys = _lazy_properties
+    else:
+        lazy_keys = []
+    metadata = _get_light_properties(object_id, properties)
 
-    ds_object = DSObject(object_id, DSMetadata(metadata), None)
+    ds_object = DSObject(object_id,
+                         DSMetadata(metadata, object_id, lazy_keys), None)
     # TODO: register the object for updates
     return ds_object
 
 
+def _supports_fd_passing():
+    """Whether the service implements the file descriptor methods, found
+    out by introspecting it on first use."""
+    global _fd_passing_supported
+
+    if _fd_passing_supported is None:
+        _fd_passing_supported = False
+        if hasattr(dbus.types, 'UnixFd') and \
+                not isinstance(_get_data_store(), localstore.LocalDataStore):
+            try:
+                bus = dbus.SessionBus()
+                xml_data = bus.get_object(DS_DBUS_SERVICE, DS_DBUS_PATH).\
+                    Introspect(dbus_interface=dbus.INTROSPECTABLE_IFACE)
+                root = ElementTree.fromstring(xml_data)
+            except (dbus.DBusException, ElementTree.ParseError), e:
+                logging.warning('Cannot introspect the DataStore: %s', e)
+                root = ElementTree.Element('node')
+            for interface in root.findall('interface'):
+                if interface.get('name') != DS_DBUS_INTERFACE:
+                    continue
+                methods = [method.get('name')
+                           for method in interface.findall('method')]
+                _fd_passing_supported = set(_FD_METHODS) <= set(methods)
+        logging.debug('DataStore file descriptor passing supported: %s',
+                      _fd_passing_supported)
+
+    return _fd_passing_supported
+
+
+def open_file(object_id):
+    """Open the file of a datastore entry for reading.
+
+    The service hands over a read-only file descriptor when it implements
+    get_file_descriptor. The current DataStore service does not, and then
+    the content is copied by get_filename, just like get_file_path() does;
+    the copy is unlinked once opened, so that nothing is left behind when
+    the descriptor is closed, but it is not avoided.
+
+    Keyword arguments:
+    object_id -- unique identifier of the object
+
+    Return: a file descriptor, to be closed by the caller, or None if the
+    entry has no file
+
+    """
+    logging.debug('datastore.open_file')
+
+    if _supports_fd_passing():
+        return _get_data_store().get_file_descriptor(object_id).take()
+
+    file_path = _get_data_store().get_filename(object_id)
+    if not file_path:
+        return None
+    try:
+        return os.open(file_path, os.O_RDONLY)
+    finally:
+        os.remove(file_path)
+
+
+def _copy_fd_to_temp_file(fd):
+    data_path = os.path.join(env.get_profile_path(), 'data')
+    if not os.path.exists(data_path):
+        os.makedirs(data_path)
+
+    temp_fd, temp_path = tempfile.mkstemp(prefix='fdcopy', dir=data_path)
+    try:
+        while True:
+            data = os.read(fd, _FD_COPY_CHUNK_SIZE)
+            if not data:
+                break
+            os.write(temp_fd, data)
+    except OSError:
+        os.close(temp_fd)
+        os.remove(temp_path)
+        raise
+    os.close(temp_fd)
+    return temp_path
+
+
 def create():
     """Create a new DSObject.
 
@@ -335,6 +891,132 @@ def _create_ds_entry(properties, filename, transfer_ownership=False):
     return object_id
 
 
+def _get_write_arguments(ds_object, update_mtime):
+    properties = ds_object.metadata.get_complete_dictionary().copy()
+
+    if update_mtime:
+        properties['mtime'] = datetime.now().isoformat()
+        properties['timestamp'] = int(time.time())
+
+    file_path = ds_object.get_file_path(fetch=False)
+    if file_path is None:
+        file_path = ''
+
+    return properties, file_path
+
+
+class _CallPipeline(object):
+    """Issue asynchronous datastore calls for a list of items, keeping at
+    most window of them in flight, and collect the replies in order.
+
+    issue_cb is called as issue_cb(item, reply_handler, error_handler) and
+    must start one asynchronous D-Bus call; an exception it raises is
+    reported as the error of the item. finished_cb is called once with
+    the list of results (one per item, None for failed items) and the list
+    of (item, exception) errors.
+    """
+
+    def __init__(self, items, issue_cb, finished_cb,
+                 window=DEFAULT_BATCH_WINDOW):
+        self._items = list(items)
+        self._issue_cb = issue_cb
+        self._finished_cb = finished_cb
+        self._window = max(1, window)
+        self._next = 0
+        self._pending = 0
+        self._results = [None] * len(self._items)
+        self._errors = []
+        self._completed = [False] * len(self._items)
+        self._filling = False
+        self.finished = False
+
+    def start(self):
+        self._fill()
+
+    def _fill(self):
+        # Replies may arrive synchronously from within issue_cb, the outer
+        # loop will pick up the freed slot in that case
+        if self._filling:
+            return
+        self._filling = True
+        try:
+            while self._pending < self._window and \
+                    self._next < len(self._items):
+                index = self._next
+                self._next += 1
+                self._pending += 1
+                try:
+                    self._issue_cb(self._items[index],
+                                   partial(self.__reply_cb, index),
+                                   partial(self.__error_cb, index))
+                except Exception, e:
+                    self.__error_cb(index, e)
+        finally:
+            self._filling = False
+
+        if self._pending == 0 and self._next == len(self._items) and \
+                not self.finished:
+            self.finished = True
+            self._finished_cb(self._results, self._errors)
+
+    def _complete(self, index):
+        # An item whose call raised after calling one of its handlers
+        # must only be counted once
+        if self._completed[index]:
+            return False
+        self._completed[index] = True
+        self._pending -= 1
+        return True
+
+    def __reply_cb(self, index, *args):
+        if not self._complete(index):
+            return
+        if len(args) == 1:
+            self._results[index] = args[0]
+        elif args:
+            self._results[index] = args
+        self._fill()
+
+    def __error_cb(self, index, error):
+        if not self._complete(index):
+            return
+        logging.error('datastore batch call failed for %r: %s',
+                      self._items[index], error)
+        self._errors.append((self._items[index], error))
+        self._fill()
+
+
+def _run_pipeline(items, issue_cb, window, reply_handler, convert_cb=None):
+    """Run a _CallPipeline either asynchronously, reporting to
+    reply_handler, or synchronously by iterating a main loop until every
+    call has completed.
+    """
+    outcome = []
+    main_loop = []
+
+    def finished_cb(results, errors):
+        if convert_cb is not None:
+            results = convert_cb(results)
+        if reply_handler is not None:
+            reply_handler(results, errors)
+            return
+        outcome.extend([results, errors])
+        if main_loop:
+            main_loop[0].quit()
+
+    pipeline = _CallPipeline(items, issue_cb, finished_cb, window)
+    pipeline.start()
+
+    if reply_handler is not None:
+        return None
+
+    if not pipeline.finished:
+        main_loop.append(GObject.MainLoop())
+        main_loop[0].run()
+
+    return outcome[0], outcome[1]
+
+
 def write(ds_object, update_mtime=True, transfer_ownership=False,
           reply_handler=None, error_handler=None, timeout=-1):
     """Write the DSObject given to the datastore. Creates a new entry if
@@ -355,15 +1037,7 @@ def write(ds_object, update_mtime=True, transfer_ownership=False,
     """
     logging.debug('datastore.write')
 
-    properties = ds_object.metadata.get_dictionary().copy()
-
-    if update_mtime:
-        properties['mtime'] = datetime.now().isoformat()
-        properties['timestamp'] = int(time.time())
-
-    file_path = ds_object.get_file_path(fetch=False)
-    if file_path is None:
-        file_path = ''
+    properties, file_path = _get_write_arguments(ds_object, update_mtime)
 
     # FIXME: this func will be sync for creates regardless of the handlers
     # supplied. This is very bad API, need to decide what to do here.
@@ -386,6 +1060,509 @@ def write(ds_object, update_mtime=True, transfer_ownership=False,
     logging.debug('Written object %s to the datastore.', ds_object.object_id)
 
 
+def write_from_fd(ds_object, fd, update_mtime=True, reply_handler=None,
+                  error_handler=None, timeout=-1):
+    """Write the DSObject given to the datastore, taking the content of the
+    entry from a file descriptor instead of the DSObject file path.
+
+    The descriptor is passed to the service when it implements
+    create_from_file_descriptor and update_from_file_descriptor. The
+    current DataStore service does not, and then the content is copied,
+    from the current offset of the descriptor, into a file whose ownership
+    is transferred to the service: this costs one full copy, made by the
+    client, like writing a file of the caller with write(). The descriptor
+    is not closed.
+
+    Keyword arguments:
+    fd -- file descriptor opened for reading
+    update_mtime -- boolean if the mtime of the entry should be regenerated
+                    (default True)
+    reply_handler -- will be called with the method's return values as
+                     arguments (default None)
+    error_handler -- will be called with an instance of a DBusException
+                     representing a remote exception (default None)
+    timeout -- dbus timeout for the caller to wait (default -1)
+
+    """
+    logging.debug('datastore.write_from_fd')
+
+    properties, file_path_ = _get_write_arguments(ds_object, update_mtime)
+    properties = dbus.Dictionary(properties)
+
+    if _supports_fd_passing():
+        if ds_object.object_id:
+            if reply_handler and error_handler:
+                _get_data_store().update_from_file_descriptor(
+                    ds_object.object_id, properties, dbus.types.UnixFd(fd),
+                    reply_handler=reply_handler,
+                    error_handler=error_handler,
+                    timeout=timeout)
+            else:
+                _get_data_store().update_from_file_descriptor(
+                    ds_object.object_id, properties, dbus.types.UnixFd(fd))
+        else:
+            ds_object.object_id = \
+                _get_data_store().create_from_file_descriptor(
+                    properties, dbus.types.UnixFd(fd))
+            ds_object.metadata['uid'] = ds_object.object_id
+        return
+
+    temp_path = _copy_fd_to_temp_file(fd)
+    if ds_object.object_id:
+        _update_ds_entry(ds_object.object_id, properties, temp_path,
+                         transfer_ownership=True,
+                         reply_handler=reply_handler,
+                         error_handler=error_handler,
+                         timeout=timeout)
+    else:
+        ds_object.object_id = _create_ds_entry(properties, temp_path,
+                                               transfer_ownership=True)
+        ds_object.metadata['uid'] = ds_object.object_id
+
+
+def _encode_queued_properties(properties):
+    encoded = {}
+    for key, value in properties.iteritems():
+        if isinstance(value, dbus.ByteArray):
+            value = {'bytes': base64.b64encode(value)}
+        elif isinstance(value, str):
+            try:
+                value = value.decode('utf-8')
+            except UnicodeDecodeError:
+                value = {'bytes': base64.b64encode(value)}
+        encoded[key] = value
+    return encoded
+
+
+def _decode_queued_properties(encoded):
+    properties = {}
+    for key, value in encoded.iteritems():
+        if isinstance(value, dict) and 'bytes' in value:
+            value = dbus.ByteArray(base64.b64decode(value['bytes']))
+        properties[key] = value
+    return properties
+
+
+class _QueuedWrite(object):
+    """A write waiting in the write-behind queue. Its state is kept in a
+    JSON file, next to a lock file held by the process that owns the
+    operation, so that operations of processes that died can be told apart
+    and adopted."""
+
+    def __init__(self, log_path, state, lock_fd):
+        self.log_path = log_path
+        self.lock_path = os.path.splitext(log_path)[0] + '.lock'
+        self.state = state
+        self.lock_fd = lock_fd
+        self.ds_object = None
+        self.reply_handlers = []
+        self.error_handlers = []
+        self.in_flight = False
+        self.attempts = 0
+
+    def save(self):
+        temp_path = self.log_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_path, self.log_path)
+
+    def release(self, delete):
+        if delete:
+            file_path = self.state['file_path']
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            if os.path.exists(self.lock_path):
+                os.remove(self.lock_path)
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+
+class _WriteBehindQueue(object):
+    """Durable queue of datastore writes, replayed in order to the service.
+
+    Each queued write is logged under the profile together with a file
+    owned by the queue, before write_behind() returns. Writes to an entry
+    that already has a write waiting are merged into it. Logs left behind
+    by processes that exited or crashed are replayed by the next process
+    that uses the queue.
+
+    A write that still fails after WRITE_BEHIND_RETRIES attempts is left
+    on disk for the next process, and the later writes to the same entry
+    are folded into it, so that it never gets replayed over newer data.
+    Such a later write in this process tries the folded write again.
+    """
+
+    def __init__(self):
+        self._path = env.get_profile_path(_WRITE_QUEUE_DIR_NAME)
+        if not os.path.exists(self._path):
+            os.makedirs(self._path)
+        self._queue = []
+        # Writes that exhausted their retries, left for the next process
+        self._failed = []
+        self._retry_sid = None
+        self._adopt_orphans()
+
+    def _lock(self, path, create=False):
+        flags = os.O_RDONLY | os.O_CREAT
+        if create:
+            flags |= os.O_EXCL
+        try:
+            fd = os.open(path, flags, 0600)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _adopt_orphans(self):
+        for name in sorted(os.listdir(self._path)):
+            if not name.endswith('.json'):
+                continue
+            log_path = os.path.join(self._path, name)
+            operation = _QueuedWrite(log_path, None, None)
+            operation.lock_fd = self._lock(operation.lock_path)
+            if operation.lock_fd is None:
+                # Still owned by a running process
+                continue
+            try:
+                with open(log_path) as f:
+                    operation.state = json.load(f)
+            except (IOError, ValueError):
+                if os.path.exists(log_path):
+                    logging.exception('Discarding unreadable queued write '
+                                      '%s', log_path)
+                    os.remove(log_path)
+                os.remove(operation.lock_path)
+                os.close(operation.lock_fd)
+                continue
+            logging.debug('Adopting queued write %s', log_path)
+            self._queue.append(operation)
+
+        self._queue.sort(key=lambda operation: operation.state['seq'])
+        self._process()
+
+    def _take_file(self, file_path, transfer_ownership):
+        if not file_path:
+            return ''
+
+        fd, queued_path = tempfile.mkstemp(prefix='file', dir=self._path)
+        os.close(fd)
+        if transfer_ownership:
+            try:
+                os.rename(file_path, queued_path)
+                return queued_path
+            except OSError:
+                pass
+        try:
+            os.remove(queued_path)
+            os.link(file_path, queued_path)
+        except OSError:
+            shutil.copyfile(file_path, queued_path)
+        if transfer_ownership:
+            os.remove(file_path)
+        return queued_path
+
+    def _find_pending(self, ds_object):
+        for operation in reversed(self._failed + self._queue):
+            if operation.ds_object is ds_object or \
+                    (ds_object.object_id and
+                     operation.state['object_id'] == ds_object.object_id):
+                return operation
+        return None
+
+    def _is_same_entry(self, operation, other):
+        return (operation.ds_object is not None and
+                operation.ds_object is other.ds_object) or \
+            (other.state['object_id'] is not None and
+             operation.state['object_id'] == other.state['object_id']) or \
+            operation.state['create_seq'] == other.state['seq']
+
+    def _supersede(self, operation, properties, queued_path):
+        # Keep the file of the superseded write if the new one brings none
+        if queued_path:
+            old_path = operation.state['file_path']
+            if old_path and os.path.exists(old_path):
+                os.remove(old_path)
+            operation.state['file_path'] = queued_path
+        operation.state['properties'] = properties
+        operation.save()
+
+    def _add_handlers(self, operation, reply_handler, error_handler):
+        # The same handler is often passed by each save of an activity
+        if reply_handler is not None and \
+                reply_handler not in operation.reply_handlers:
+            operation.reply_handlers.append(reply_handler)
+        if error_handler is not None and \
+                error_handler not in operation.error_handlers:
+            operation.error_handlers.append(error_handler)
+
+    def add(self, ds_object, properties, file_path, transfer_ownership,
+            reply_handler, error_handler):
+        queued_path = self._take_file(file_path, transfer_ownership)
+        properties = _encode_queued_properties(properties)
+
+        pending = self._find_pending(ds_object)
+        if pending is not None and pending in self._failed:
+            # Try the failed write again, carrying this one
+            self._failed.remove(pending)
+            pending.attempts = 0
+            self._queue.append(pending)
+        if pending is not None and not pending.in_flight:
+            self._supersede(pending, properties, queued_path)
+            operation = pending
+        else:
+            seq = int(time.time() * 1000000)
+            if self._queue:
+                seq = max(seq, self._queue[-1].state['seq'] + 1)
+            state = {
+                'seq': seq,
+                'object_id': ds_object.object_id,
+                'create_seq': None,
+                'properties': properties,
+                'file_path': queued_path,
+            }
+            if ds_object.object_id is None and pending is not None:
+                # The entry is being created, update it once it is
+                state['create_seq'] = pending.state['seq']
+
+            while True:
+                log_path = os.path.join(self._path, '%d.json' % state['seq'])
+                operation = _QueuedWrite(log_path, state, None)
+                # Lock before the log exists so that no other process adopts
+                # it, and pick another seq if another process has it
+                operation.lock_fd = self._lock(operation.lock_path,
+                                               create=True)
+                if operation.lock_fd is not None and \
+                        not os.path.exists(log_path):
+                    break
+                if operation.lock_fd is not None:
+                    os.remove(operation.lock_path)
+                    operation.release(delete=False)
+                state['seq'] += 1
+            operation.save()
+            self._queue.append(operation)
+
+        operation.ds_object = ds_object
+        self._add_handlers(operation, reply_handler, error_handler)
+
+        self._process()
+
+    def has_pending(self, ds_object):
+        return self._find_pending(ds_object) is not None
+
+    def _process(self):
+        if not self._queue or self._queue[0].in_flight or \
+                self._retry_sid is not None:
+            return
+
+        operation = self._queue[0]
+        state = operation.state
+        if state['object_id'] is None and state['create_seq'] is not None:
+            # The create this update depended on was lost, create instead
+            state['create_seq'] = None
+
+        operation.in_flight = True
+        properties = dbus.Dictionary(
+            _decode_queued_properties(state['properties']))
+        try:
+            if state['object_id']:
+                _get_data_store().update(
+                    state['object_id'], properties, state['file_path'], True,
+                    reply_handler=partial(self.__reply_cb, operation, None),
+                    error_handler=partial(self.__error_cb, operation))
+            else:
+                _get_data_store().create(
+                    properties, state['file_path'], True,
+                    reply_handler=partial(self.__reply_cb, operation),
+                    error_handler=partial(self.__error_cb, operation))
+        except dbus.DBusException, e:
+            self.__error_cb(operation, e)
+
+    def __reply_cb(self, operation, object_id):
+        if object_id is not None:
+            # Recorded first, so that replaying the log updates the entry
+            # created instead of creating it again
+            operation.state['object_id'] = object_id
+            operation.save()
+        self._queue.remove(operation)
+
+        object_id = operation.state['object_id']
+        if object_id is not None:
+            if operation.ds_object is not None and \
+                    operation.ds_object.object_id is None:
+                operation.ds_object.object_id = object_id
+                operation.ds_object.metadata['uid'] = object_id
+            for dependent in self._queue:
+                if dependent.state['create_seq'] == operation.state['seq']:
+                    dependent.state['object_id'] = object_id
+                    dependent.state['create_seq'] = None
+                    dependent.save()
+
+        operation.release(delete=True)
+        self._process()
+        for reply_handler in operation.reply_handlers:
+            try:
+                reply_handler()
+            except Exception:
+                logging.exception('Error in write_behind reply handler')
+
+    def __error_cb(self, operation, error):
+        operation.in_flight = False
+        operation.attempts += 1
+        logging.error('Queued datastore write %s failed: %s',
+                      operation.log_path, error)
+
+        if operation.attempts < WRITE_BEHIND_RETRIES:
+            delay = WRITE_BEHIND_RETRY_DELAY * 2 ** (operation.attempts - 1)
+            self._retry_sid = GObject.timeout_add(delay, self.__retry_cb)
+            return
+
+        # Leave the write on disk, still locked, for the next process to
+        # try again, and fold the later writes to the entry into it
+        self._queue.remove(operation)
+        for later in self._queue[:]:
+            if not self._is_same_entry(later, operation):
+                continue
+            self._queue.remove(later)
+            self._supersede(operation, later.state['properties'],
+                            later.state['file_path'])
+            later.state['file_path'] = ''
+            later.release(delete=True)
+            if later.ds_object is not None:
+                operation.ds_object = later.ds_object
+            for error_handler in later.error_handlers:
+                self._add_handlers(operation, None, error_handler)
+
+        error_handlers = operation.error_handlers
+        operation.reply_handlers = []
+        operation.error_handlers = []
+        self._failed.append(operation)
+        self._process()
+        for error_handler in error_handlers:
+            try:
+                error_handler(error)
+            except Exception:
+                logging.exception('Error in write_behind error handler')
+
+    def __retry_cb(self):
+        self._retry_sid = None
+        self._process()
+        return False
+
+
+_write_behind_queue = None
+
+
+def _get_write_behind_queue():
+    global _write_behind_queue
+
+    if _write_behind_queue is None:
+        _write_behind_queue = _WriteBehindQueue()
+    return _write_behind_queue
+
+
+def write_behind(ds_object, update_mtime=True, transfer_ownership=False,
+                 reply_handler=None, error_handler=None):
+    """Queue a write of the DSObject given and return at once.
+
+    The metadata and file are logged under the profile before returning,
+    and the queued writes are sent to the datastore in order. A write to
+    an entry that still has a write waiting in the queue replaces it.
+    Writes that could not be sent, because the process exited or crashed,
+    are sent by the next process that queues a write. When the entry is
+    created, the object_id of the DSObject is set.
+
+    Keyword arguments:
+    update_mtime -- boolean if the mtime of the entry should be regenerated
+                    (default True)
+    transfer_ownership -- set it to true if the file can be moved to the
+                          queue instead of being linked or copied
+                          (default False)
+    reply_handler -- will be called without arguments once the write has
+                     reached the datastore (default None)
+    error_handler -- will be called with the exception if the write could
+                     not be sent after WRITE_BEHIND_RETRIES attempts
+                     (default None)
+
+    """
+    logging.debug('datastore.write_behind')
+
+    properties, file_path = _get_write_arguments(ds_object, update_mtime)
+    _get_write_behind_queue().add(ds_object, properties, file_path,
+                                  transfer_ownership, reply_handler,
+                                  error_handler)
+
+
+def has_pending_writes(ds_object):
+    """Whether the DSObject given has writes waiting in the write-behind
+    queue."""
+    if _write_behind_queue is None:
+        return False
+    return _write_behind_queue.has_pending(ds_object)
+
+
+def write_many(ds_objects, update_mtime=True, transfer_ownership=False,
+               window=DEFAULT_BATCH_WINDOW, reply_handler=None, timeout=-1):
+    """Write several DSObjects to the datastore, pipelining the calls.
+
+    Entries without an object_id are created, the others are updated. Up
+    to window calls are in flight at the same time.
+
+    Keyword arguments:
+    update_mtime -- boolean if the mtime of the entries should be
+                    regenerated (default True)
+    transfer_ownership -- set it to true if the ownership of the entries
+                          should be passed (default False)
+    window -- maximum number of concurrent calls
+              (default DEFAULT_BATCH_WINDOW)
+    reply_handler -- if given, the call returns at once and reply_handler
+                     is called with (object_ids, errors) when all the
+                     writes have completed (default None)
+    timeout -- dbus timeout for each call (default -1)
+
+    Return: a tuple (object_ids, errors) where object_ids has one entry per
+    DSObject (None if its write failed) and errors is a list of
+    (ds_object, exception) pairs; None if reply_handler is given.
+
+    """
+    logging.debug('datastore.write_many')
+
+    def issue_cb(ds_object, reply_cb, error_cb):
+        properties, file_path = _get_write_arguments(ds_object,
+                                                     update_mtime)
+        if ds_object.object_id:
+            _get_data_store().update(ds_object.object_id,
+                                     dbus.Dictionary(properties), file_path,
+                                     transfer_ownership,
+                                     reply_handler=partial(
+                                         reply_cb, ds_object.object_id),
+                                     error_handler=error_cb,
+                                     timeout=timeout)
+        else:
+            def created_cb(object_id):
+                ds_object.object_id = object_id
+                ds_object.metadata['uid'] = object_id
+                reply_cb(object_id)
+
+            _get_data_store().create(dbus.Dictionary(properties), file_path,
+                                     transfer_ownership,
+                                     reply_handler=created_cb,
+                                     error_handler=error_cb,
+                                     timeout=timeout)
+
+    return _run_pipeline(ds_objects, issue_cb, window, reply_handler)
+
+
 def delete(object_id):
     """Delete the datastore entry with the given uid.
 
@@ -397,6 +1574,109 @@ def delete(object_id):
     _get_data_store().delete(object_id)
 
 
+def delete_many(object_ids, window=DEFAULT_BATCH_WINDOW, reply_handler=None,
+                timeout=-1):
+    """Delete several datastore entries, pipelining the calls.
+
+    Keyword arguments:
+    object_ids -- uids of the datastore entries
+    window -- maximum number of concurrent calls
+              (default DEFAULT_BATCH_WINDOW)
+    reply_handler -- if given, the call returns at once and reply_handler
+                     is called with (deleted, errors) when all the deletes
+                     have completed (default None)
+    timeout -- dbus timeout for each call (default -1)
+
+    Return: a tuple (deleted, errors) where deleted has one entry per uid
+    (None if its deletion failed) and errors is a list of
+    (object_id, exception) pairs; None if reply_handler is given.
+
+    """
+    logging.debug('datastore.delete_many')
+
+    def issue_cb(object_id, reply_cb, error_cb):
+        _get_data_store().delete(object_id,
+                                 reply_handler=partial(reply_cb, object_id),
+                                 error_handler=error_cb,
+                                 timeout=timeout)
+
+    return _run_pipeline(object_ids, issue_cb, window, reply_handler)
+
+
+def get_many(object_ids, window=DEFAULT_BATCH_WINDOW, reply_handler=None,
+             timeout=-1):
+    """Get the properties of several objects, pipelining the calls.
+
+    Keyword arguments:
+    object_ids -- unique identifiers of the objects
+    window -- maximum number of concurrent calls
+              (default DEFAULT_BATCH_WINDOW)
+    reply_handler -- if given, the call returns at once and reply_handler
+                     is called with (ds_objects, errors) when all the
+                     properties have been retrieved (default None)
+    timeout -- dbus timeout for each call (default -1)
+
+    Return: a tuple (ds_objects, errors) where ds_objects has one DSObject
+    (or RawObject) per uid, None if it could not be retrieved, and errors
+    is a list of (object_id, exception) pairs; None if reply_handler is
+    given.
+
+    """
+    logging.debug('datastore.get_many')
+
+    object_ids = list(object_ids)
+
+    def issue_cb(object_id, reply_cb, error_cb):
+        if object_id.startswith('/'):
+            try:
+                raw_object = RawObject(object_id)
+            except OSError, e:
+                error_cb(e)
+            else:
+                reply_cb(raw_object)
+            return
+
+        def find_reply_cb(entries, count_):
+            try:
+                entry = _find_entry(object_id, entries)
+            except dbus.DBusException, e:
+                error_cb(e)
+            else:
+                reply_cb(entry)
+
+        _get_data_store().find({'uid': object_id}, _get_light_keys(),
+                               reply_handler=find_reply_cb,
+                               error_handler=error_cb,
+                               byte_arrays=True,
+                               timeout=timeout)
+
+    def convert_cb(results):
+        ds_objects = []
+        for object_id, metadata in zip(object_ids, results):
+            if metadata is None or isinstance(metadata, RawObject):
+                ds_objects.append(metadata)
+            else:
+                metadata = DSMetadata(metadata, object_id, _lazy_properties)
+                ds_objects.append(DSObject(object_id, metadata, None))
+        return ds_objects
+
+    return _run_pipeline(object_ids, issue_cb, window, reply_handler,
+                         convert_cb)
+
+
+def _build_find_query(query, sorting, limit, offset):
+    query = query.copy()
+
+    if sorting:
+        query['order_by'] = sorting
+    if limit:
+        query['limit'] = limit
+    if offset:
+        query['offset'] = offset
+
+    return query
+
+
 def find(query, sorting=None, limit=None, offset=None, properties=None,
          reply_handler=None, error_handler=None):
     """Find DS entries that match the query provided.
@@ -433,18 +1713,11 @@ def find(query, sorting=None, limit=None, offset=None, properties=None,
     Return: DSObjects matching the query, number of matches
 
     """
-    query = query.copy()
+    query = _build_find_query(query, sorting, limit, offset)
 
     if properties is None:
         properties = []
 
-    if sorting:
-        query['order_by'] = sorting
-    if limit:
-        query['limit'] = limit
-    if offset:
-        query['offset'] = offset
-
     if reply_handler and error_handler:
         _get_data_store().find(query, properties,
                                reply_handler=reply_handler,
@@ -465,9 +1738,170 @@ def find(query, sorting=None, limit=None, offset=None, properties=None,
     return ds_objects, total_count
 
 
+class ResultRow(object):
+    """A read-only view of one entry of a ResultSet."""
+
+    __slots__ = ['_result_set', '_index']
+
+    def __init__(self, result_set, index):
+        self._result_set = result_set
+        self._index = index
+
+    def get_object_id(self):
+        return self._result_set.get_value(self._index, 'uid')
+
+    object_id = property(get_object_id)
+
+    def __getitem__(self, key):
+        value = self._result_set.get_value(self._index, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._result_set.get_value(self._index, key) is not None
+
+    def get(self, key, default=None):
+        value = self._result_set.get_value(self._index, key)
+        if value is None:
+            return default
+        return value
+
+    def keys(self):
+        return [key for key in self._result_set.get_properties()
+                if key in self]
+
+    def get_dictionary(self):
+        return dict((key, self[key]) for key in self.keys())
+
+    def to_ds_object(self):
+        """Return a DSObject for the entry, whose full metadata is fetched
+        when first accessed."""
+        return DSObject(self.object_id)
+
+
+class ResultSet(object):
+    """find() results stored column-wise, one list per property.
+
+    Meant for listing large numbers of entries: rows are handed out as
+    ResultRow views and only turned into DSObjects, with their signal
+    connections, when ResultRow.to_ds_object() is called. Equal values
+    of the same type in a column share a single object.
+    """
+
+    def __init__(self, entries, properties):
+        self._properties = list(properties)
+        if 'uid' not in self._properties:
+            self._properties.insert(0, 'uid')
+
+        self._columns = dict((key, []) for key in self._properties)
+        self._index = {}
+        # Keyed by type too, so that 1, 1.0 and True, or str and unicode,
+        # stay apart
+        pools = dict((key, {}) for key in self._properties)
+
+        for row, entry in enumerate(entries):
+            for key in self._properties:
+                value = entry.get(key, None)
+                try:
+                    value = pools[key].setdefault((type(value), value),
+                                                  value)
+                except TypeError:
+                    # Unhashable values are kept as they are
+                    pass
+                self._columns[key].append(value)
+            self._index[entry['uid']] = row
+
+    def __len__(self):
+        return len(self._columns['uid'])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return ResultRow(self, index)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield ResultRow(self, index)
+
+    def get_properties(self):
+        return list(self._properties)
+
+    def get_value(self, index, key):
+        column = self._columns.get(key, None)
+        if column is None:
+            return None
+        return column[index]
+
+    def get_column(self, key):
+        """Return the list of values of key, None where an entry lacks it"""
+        return self._columns[key]
+
+    def get_row(self, object_id):
+        """Return the ResultRow of the entry with object_id, or None"""
+        index = self._index.get(object_id, None)
+        if index is None:
+            return None
+        return ResultRow(self, index)
+
+
+def find_rows(query, properties, sorting=None, limit=None, offset=None,
+              reply_handler=None, error_handler=None):
+    """Find DS entries that match the query provided, returning them in a
+    compact ResultSet instead of a list of DSObjects.
+
+    Keyword arguments:
+    query -- a dictionary containing metadata key value pairs, see find()
+    properties -- list of the metadata to retrieve e.g. ['title', 'keep']
+    sorting -- key to order results by e.g. 'timestamp' (default None)
+    limit -- return only limit results (default None)
+    offset -- return only results starting at offset (default None)
+    reply_handler -- will be called with the ResultSet and the number of
+                     matches (default None)
+    error_handler -- will be called with an instance of a DBusException
+                     representing a remote exception (default None)
+
+    Return: ResultSet matching the query, number of matches
+
+    """
+    query = _build_find_query(query, sorting, limit, offset)
+
+    if reply_handler and error_handler:
+        def find_cb(entries, total_count):
+            reply_handler(ResultSet(entries, properties), total_count)
+
+        _get_data_store().find(query, properties,
+                               reply_handler=find_cb,
+                               error_handler=error_handler,
+                               byte_arrays=True)
+        return
+
+    entries, total_count = _get_data_store().find(query, properties,
+                                                  byte_arrays=True)
+    return ResultSet(entries, properties), total_count
+
+
+def _get_suggested_filename(metadata):
+    if 'title' not in metadata:
+        return None
+
+    filename = metadata['title']
+    if 'mime_type' in metadata:
+        mime_type = metadata['mime_type']
+        extension = mime.get_primary_extension(mime_type)
+        if extension:
+            filename += '.' + extension
+    return filename
+
+
 def copy(ds_object, mount_point):
     """Copy a datastore entry
 
+    See copy_async() for a version that streams the file and reports its
+    progress.
+
     Keyword arguments:
     ds_object -- DSObject to copy
     mount_point -- mount point of the new datastore entry
@@ -476,15 +1910,8 @@ def copy(ds_object, mount_point):
     new_ds_object = ds_object.copy()
     new_ds_object.metadata['mountpoint'] = mount_point
 
-    if 'title' in ds_object.metadata:
-        filename = ds_object.metadata['title']
-
-        if 'mime_type' in ds_object.metadata:
-            mime_type = ds_object.metadata['mime_type']
-            extension = mime.get_primary_extension(mime_type)
-            if extension:
-                filename += '.' + extension
-
+    filename = _get_suggested_filename(ds_object.metadata)
+    if filename is not None:
         new_ds_object.metadata['suggested_filename'] = filename
 
     # this will cause the file be retrieved from the DS
@@ -493,14 +1920,370 @@ def copy(ds_object, mount_point):
     write(new_ds_object)
 
 
+class CopyCancelledError(Exception):
+    pass
+
+
+class _CopyScheduler(object):
+    """Run copy jobs, at most MAX_CONCURRENT_COPIES at a time."""
+
+    def __init__(self):
+        self._queue = []
+        self._running = []
+
+    def add(self, job):
+        self._queue.append(job)
+        self._run_next()
+
+    def remove(self, job):
+        if job in self._queue:
+            self._queue.remove(job)
+            return True
+        return False
+
+    def job_done(self, job):
+        if job in self._running:
+            self._running.remove(job)
+        self._run_next()
+
+    def _run_next(self):
+        while self._queue and len(self._running) < MAX_CONCURRENT_COPIES:
+            job = self._queue.pop(0)
+            self._running.append(job)
+            job._run()
+
+
+_copy_scheduler = _CopyScheduler()
+
+
+class CopyJob(GObject.GObject):
+    """Copy the file of a datastore entry to a directory, usually the
+    mount point of a removable device, without blocking the caller.
+
+    The file is requested from the service asynchronously, then cloned
+    when the filesystem supports it and streamed in COPY_CHUNK_SIZE chunks
+    from a worker thread otherwise. 'progress' is emitted with the number
+    of bytes copied and the total, at most every COPY_PROGRESS_INTERVAL
+    seconds, and 'finished' with None on success or the exception that
+    made the copy fail (CopyCancelledError after cancel()). The metadata
+    is stored next to the file, in the .Sugar-Metadata directory used for
+    journal entries on external media.
+
+    """
+    __gsignals__ = {
+        'progress': (GObject.SignalFlags.RUN_FIRST, None,
+                     ([object, object])),
+        'finished': (GObject.SignalFlags.RUN_FIRST, None, ([object])),
+    }
+
+    def __init__(self, ds_object, mount_point):
+        GObject.GObject.__init__(self)
+        self._ds_object = ds_object
+        self._mount_point = mount_point
+        self._metadata = None
+        self._cancelled = False
+        self._thread = None
+        self.destination_path = None
+
+    def start(self):
+        """Queue the copy, it starts as soon as a slot is free."""
+        _copy_scheduler.add(self)
+
+    def cancel(self):
+        self._cancelled = True
+        if _copy_scheduler.remove(self):
+            self.emit('finished', CopyCancelledError())
+
+    def _create_destination(self):
+        filename = _get_suggested_filename(self._metadata) or \
+            self._ds_object.object_id
+        filename = filename.replace('/', '_')
+        name, extension = os.path.splitext(filename)
+
+        counter = 1
+        while True:
+            path = os.path.join(self._mount_point, filename)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0644)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                counter += 1
+                filename = '%s (%d)%s' % (name, counter, extension)
+                continue
+            return fd, path
+
+    def _run(self):
+        # The D-Bus calls have to be done from the main thread, and without
+        # waiting for the service to copy the file out of the datastore
+        try:
+            metadata = self._ds_object.metadata
+            self._metadata = metadata.get_complete_dictionary().copy()
+            object_id = self._ds_object.object_id
+            file_path = self._ds_object.get_file_path(fetch=False)
+            if file_path or object_id is None:
+                self._start_copy(file_path)
+            elif _supports_fd_passing():
+                _get_data_store().get_file_descriptor(
+                    object_id,
+                    reply_handler=self.__get_file_descriptor_reply_cb,
+                    error_handler=self.__get_file_error_cb)
+            else:
+                _get_data_store().get_filename(
+                    object_id,
+                    reply_handler=self.__get_filename_reply_cb,
+                    error_handler=self.__get_file_error_cb)
+        except Exception, e:
+            self._start_failed(e)
+
+    def __get_file_descriptor_reply_cb(self, fd):
+        self._start_copy(fd=fd.take())
+
+    def __get_filename_reply_cb(self, file_path):
+        # The service made a copy for us, only needed until it is opened
+        try:
+            self._start_copy(file_path)
+        finally:
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
+
+    def __get_file_error_cb(self, error):
+        self._start_failed(error)
+
+    def _start_failed(self, error):
+        logging.error('Could not start copying %s: %s',
+                      self._ds_object.object_id, error)
+        GObject.idle_add(self.__finished_cb, error)
+
+    def _start_copy(self, file_path=None, fd=None):
+        try:
+            if fd is None:
+                if not file_path:
+                    raise ValueError('Entry %s has no file' %
+                                     self._ds_object.object_id)
+                fd = os.open(file_path, os.O_RDONLY)
+            try:
+                dst_fd, self.destination_path = self._create_destination()
+            except OSError:
+                os.close(fd)
+                raise
+        except Exception, e:
+            self._start_failed(e)
+            return
+
+        self._thread = threading.Thread(target=self._copy,
+                                        args=(fd, dst_fd))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _copy(self, src_fd, dst_fd):
+        error = None
+        try:
+            total = os.fstat(src_fd).st_size
+            if os.fstat(dst_fd).st_dev == os.fstat(src_fd).st_dev:
+                try:
+                    fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+                except IOError:
+                    pass
+                else:
+                    GObject.idle_add(self.__progress_cb, total, total)
+                    return
+
+            copied = 0
+            last_progress = 0
+            while True:
+                if self._cancelled:
+                    raise CopyCancelledError()
+                data = os.read(src_fd, COPY_CHUNK_SIZE)
+                if not data:
+                    break
+                while data:
+                    written = os.write(dst_fd, data)
+                    data = data[written:]
+                    copied += written
+
+                now = time.time()
+                if now - last_progress >= COPY_PROGRESS_INTERVAL:
+                    last_progress = now
+                    GObject.idle_add(self.__progress_cb, copied, total)
+
+            # Removable media can be unplugged right after the copy
+            os.fsync(dst_fd)
+            GObject.idle_add(self.__progress_cb, copied, total)
+        except Exception, e:
+            error = e
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+            GObject.idle_add(self.__finished_cb, error)
+
+    def _write_metadata(self):
+        metadata_dir = os.path.join(self._mount_point, _METADATA_DIR_NAME)
+        if not os.path.exists(metadata_dir):
+            os.mkdir(metadata_dir)
+
+        filename = os.path.basename(self.destination_path)
+        metadata = self._metadata.copy()
+        preview = metadata.pop('preview', None)
+        metadata.pop('uid', None)
+        metadata.pop('mountpoint', None)
+
+        with open(os.path.join(metadata_dir, filename + '.metadata'),
+                  'w') as f:
+            json.dump(metadata, f)
+        if preview:
+            with open(os.path.join(metadata_dir, filename + '.preview'),
+                      'w') as f:
+                f.write(preview)
+
+    def __progress_cb(self, copied, total):
+        if not self._cancelled:
+            self.emit('progress', copied, total)
+        return False
+
+    def __finished_cb(self, error):
+        if error is None:
+            try:
+                self._write_metadata()
+            except (IOError, OSError, TypeError, ValueError), e:
+                logging.exception('Could not write metadata of %s',
+                                  self.destination_path)
+                error = e
+
+        if error is not None and self.destination_path is not None and \
+                os.path.exists(self.destination_path):
+            os.remove(self.destination_path)
+
+        _copy_scheduler.job_done(self)
+        self.emit('finished', error)
+        return False
+
+
+def copy_async(ds_object, mount_point):
+    """Copy a datastore entry to a mount point in the background
+
+    Keyword arguments:
+    ds_object -- DSObject to copy
+    mount_point -- directory the file is copied to
+
+    Return: the started CopyJob, connect to its 'progress' and 'finished'
+    signals to follow the copy
+
+    """
+    job = CopyJob(ds_object, mount_point)
+    job.start()
+    return job
+
+
+# Keys whose unique values and counts are tracked by the facet index
+FACET_KEYS = ['activity', 'mime_type', 'keep']
+
+
+class FacetIndex(GObject.GObject):
+    """Unique values, and the number of entries having them, of the
+    FACET_KEYS properties of the datastore entries.
+
+    The index is built with a single find() the first time it is used and
+    then kept up to date from the Created, Updated and Deleted signals of
+    the datastore, so filter menus can be built without querying the
+    service. 'changed' is emitted when a count changes.
+    """
+    __gsignals__ = {
+        'changed': (GObject.SignalFlags.RUN_FIRST, None, ([])),
+    }
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+        # uid -> tuple of the values of FACET_KEYS
+        self._entries = {}
+        self._counts = dict((key, {}) for key in FACET_KEYS)
+        self._built = False
+
+        created.connect(self.__updated_cb)
+        updated.connect(self.__updated_cb)
+        deleted.connect(self.__deleted_cb)
+
+    def _build(self):
+        entries, count_ = _get_data_store().find({}, FACET_KEYS + ['uid'],
+                                                 byte_arrays=True)
+        for entry in entries:
+            self._add(entry['uid'], self._get_values(entry))
+        self._built = True
+
+    def _get_values(self, metadata):
+        return tuple(metadata.get(key, '') for key in FACET_KEYS)
+
+    def _add(self, uid, values):
+        self._entries[uid] = values
+        for key, value in zip(FACET_KEYS, values):
+            counts = self._counts[key]
+            counts[value] = counts.get(value, 0) + 1
+
+    def _remove(self, uid):
+        values = self._entries.pop(uid, None)
+        if values is None:
+            return
+        for key, value in zip(FACET_KEYS, values):
+            counts = self._counts[key]
+            counts[value] -= 1
+            if counts[value] <= 0:
+                del counts[value]
+
+    def __updated_cb(self, signal, sender, object_id, metadata, **kwargs):
+        if not self._built:
+            return
+        values = self._get_values(metadata)
+        if self._entries.get(object_id) == values:
+            return
+        self._remove(object_id)
+        self._add(object_id, values)
+        self.emit('changed')
+
+    def __deleted_cb(self, signal, sender, object_id, **kwargs):
+        if not self._built or object_id not in self._entries:
+            return
+        self._remove(object_id)
+        self.emit('changed')
+
+    def get_counts(self, key):
+        """Return a dictionary mapping each value of key to the number of
+        entries that have it."""
+        if not self._built:
+            self._build()
+        return dict(self._counts[key])
+
+    def get_values(self, key):
+        """Return the unique non-empty values of key."""
+        return [value for value in self.get_counts(key) if value != '']
+
+
+_facet_index = None
+
+
+def get_facet_index():
+    """Return the FacetIndex of the datastore."""
+    global _facet_index
+
+    if _facet_index is None:
+        _facet_index = FacetIndex()
+    return _facet_index
+
+
 def get_unique_values(key):
     """Retrieve an array of unique values for a field.
 
+    Values of the FACET_KEYS properties come from the facet index, the
+    other keys are looked up in the datastore.
+
     Keyword arguments:
-    key -- only the property activity is currently supported
+    key -- name of the property, e.g. 'activity'
 
-    Return: list of activities
+    Return: list of values
 
     """
+    if key in FACET_KEYS:
+        return get_facet_index().get_values(key)
+
     return _get_data_store().get_uniquevaluesfor(
         key, dbus.Dictionary({}, signature='ss'))
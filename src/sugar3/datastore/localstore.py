@@ -0,0 +1,375 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""In-process implementation of the org.laptop.sugar.DataStore interface
+
+The datastore client uses it instead of the D-Bus service when the
+SUGAR_LOCAL_DATASTORE environment variable points to a directory. Metadata
+is kept in a SQLite database and entry files in a directory next to it,
+which makes it possible to test and benchmark save and load paths without
+a running DataStore.
+
+Calls complete, and signals are emitted, before the methods return; the
+reply_handler, error_handler, timeout and byte_arrays arguments accepted
+by the D-Bus proxy are honoured so that it can be used as a drop-in
+replacement.
+
+UNSTABLE.
+"""
+
+import os
+import errno
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+import logging
+
+from sugar3 import env
+
+
+_DB_FILE_NAME = 'metadata.db'
+_FILES_DIR_NAME = 'files'
+
+# Properties looked up by fulltext queries
+_FULLTEXT_PROPERTIES = ['title', 'description', 'tags']
+
+# Query keys that are not matched against properties
+_SPECIAL_QUERY_KEYS = ['query', 'order_by', 'limit', 'offset', 'mountpoints']
+
+_DEFAULT_ORDER_BY = '-timestamp'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    uid TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS properties (
+    uid TEXT NOT NULL REFERENCES entries(uid) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value,
+    PRIMARY KEY (uid, key)
+);
+CREATE INDEX IF NOT EXISTS properties_key_value ON properties (key, value);
+"""
+
+
+class DataStoreError(Exception):
+    pass
+
+
+class _SignalMatch(object):
+
+    def __init__(self, handlers, handler, arg0):
+        self._handlers = handlers
+        self._entry = (handler, arg0)
+        handlers.append(self._entry)
+
+    def remove(self):
+        if self._entry in self._handlers:
+            self._handlers.remove(self._entry)
+
+
+def _to_db_value(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, long, float)):
+        return value
+    if isinstance(value, unicode):
+        return value
+    value = str(value)
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return sqlite3.Binary(value)
+
+
+def _from_db_value(value):
+    if isinstance(value, buffer):
+        return str(value)
+    return value
+
+
+class LocalDataStore(object):
+    """A DataStore kept in a SQLite database and a content directory."""
+
+    def __init__(self, root_path):
+        self._root_path = root_path
+        self._files_path = os.path.join(root_path, _FILES_DIR_NAME)
+        if not os.path.isdir(self._files_path):
+            os.makedirs(self._files_path)
+
+        self._db = sqlite3.connect(os.path.join(root_path, _DB_FILE_NAME))
+        self._db.execute('PRAGMA foreign_keys = ON')
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+        self._signal_handlers = {'Created': [], 'Updated': [], 'Deleted': []}
+
+    def close(self):
+        self._db.close()
+
+    def connect_to_signal(self, signal_name, handler_function, arg0=None,
+                          **kwargs):
+        """Connect to one of the Created, Updated or Deleted signals, like
+        dbus.proxies.Interface.connect_to_signal does."""
+        handlers = self._signal_handlers[signal_name]
+        return _SignalMatch(handlers, handler_function, arg0)
+
+    def _emit(self, signal_name, object_id):
+        for handler, arg0 in list(self._signal_handlers[signal_name]):
+            if arg0 is None or arg0 == object_id:
+                handler(object_id)
+
+    def _call(self, function, args, kwargs):
+        reply_handler = kwargs.get('reply_handler', None)
+        error_handler = kwargs.get('error_handler', None)
+        if reply_handler is None and error_handler is None:
+            return function(*args)
+
+        try:
+            result = function(*args)
+        except Exception, e:
+            if error_handler is None:
+                raise
+            error_handler(e)
+            return None
+
+        if reply_handler is not None:
+            if result is None:
+                reply_handler()
+            elif isinstance(result, tuple):
+                # Several return values, as from find()
+                reply_handler(*result)
+            else:
+                reply_handler(result)
+        return None
+
+    def create(self, props, file_path, transfer_ownership, **kwargs):
+        return self._call(self._create, (props, file_path,
+                                         transfer_ownership), kwargs)
+
+    def update(self, uid, props, file_path, transfer_ownership, **kwargs):
+        return self._call(self._update, (uid, props, file_path,
+                                         transfer_ownership), kwargs)
+
+    def delete(self, uid, **kwargs):
+        return self._call(self._delete, (uid,), kwargs)
+
+    def get_properties(self, uid, **kwargs):
+        return self._call(self._get_properties, (uid,), kwargs)
+
+    def get_filename(self, uid, **kwargs):
+        return self._call(self._get_filename, (uid,), kwargs)
+
+    def find(self, query, properties, **kwargs):
+        return self._call(self._find, (query, properties), kwargs)
+
+    def get_uniquevaluesfor(self, propertyname, query, **kwargs):
+        return self._call(self._get_unique_values, (propertyname, query),
+                          kwargs)
+
+    def _get_file_path(self, uid):
+        return os.path.join(self._files_path, uid)
+
+    def _exists(self, uid):
+        cursor = self._db.execute('SELECT 1 FROM entries WHERE uid = ?',
+                                  (uid,))
+        return cursor.fetchone() is not None
+
+    def _store_file(self, uid, file_path, transfer_ownership):
+        if not file_path:
+            return
+        destination = self._get_file_path(uid)
+        if transfer_ownership:
+            try:
+                os.rename(file_path, destination)
+                return
+            except OSError, e:
+                if e.errno != errno.EXDEV:
+                    raise
+            shutil.copyfile(file_path, destination)
+            os.remove(file_path)
+        else:
+            shutil.copyfile(file_path, destination)
+
+    def _store_properties(self, uid, props):
+        props = dict(props)
+        props['uid'] = uid
+        file_path = self._get_file_path(uid)
+        if os.path.exists(file_path):
+            props['filesize'] = os.stat(file_path).st_size
+        if 'timestamp' not in props:
+            props['timestamp'] = int(time.time())
+
+        self._db.execute('DELETE FROM properties WHERE uid = ?', (uid,))
+        self._db.executemany(
+            'INSERT INTO properties (uid, key, value) VALUES (?, ?, ?)',
+            [(uid, key, _to_db_value(value))
+             for key, value in props.iteritems()])
+
+    def _create(self, props, file_path, transfer_ownership):
+        uid = str(uuid.uuid4())
+        self._store_file(uid, file_path, transfer_ownership)
+        self._db.execute('INSERT INTO entries (uid) VALUES (?)', (uid,))
+        self._store_properties(uid, props)
+        self._db.commit()
+        logging.debug('LocalDataStore created %s', uid)
+        self._emit('Created', uid)
+        return uid
+
+    def _update(self, uid, props, file_path, transfer_ownership):
+        if not self._exists(uid):
+            raise DataStoreError('Entry %s does not exist' % uid)
+        self._store_file(uid, file_path, transfer_ownership)
+        self._store_properties(uid, props)
+        self._db.commit()
+        self._emit('Updated', uid)
+
+    def _delete(self, uid):
+        if not self._exists(uid):
+            raise DataStoreError('Entry %s does not exist' % uid)
+        self._db.execute('DELETE FROM properties WHERE uid = ?', (uid,))
+        self._db.execute('DELETE FROM entries WHERE uid = ?', (uid,))
+        self._db.commit()
+        file_path = self._get_file_path(uid)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        self._emit('Deleted', uid)
+
+    def _read_properties(self, uid, keys=None):
+        cursor = self._db.execute(
+            'SELECT key, value FROM properties WHERE uid = ?', (uid,))
+        props = {}
+        for key, value in cursor:
+            if keys and key not in keys and key != 'uid':
+                continue
+            props[key] = _from_db_value(value)
+        return props
+
+    def _get_properties(self, uid):
+        if not self._exists(uid):
+            raise DataStoreError('Entry %s does not exist' % uid)
+        return self._read_properties(uid)
+
+    def _get_filename(self, uid):
+        if not self._exists(uid):
+            raise DataStoreError('Entry %s does not exist' % uid)
+        file_path = self._get_file_path(uid)
+        if not os.path.exists(file_path):
+            return ''
+
+        # Like the DataStore service, hand out a file the caller owns
+        data_path = os.path.join(env.get_profile_path(), 'data')
+        if not os.path.exists(data_path):
+            os.makedirs(data_path)
+        fd, destination = tempfile.mkstemp(prefix=uid, dir=data_path)
+        os.close(fd)
+        os.remove(destination)
+        try:
+            os.link(file_path, destination)
+        except OSError:
+            shutil.copyfile(file_path, destination)
+        return destination
+
+    def _build_where(self, query, uid_column='uid'):
+        clauses = []
+        args = []
+
+        for key, value in query.iteritems():
+            if key in _SPECIAL_QUERY_KEYS:
+                continue
+            if isinstance(value, dict):
+                clause = '%s IN (SELECT uid FROM properties ' \
+                    'WHERE key = ?' % uid_column
+                args.append(key)
+                if value.get('start', None) is not None:
+                    clause += ' AND value >= ?'
+                    args.append(_to_db_value(value['start']))
+                if value.get('end', None) is not None:
+                    clause += ' AND value <= ?'
+                    args.append(_to_db_value(value['end']))
+                clauses.append(clause + ')')
+            elif isinstance(value, (list, tuple)):
+                if not value:
+                    continue
+                clauses.append('%s IN (SELECT uid FROM properties '
+                               'WHERE key = ? AND value IN (%s))' %
+                               (uid_column, ', '.join('?' * len(value))))
+                args.append(key)
+                args.extend([_to_db_value(item) for item in value])
+            else:
+                clauses.append('%s IN (SELECT uid FROM properties '
+                               'WHERE key = ? AND value = ?)' % uid_column)
+                args.extend([key, _to_db_value(value)])
+
+        for term in query.get('query', '').split():
+            term = term.strip('*"')
+            if not term:
+                continue
+            clauses.append('%s IN (SELECT uid FROM properties '
+                           'WHERE key IN (%s) AND value LIKE ?)' %
+                           (uid_column,
+                            ', '.join('?' * len(_FULLTEXT_PROPERTIES))))
+            args.extend(_FULLTEXT_PROPERTIES)
+            args.append('%' + term + '%')
+
+        if clauses:
+            return ' WHERE ' + ' AND '.join(clauses), args
+        return '', args
+
+    def _find(self, query, properties):
+        where, args = self._build_where(query)
+        sort_where, args_ = self._build_where(query, 'entries.uid')
+
+        cursor = self._db.execute('SELECT COUNT(*) FROM entries' + where,
+                                  args)
+        total_count = cursor.fetchone()[0]
+
+        order_by = query.get('order_by', _DEFAULT_ORDER_BY) or \
+            _DEFAULT_ORDER_BY
+        if isinstance(order_by, (list, tuple)):
+            order_by = order_by[0] if order_by else _DEFAULT_ORDER_BY
+        direction = 'ASC'
+        if order_by.startswith('-'):
+            direction = 'DESC'
+        order_key = order_by.lstrip('+-')
+
+        sql = 'SELECT entries.uid FROM entries ' \
+            'LEFT JOIN properties AS sort ' \
+            'ON sort.uid = entries.uid AND sort.key = ?' + sort_where + \
+            ' ORDER BY sort.value %s, entries.uid' % direction
+        sql_args = [order_key] + args
+
+        limit = query.get('limit', None)
+        offset = query.get('offset', None)
+        if limit is not None or offset is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            sql_args.extend([limit if limit is not None else -1,
+                             offset or 0])
+
+        uids = [row[0] for row in self._db.execute(sql, sql_args)]
+        entries = [self._read_properties(uid, properties) for uid in uids]
+        return entries, total_count
+
+    def _get_unique_values(self, propertyname, query):
+        where, args = self._build_where(query or {})
+        cursor = self._db.execute(
+            'SELECT DISTINCT value FROM properties WHERE key = ? AND '
+            'uid IN (SELECT uid FROM entries%s)' % where,
+            [propertyname] + args)
+        return [_from_db_value(row[0]) for row in cursor]
@@ -55,6 +55,15 @@ class _SVGLoader(object):
             if cache:
                 self._cache[file_name] = icon
 
+        icon = self._set_entities(icon, entities, file_name)
+        return Rsvg.Handle.new_from_data(icon.encode('utf-8'))
+
+    def load_data(self, data, entities):
+        """Load an icon from the content of its SVG file"""
+        icon = self._set_entities(data, entities, '<data>')
+        return Rsvg.Handle.new_from_data(icon)
+
+    def _set_entities(self, icon, entities, file_name):
         for entity, value in entities.items():
             if isinstance(value, basestring):
                 xml = '<!ENTITY %s "%s">' % (entity, value)
@@ -62,8 +71,7 @@ class _SVGLoader(object):
             else:
                 logging.error(
                     'Icon %s, entity %s is invalid.', file_name, entity)
-
-        return Rsvg.Handle.new_from_data(icon.encode('utf-8'))
+        return icon
 
 
 class _IconInfo(object):
@@ -92,6 +100,7 @@ class _IconBuffer(object):
         self.icon_name = None
         self.icon_size = None
         self.file_name = None
+        self.file_data = None
         self.fill_color = None
         self.background_color = None
         self.stroke_color = None
@@ -107,18 +116,21 @@ class _IconBuffer(object):
         else:
             color = (self.background_color.red, self.background_color.green,
                      self.background_color.blue)
-        return (self.icon_name, self.file_name, self.fill_color,
+        return (self.icon_name, self.file_name, self.file_data,
+                self.fill_color,
                 self.stroke_color, self.badge_name, self.width, self.height,
                 color, sensitive)
 
-    def _load_svg(self, file_name):
+    def _get_entities(self):
         entities = {}
         if self.fill_color:
             entities['fill_color'] = self.fill_color
         if self.stroke_color:
             entities['stroke_color'] = self.stroke_color
+        return entities
 
-        return self._loader.load(file_name, entities, self.cache)
+    def _load_svg(self, file_name):
+        return self._loader.load(file_name, self._get_entities(), self.cache)
 
     def _get_attach_points(self, info, size_request):
         has_attach_points_, attach_points = info.get_attach_points()
@@ -252,12 +264,26 @@ class _IconBuffer(object):
         if cache_key in self._surface_cache:
             return self._surface_cache[cache_key]
 
-        # We run two attempts at finding the icon. First, we try the icon
-        # requested by the user. If that fails, we fall back on
-        # document-generic. If that doesn't work out, bail.
+        # SVG data given directly, for example the icon of a zipped bundle,
+        # is used first. Then we run two attempts at finding the icon.
+        # First, we try the icon requested by the user. If that fails, we
+        # fall back on document-generic. If that doesn't work out, bail.
         icon_width = None
+        if self.file_data is not None:
+            icon_info = _IconInfo()
+            try:
+                handle = self._loader.load_data(self.file_data,
+                                                self._get_entities())
+                icon_width = handle.props.width
+                icon_height = handle.props.height
+                is_svg = True
+            except GObject.GError:
+                logging.warning('Invalid icon data')
+
         for (file_name, icon_name) in ((self.file_name, self.icon_name),
                                       (None, 'document-generic')):
+            if icon_width is not None:
+                break
             icon_info = self._get_icon_info(file_name, icon_name)
             if icon_info.file_name is None:
                 return None
@@ -365,6 +391,19 @@ class Icon(Gtk.Image):
 
     file = GObject.property(type=object, setter=set_file, getter=get_file)
 
+    def get_file_data(self):
+        return self._buffer.file_data
+
+    def set_file_data(self, file_data):
+        """Set the content of a SVG file to render, such as the one given
+        by the get_icon_data() method of bundles"""
+        if self._buffer.file_data != file_data:
+            self._buffer.file_data = file_data
+            self.queue_resize()
+
+    file_data = GObject.property(type=object, setter=set_file_data,
+                                 getter=get_file_data)
+
     def _sync_image_properties(self):
         if self._buffer.icon_name != self.props.icon_name:
             self._buffer.icon_name = self.props.icon_name
@@ -587,6 +626,17 @@ class EventIcon(Gtk.EventBox):
     file_name = GObject.property(
         type=object, getter=get_file_name, setter=set_file_name)
 
+    def set_file_data(self, value):
+        if self._buffer.file_data != value:
+            self._buffer.file_data = value
+            self.queue_draw()
+
+    def get_file_data(self):
+        return self._buffer.file_data
+
+    file_data = GObject.property(
+        type=object, getter=get_file_data, setter=set_file_data)
+
     def set_icon_name(self, value):
         if self._buffer.icon_name != value:
             self._buffer.icon_name = value
@@ -22,14 +22,24 @@ STABLE.
 """
 
 import os
+import json
 import logging
 import gettext
+import threading
+import Queue
+from collections import OrderedDict
 
 from gi.repository import GLib
 from gi.repository import GdkPixbuf
 from gi.repository import Gio
 
-from gi.repository import SugarExt
+try:
+    from gi.repository import SugarExt
+except ImportError:
+    SugarExt = None
+
+from sugar3 import env
+from sugar3 import mimecache
 
 _ = lambda msg: gettext.dgettext('sugar-toolkit-gtk3', msg)
 
@@ -40,6 +50,13 @@ GENERIC_TYPE_VIDEO = 'Video'
 GENERIC_TYPE_LINK = 'Link'
 GENERIC_TYPE_BUNDLE = 'Bundle'
 
+# Number of threads get_for_files() sniffs with
+SNIFF_WORKERS = 4
+# Number of files whose MIME type is remembered across sessions
+SNIFF_CACHE_SIZE = 16384
+
+_SNIFF_CACHE_FILE_NAME = 'mime-types.json'
+
 
 def _get_supported_image_mime_types():
     mime_types = []
@@ -48,8 +65,10 @@ def _get_supported_image_mime_types():
     return mime_types
 
 
-_extensions = {}
-_globs_timestamps = []
+# MIME type -> generic type, built on first use
+_generic_types_index = None
+# Generic types found through the MIME parents, or None
+_generic_types_cache = {}
 _generic_types = [{
     'id': GENERIC_TYPE_TEXT,
     'name': _('Text'),
@@ -61,7 +80,8 @@ _generic_types = [{
     'id': GENERIC_TYPE_IMAGE,
     'name': _('Image'),
     'icon': 'image-x-generic',
-    'types': _get_supported_image_mime_types(),
+    # Filled in with the GdkPixbuf formats on first use
+    'types': None,
 }, {
     'id': GENERIC_TYPE_AUDIO,
     'name': _('Audio'),
@@ -109,9 +129,16 @@ def get_generic_type(type_id):
             return generic_type
 
 
+def _get_generic_types():
+    for generic_type in _generic_types:
+        if generic_type['types'] is None:
+            generic_type['types'] = _get_supported_image_mime_types()
+    return _generic_types
+
+
 def get_all_generic_types():
     types = []
-    for generic_type in _generic_types:
+    for generic_type in _get_generic_types():
         object_type = ObjectType(generic_type['id'], generic_type['name'],
                                  generic_type['icon'], generic_type['types'])
         types.append(object_type)
@@ -122,9 +149,25 @@ def get_for_file(file_name):
     if file_name.startswith('file://'):
         file_name = file_name[7:]
 
-    file_name = os.path.realpath(file_name)
+    database = None
+    if SugarExt is None:
+        database = mimecache.get_database()
+    return _sniff(os.path.realpath(file_name), database)
+
+
+# The xdgmime copy behind SugarExt keeps global state
+_sniff_lock = threading.Lock()
+
+
+def _sniff(file_name, database=None):
+    if database is not None:
+        mime_type = database.get_for_file(file_name)
+    elif SugarExt is not None:
+        with _sniff_lock:
+            mime_type = SugarExt.mime_get_mime_type_for_file(file_name, None)
+    else:
+        mime_type = 'application/octet-stream'
 
-    mime_type = SugarExt.mime_get_mime_type_for_file(file_name, None)
     if mime_type == 'application/octet-stream':
         if _file_looks_like_text(file_name):
             return 'text/plain'
@@ -134,7 +177,134 @@ def get_for_file(file_name):
     return mime_type
 
 
+_sniff_cache = None
+
+
+def _get_sniff_cache():
+    global _sniff_cache
+
+    if _sniff_cache is None:
+        _sniff_cache = OrderedDict()
+        cache_path = env.get_profile_path(_SNIFF_CACHE_FILE_NAME)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path) as f:
+                    _sniff_cache = json.load(f, object_pairs_hook=OrderedDict)
+            except (IOError, ValueError):
+                logging.exception('Cannot read the MIME types cache')
+    return _sniff_cache
+
+
+def _save_sniff_cache():
+    cache = _get_sniff_cache()
+    while len(cache) > SNIFF_CACHE_SIZE:
+        cache.popitem(last=False)
+
+    cache_path = env.get_profile_path(_SNIFF_CACHE_FILE_NAME)
+    temp_path = cache_path + '.tmp'
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(cache, f)
+        os.rename(temp_path, cache_path)
+    except (IOError, OSError):
+        logging.exception('Cannot write the MIME types cache')
+
+
+def _get_sniff_key(file_name):
+    stat = os.stat(file_name)
+    return '%d:%d:%d:%d' % (stat.st_dev, stat.st_ino, stat.st_size,
+                            stat.st_mtime)
+
+
+def _sniff_worker(pending, results, cache, database, cancelled):
+    while not cancelled.is_set():
+        file_name = pending.get()
+        if file_name is None:
+            return
+
+        key = None
+        mime_type = None
+        try:
+            path = file_name
+            if path.startswith('file://'):
+                path = path[7:]
+            path = os.path.realpath(path)
+            key = _get_sniff_key(path)
+            mime_type = cache.get(key, None)
+            if mime_type is None:
+                mime_type = _sniff(path, database)
+        except (IOError, OSError), e:
+            logging.warning('Cannot get the MIME type of %s: %s',
+                            file_name, e)
+        except Exception:
+            logging.exception('Cannot get the MIME type of %s', file_name)
+        results.put((file_name, key, mime_type))
+
+
+def get_for_files(file_names, workers=None):
+    """Get the MIME types of several files, sniffing them in parallel
+
+    The MIME type of each file is remembered, for as long as its size and
+    modification time do not change, in a cache in the profile directory.
+
+    Keyword arguments:
+    file_names -- the paths or file:// URIs of the files
+    workers -- number of sniffing threads, SNIFF_WORKERS by default
+
+    Returns an iterator of (file_name, mime_type) tuples, in the order the
+    files finish sniffing; mime_type is None for files that cannot be read.
+    """
+    file_names = list(file_names)
+    if workers is None:
+        workers = SNIFF_WORKERS
+    workers = max(1, min(workers, len(file_names)))
+
+    cache = _get_sniff_cache()
+    # Sniff like get_for_file() does
+    database = None
+    if SugarExt is None:
+        database = mimecache.get_database()
+    pending = Queue.Queue()
+    results = Queue.Queue()
+    cancelled = threading.Event()
+    for file_name in file_names:
+        pending.put(file_name)
+    for i in range(workers):
+        pending.put(None)
+
+    for i in range(workers):
+        thread = threading.Thread(target=_sniff_worker,
+                                  args=(pending, results, cache, database,
+                                        cancelled))
+        thread.daemon = True
+        thread.start()
+
+    modified = False
+    try:
+        for i in range(len(file_names)):
+            file_name, key, mime_type = results.get()
+            if key is not None and mime_type is not None:
+                # The most recently used types are the last to be dropped
+                cache.pop(key, None)
+                cache[key] = mime_type
+                modified = True
+            yield file_name, mime_type
+    finally:
+        # Stops the workers if the caller did not consume every result
+        cancelled.set()
+        if modified:
+            _save_sniff_cache()
+
+
 def get_from_file_name(file_name):
+    if SugarExt is None:
+        database = mimecache.get_database()
+        if database is not None:
+            mime_types = database.get_for_file_name(file_name)
+            if mime_types:
+                return mime_types[0]
+        return 'application/octet-stream'
+
     return SugarExt.mime_get_mime_type_from_file_name(file_name)
 
 
@@ -155,13 +325,16 @@ def get_mime_description(mime_type):
 
 
 def get_mime_parents(mime_type):
-    return SugarExt.mime_list_mime_parents(mime_type)
+    if SugarExt is None:
+        database = mimecache.get_database()
+        if database is None:
+            return []
+        return database.get_parents(mime_type)
 
+    return SugarExt.mime_list_mime_parents(mime_type)
 
-def get_primary_extension(mime_type):
-    global _extensions
-    global _globs_timestamps
 
+def _get_mime_data_dirs():
     dirs = []
 
     if 'XDG_DATA_HOME' in os.environ:
@@ -174,38 +347,148 @@ def get_primary_extension(mime_type):
     else:
         dirs.extend(['/usr/local/share/', '/usr/share/'])
 
-    timestamps = []
-    globs_path_list = []
-    for f in dirs:
-        globs_path = os.path.join(f, 'mime', 'globs')
-        if os.path.exists(globs_path):
-            mtime = os.stat(globs_path).st_mtime
-            timestamps.append([globs_path, mtime])
-            globs_path_list.append(globs_path)
+    return [os.path.join(data_dir, 'mime') for data_dir in dirs]
+
+
+class _GlobsIndex(object):
+    """Extension lookups over the globs files of the MIME database
+
+    The globs2 file of each MIME directory is preferred, as it carries the
+    weight of every glob, and the older globs file is read when it is
+    missing. Both files are watched with a Gio.FileMonitor and the index is
+    reloaded on the first lookup after any of them changed.
+    """
+
+    def __init__(self):
+        self._extensions = None
+        self._types = None
+        self._monitors = []
+
+        for mime_dir in _get_mime_data_dirs():
+            for name in ['globs2', 'globs']:
+                globs_file = Gio.File.new_for_path(os.path.join(mime_dir,
+                                                                name))
+                try:
+                    monitor = globs_file.monitor_file(
+                        Gio.FileMonitorFlags.NONE, None)
+                except GLib.GError:
+                    logging.exception('Cannot monitor %s',
+                                      globs_file.get_path())
+                    continue
+                monitor.connect('changed', self.__globs_changed_cb)
+                self._monitors.append(monitor)
+
+    def __globs_changed_cb(self, monitor, changed_file, other_file,
+                           event_type):
+        self._extensions = None
+        self._types = None
+
+    def _read_globs(self, mime_dir):
+        """Yield (weight, mime_type, glob, case_sensitive) tuples"""
+        globs2_path = os.path.join(mime_dir, 'globs2')
+        globs_path = os.path.join(mime_dir, 'globs')
+        if os.path.exists(globs2_path):
+            with open(globs2_path) as globs_file:
+                for line in globs_file:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    fields = line.split(':')
+                    if len(fields) < 3:
+                        continue
+                    try:
+                        weight = int(fields[0])
+                    except ValueError:
+                        continue
+                    flags = fields[3].split(',') if len(fields) > 3 else []
+                    yield weight, fields[1], fields[2], 'cs' in flags
+        elif os.path.exists(globs_path):
+            with open(globs_path) as globs_file:
+                for line in globs_file:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    fields = line.split(':')
+                    if len(fields) == 2:
+                        yield 50, fields[0], fields[1], False
+
+    def _load(self):
+        extensions = {}
+        types = {}
+        # The first glob of the highest weight wins, so that the user MIME
+        # directory takes precedence and the primary glob of a MIME type,
+        # listed first, is used as its extension
+        extension_weights = {}
+        type_weights = {}
+
+        for mime_dir in _get_mime_data_dirs():
+            for weight, mime_type, glob, case_sensitive in \
+                    self._read_globs(mime_dir):
+                if not glob.startswith('*.'):
+                    continue
+                extension = glob[2:]
+                if not extension or '*' in extension or '?' in extension or \
+                        '[' in extension:
+                    continue
+
+                if weight > extension_weights.get(mime_type, -1):
+                    extensions[mime_type] = extension
+                    extension_weights[mime_type] = weight
 
-    if timestamps != _globs_timestamps:
-        # Clear the old extensions list
-        _extensions = {}
+                # Case sensitive globs are matched before the others
+                if case_sensitive:
+                    key = (True, extension)
+                else:
+                    key = (False, extension.lower())
+                if weight > type_weights.get(key, -1):
+                    types[key] = mime_type
+                    type_weights[key] = weight
 
         # FIXME Properly support these types in the system. (#4855)
-        _extensions['audio/ogg'] = 'ogg'
-        _extensions['video/ogg'] = 'ogg'
-
-        for globs_path in globs_path_list:
-            globs_file = open(globs_path)
-            for line in globs_file.readlines():
-                line = line.strip()
-                if not line.startswith('#'):
-                    line_type, glob = line.split(':')
-                    if glob.startswith('*.'):
-                        _extensions[line_type] = glob[2:]
-
-        _globs_timestamps = timestamps
-
-    if mime_type in _extensions:
-        return _extensions[mime_type]
-    else:
-        return None
+        extensions['audio/ogg'] = 'ogg'
+        extensions['video/ogg'] = 'ogg'
+
+        self._extensions = extensions
+        self._types = types
+
+    def get_extension(self, mime_type):
+        if self._extensions is None:
+            self._load()
+        return self._extensions.get(mime_type, None)
+
+    def get_mime_type(self, extension):
+        if self._types is None:
+            self._load()
+        if (True, extension) in self._types:
+            return self._types[(True, extension)]
+        return self._types.get((False, extension.lower()), None)
+
+
+_globs_index = None
+
+
+def _get_globs_index():
+    global _globs_index
+
+    if _globs_index is None:
+        _globs_index = _GlobsIndex()
+    return _globs_index
+
+
+def get_primary_extension(mime_type):
+    return _get_globs_index().get_extension(mime_type)
+
+
+def get_for_extension(extension):
+    """Get the MIME type registered for a file name extension
+
+    Keyword arguments:
+    extension -- the extension, without the leading dot
+
+    Returns the MIME type whose glob has the highest weight, or None if no
+    glob matches the extension.
+    """
+    return _get_globs_index().get_mime_type(extension.lstrip('.'))
 
 
 _MIME_TYPE_BLACK_LIST = [
@@ -278,8 +561,45 @@ def _file_looks_like_text(file_name):
     return False
 
 
+def _get_generic_types_index():
+    global _generic_types_index
+
+    if _generic_types_index is None:
+        _generic_types_index = {}
+        # Reversed so that the first generic type listing a MIME type wins
+        for generic_type in reversed(_get_generic_types()):
+            for mime_type in generic_type['types']:
+                _generic_types_index[mime_type] = generic_type
+    return _generic_types_index
+
+
 def _get_generic_type_for_mime(mime_type):
-    for generic_type in _generic_types:
-        if mime_type in generic_type['types']:
-            return generic_type
-    return None
+    index = _get_generic_types_index()
+    if mime_type in index:
+        return index[mime_type]
+
+    if mime_type in _generic_types_cache:
+        return _generic_types_cache[mime_type]
+
+    # Breadth first search of the MIME parents, so that the closest
+    # ancestor decides
+    generic_type = None
+    visited = set([mime_type])
+    pending = [mime_type]
+    while pending and generic_type is None:
+        parents = []
+        for pending_type in pending:
+            for parent in get_mime_parents(pending_type) or []:
+                if parent in visited:
+                    continue
+                visited.add(parent)
+                if parent in index:
+                    generic_type = index[parent]
+                    break
+                parents.append(parent)
+            if generic_type is not None:
+                break
+        pending = parents
+
+    _generic_types_cache[mime_type] = generic_type
+    return generic_type
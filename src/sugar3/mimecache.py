@@ -0,0 +1,429 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Reader of the mime.cache files written by update-mime-database
+
+The caches are mapped in memory and looked up in place, following the
+algorithms of the xdgmime library, so that MIME types can be guessed from
+Python threads without going through SugarExt.
+
+UNSTABLE.
+"""
+
+import os
+import mmap
+import stat
+import struct
+import fnmatch
+import logging
+import threading
+
+from sugar3 import util
+
+
+# Number of file name lookups remembered by a MimeDatabase
+GLOB_RESULTS_CACHE_SIZE = 1024
+
+DEFAULT_MIME_TYPE = 'application/octet-stream'
+
+_SUPPORTED_MAJOR_VERSION = 1
+_MIN_MINOR_VERSION = 1
+
+_UINT32 = struct.Struct('>I')
+_UINT32_PAIR = struct.Struct('>II')
+_UINT32_TRIPLE = struct.Struct('>III')
+_HEADER = struct.Struct('>HHIIIIIII')
+_MATCH = struct.Struct('>IIII')
+_MATCHLET = struct.Struct('>IIIIIIII')
+
+_CASE_SENSITIVE = 0x100
+_WEIGHT_MASK = 0xff
+
+
+class MimeCacheError(Exception):
+    pass
+
+
+def _ascii_lower(name):
+    return ''.join([c.lower() if ord(c) < 0x80 else c for c in name])
+
+
+class MimeCache(object):
+    """One mime.cache file, mapped in memory"""
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            try:
+                self._buffer = mmap.mmap(f.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError), e:
+                raise MimeCacheError('Cannot map %s: %s' % (path, e))
+
+        if len(self._buffer) < _HEADER.size:
+            raise MimeCacheError('%s is truncated' % path)
+
+        (major, minor, self._alias_list, self._parent_list,
+         self._literal_list, self._suffix_tree, self._glob_list,
+         self._magic_list, namespace_list) = \
+            _HEADER.unpack_from(self._buffer, 0)
+        if major != _SUPPORTED_MAJOR_VERSION or minor < _MIN_MINOR_VERSION:
+            raise MimeCacheError('%s has unsupported version %d.%d' %
+                                 (path, major, minor))
+
+        self.max_extent = self._get_uint32(self._magic_list + 4)
+
+    def _get_uint32(self, offset):
+        return _UINT32.unpack_from(self._buffer, offset)[0]
+
+    def _get_string(self, offset):
+        end = self._buffer.find('\0', offset)
+        return self._buffer[offset:end]
+
+    def _search(self, list_offset, entry_size, key):
+        """Binary search of a list sorted by the string its entries point
+        to first, returning the offset of the matching entry or None"""
+        low = 0
+        high = self._get_uint32(list_offset) - 1
+        while low <= high:
+            middle = (low + high) / 2
+            entry = list_offset + 4 + entry_size * middle
+            value = self._get_string(self._get_uint32(entry))
+            if value < key:
+                low = middle + 1
+            elif value > key:
+                high = middle - 1
+            else:
+                return entry
+        return None
+
+    def unalias(self, mime_type):
+        entry = self._search(self._alias_list, 8, mime_type)
+        if entry is None:
+            return None
+        return self._get_string(self._get_uint32(entry + 4))
+
+    def get_parents(self, mime_type):
+        entry = self._search(self._parent_list, 8, mime_type)
+        if entry is None:
+            return []
+        parents_offset = self._get_uint32(entry + 4)
+        return [self._get_string(self._get_uint32(parents_offset + 4 + 4 * i))
+                for i in range(self._get_uint32(parents_offset))]
+
+    def lookup_literal(self, name, case_sensitive_check):
+        entry = self._search(self._literal_list, 12, name)
+        if entry is None:
+            return []
+        mime_type_offset, weight = _UINT32_PAIR.unpack_from(self._buffer,
+                                                            entry + 4)
+        if not case_sensitive_check and weight & _CASE_SENSITIVE:
+            return []
+        return [(self._get_string(mime_type_offset), weight & _WEIGHT_MASK)]
+
+    def lookup_suffix(self, name, case_sensitive_check):
+        """Match the name against the *.suffix globs of the reverse suffix
+        tree, returning a list of (mime_type, weight) tuples"""
+        characters = [ord(c) for c in name.decode('utf-8', 'replace')]
+        n_roots, first_root = _UINT32_PAIR.unpack_from(self._buffer,
+                                                       self._suffix_tree)
+        return self._lookup_suffix_node(n_roots, first_root, characters,
+                                        len(characters), case_sensitive_check)
+
+    def _lookup_suffix_node(self, n_nodes, offset, characters, length,
+                            case_sensitive_check):
+        character = characters[length - 1]
+        low = 0
+        high = n_nodes - 1
+        while low <= high:
+            middle = (low + high) / 2
+            node = offset + 12 * middle
+            node_character, n_children, first_child = \
+                _UINT32_TRIPLE.unpack_from(self._buffer, node)
+            if node_character < character:
+                low = middle + 1
+            elif node_character > character:
+                high = middle - 1
+            else:
+                matches = []
+                if length > 1:
+                    matches = self._lookup_suffix_node(
+                        n_children, first_child, characters, length - 1,
+                        case_sensitive_check)
+                if matches:
+                    return matches
+
+                # The leaves, with a null character, are sorted first
+                for i in range(n_children):
+                    leaf_character, mime_type_offset, weight = \
+                        _UINT32_TRIPLE.unpack_from(self._buffer,
+                                                   first_child + 12 * i)
+                    if leaf_character != 0:
+                        break
+                    if case_sensitive_check or \
+                            not weight & _CASE_SENSITIVE:
+                        matches.append((self._get_string(mime_type_offset),
+                                        weight & _WEIGHT_MASK))
+                return matches
+        return []
+
+    def lookup_fnmatch(self, name):
+        matches = []
+        n_globs = self._get_uint32(self._glob_list)
+        for i in range(n_globs - 1, -1, -1):
+            glob_offset, mime_type_offset, weight = \
+                _UINT32_TRIPLE.unpack_from(self._buffer,
+                                           self._glob_list + 4 + 12 * i)
+            if fnmatch.fnmatchcase(name, self._get_string(glob_offset)):
+                matches.append((self._get_string(mime_type_offset),
+                                weight & _WEIGHT_MASK))
+        return matches
+
+    def _matchlet_matches_data(self, offset, data):
+        range_start, range_length, word_size, value_length, value_offset, \
+            mask_offset, n_children, first_child = \
+            _MATCHLET.unpack_from(self._buffer, offset)
+
+        matched = False
+        if mask_offset == 0:
+            value = self._buffer[value_offset:value_offset + value_length]
+            end = min(len(data), range_start + range_length - 1 +
+                      value_length)
+            matched = data.find(value, range_start, end) != -1
+            range_length = 0
+
+        for i in range(range_start, range_start + range_length):
+            if i + value_length > len(data):
+                break
+            matched = True
+            for j in range(value_length):
+                mask = ord(self._buffer[mask_offset + j])
+                if ord(self._buffer[value_offset + j]) & mask != \
+                        ord(data[i + j]) & mask:
+                    matched = False
+                    break
+            if matched:
+                break
+
+        if not matched:
+            return False
+        if n_children == 0:
+            return True
+        for i in range(n_children):
+            if self._matchlet_matches_data(first_child + _MATCHLET.size * i,
+                                           data):
+                return True
+        return False
+
+    def lookup_magic(self, data):
+        """Return a (mime_type, priority) tuple for the first magic rule
+        matching the data, or (None, 0)"""
+        n_matches = self._get_uint32(self._magic_list)
+        first_match = self._get_uint32(self._magic_list + 8)
+        for i in range(n_matches):
+            priority, mime_type_offset, n_matchlets, first_matchlet = \
+                _MATCH.unpack_from(self._buffer, first_match + _MATCH.size * i)
+            for j in range(n_matchlets):
+                if self._matchlet_matches_data(
+                        first_matchlet + _MATCHLET.size * j, data):
+                    return self._get_string(mime_type_offset), priority
+        return None, 0
+
+    def close(self):
+        self._buffer.close()
+
+
+class MimeDatabase(object):
+    """The MIME database made of the mime.cache files of several
+    directories, the first ones taking precedence"""
+
+    def __init__(self, caches):
+        self._caches = caches
+        self.max_extent = max([cache.max_extent for cache in caches] or [0])
+
+        self._aliases = {}
+        self._parents = {}
+        self._lock = threading.Lock()
+        self._globs_results = util.LRU(GLOB_RESULTS_CACHE_SIZE)
+
+    def unalias(self, mime_type):
+        if mime_type not in self._aliases:
+            target = mime_type
+            for cache in self._caches:
+                alias_target = cache.unalias(mime_type)
+                if alias_target is not None:
+                    target = alias_target
+                    break
+            self._aliases[mime_type] = target
+        return self._aliases[mime_type]
+
+    def get_parents(self, mime_type):
+        mime_type = self.unalias(mime_type)
+        if mime_type not in self._parents:
+            parents = []
+            for cache in self._caches:
+                for parent in cache.get_parents(mime_type):
+                    if parent not in parents:
+                        parents.append(parent)
+            self._parents[mime_type] = parents
+        return self._parents[mime_type]
+
+    def is_subclass(self, mime_type, base):
+        mime_type = self.unalias(mime_type)
+        base = self.unalias(base)
+        if mime_type == base:
+            return True
+        if base.endswith('/*') and \
+                mime_type.split('/')[0] == base.split('/')[0]:
+            return True
+        if base == 'text/plain' and mime_type.startswith('text/'):
+            return True
+        if base == DEFAULT_MIME_TYPE and not mime_type.startswith('inode/'):
+            return True
+        for parent in self.get_parents(mime_type):
+            if self.is_subclass(parent, base):
+                return True
+        return False
+
+    def _lookup_file_name(self, name):
+        lower_name = _ascii_lower(name)
+
+        for lookup_name, case_sensitive_check in [(lower_name, False),
+                                                  (name, True)]:
+            for cache in self._caches:
+                matches = cache.lookup_literal(lookup_name,
+                                               case_sensitive_check)
+                if matches:
+                    return [mime_type for mime_type, weight in matches]
+
+        matches = []
+        for cache in self._caches:
+            matches.extend(cache.lookup_suffix(lower_name, False))
+        if len(matches) < 2:
+            for cache in self._caches:
+                matches.extend(cache.lookup_suffix(name, True))
+        if len(matches) < 2:
+            for cache in self._caches:
+                cache_matches = cache.lookup_fnmatch(name)
+                if cache_matches:
+                    matches.extend(cache_matches)
+                    break
+
+        weights = {}
+        mime_types = []
+        for mime_type, weight in matches:
+            if mime_type not in weights:
+                mime_types.append(mime_type)
+            weights[mime_type] = max(weight, weights.get(mime_type, 0))
+        mime_types.sort(key=lambda mime_type: -weights[mime_type])
+        return mime_types
+
+    def get_for_file_name(self, name):
+        """Return the MIME types whose globs match the base name of a file,
+        by decreasing weight"""
+        name = os.path.basename(name)
+        # The names in the cache files are UTF-8 encoded
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        with self._lock:
+            if name in self._globs_results:
+                return list(self._globs_results[name])
+
+        mime_types = self._lookup_file_name(name)
+        with self._lock:
+            self._globs_results[name] = mime_types
+        return list(mime_types)
+
+    def get_for_data(self, data, glob_mime_types=None):
+        """Guess the MIME type of some content
+
+        Keyword arguments:
+        data -- the first max_extent bytes of the content
+        glob_mime_types -- the MIME types guessed from its file name
+
+        Returns None if the content matches no magic rule and no MIME type
+        was guessed from the file name.
+        """
+        glob_mime_types = glob_mime_types or []
+
+        mime_type = None
+        priority = 0
+        for cache in self._caches:
+            cache_mime_type, cache_priority = cache.lookup_magic(data)
+            if cache_priority > priority:
+                mime_type = cache_mime_type
+                priority = cache_priority
+
+        if mime_type is not None:
+            # Prefer a MIME type from the file name that specializes the
+            # one found in the content
+            for glob_mime_type in glob_mime_types:
+                if self.is_subclass(glob_mime_type, mime_type):
+                    return glob_mime_type
+            return mime_type
+
+        if glob_mime_types:
+            return glob_mime_types[0]
+        return None
+
+    def get_for_file(self, path):
+        """Guess the MIME type of a file from its name and its content"""
+        file_stat = os.stat(path)
+        if not stat.S_ISREG(file_stat.st_mode):
+            return DEFAULT_MIME_TYPE
+
+        glob_mime_types = self.get_for_file_name(path)
+        if len(glob_mime_types) == 1:
+            return glob_mime_types[0]
+
+        with open(path, 'rb') as f:
+            data = f.read(self.max_extent)
+        return self.get_for_data(data, glob_mime_types) or DEFAULT_MIME_TYPE
+
+
+def _get_mime_dirs():
+    dirs = [os.environ.get('XDG_DATA_HOME',
+                           os.path.expanduser('~/.local/share'))]
+    dirs.extend(os.environ.get('XDG_DATA_DIRS',
+                               '/usr/local/share:/usr/share').split(':'))
+    return [os.path.join(data_dir, 'mime') for data_dir in dirs if data_dir]
+
+
+_database = None
+
+
+def get_database():
+    """Get the MimeDatabase of the mime.cache files of the XDG data
+    directories, or None if there are none"""
+    global _database
+
+    if _database is None:
+        caches = []
+        for mime_dir in _get_mime_dirs():
+            cache_path = os.path.join(mime_dir, 'mime.cache')
+            if not os.path.exists(cache_path):
+                continue
+            try:
+                caches.append(MimeCache(cache_path))
+            except (IOError, MimeCacheError):
+                logging.exception('Cannot read %s', cache_path)
+        _database = MimeDatabase(caches)
+
+    if not _database._caches:
+        return None
+    return _database
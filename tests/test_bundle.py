@@ -15,11 +15,16 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import os
+import shutil
+import tempfile
 import unittest
 import subprocess
+import zipfile
 
 from sugar3.bundle.helpers import bundle_from_dir, bundle_from_archive
 from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle.bundle import MalformedBundleException
+from sugar3.bundle.bundle import replace_dir, wait_for_trash
 from sugar3.bundle.contentbundle import ContentBundle
 
 tests_dir = os.path.dirname(__file__)
@@ -47,3 +52,111 @@ class TestBundle(unittest.TestCase):
         subprocess.check_call(["zip", "-r", "sample-1.xol", "sample.content"])
         bundle = bundle_from_archive("./sample-1.xol")
         self.assertIsInstance(bundle, ContentBundle)
+
+    def test_zipped_bundle_files(self):
+        os.chdir(SAMPLE_ACTIVITY_PATH)
+        subprocess.check_call(["./setup.py", "dist_xo"])
+        bundle = bundle_from_archive(os.path.join(".", "dist", "Sample-1.xo"))
+        self.assertTrue(bundle.is_dir('activity'))
+        self.assertTrue(bundle.is_file('activity/activity.info'))
+        self.assertFalse(bundle.is_dir('activity/activity.info'))
+        self.assertFalse(bundle.is_file('activity/missing.info'))
+        self.assertIn('activity.info', bundle.list_dir('activity'))
+        self.assertIsNone(bundle.list_dir('missing'))
+        self.assertEqual(bundle.get_file('activity/activity.info').readline(),
+                         '[Activity]\n')
+        self.assertTrue(bundle.get_icon_data().startswith('<?xml'))
+
+
+class TestBundleInstall(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._activities_path = os.path.join(self._root, 'Activities')
+        os.environ['SUGAR_ACTIVITIES_PATH'] = self._activities_path
+        os.environ['SUGAR_HOME'] = os.path.join(self._root, 'home')
+        os.environ['XDG_DATA_HOME'] = os.path.join(self._root, 'share')
+
+    def tearDown(self):
+        wait_for_trash()
+        shutil.rmtree(self._root)
+
+    def _create_xo(self, name, corrupted=False, version='1'):
+        with open(os.path.join(SAMPLE_ACTIVITY_PATH,
+                               'activity', 'activity.info')) as f:
+            info = f.read()
+        info = info.replace('activity_version = 1',
+                            'activity_version = %s' % version)
+        path = os.path.join(self._root, name)
+        xo = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        xo.writestr('Sample.activity/activity/activity.info', info)
+        xo.writestr('Sample.activity/activity.py', 'pass\n' * 1000)
+        xo.close()
+
+        if corrupted:
+            xo = zipfile.ZipFile(path)
+            member = xo.getinfo('Sample.activity/activity.py')
+            xo.close()
+            # Local header, then an invalid deflate block type
+            with open(path, 'r+b') as f:
+                f.seek(member.header_offset + 30 + len(member.filename))
+                f.write('\xff' * 4)
+        return path
+
+    def test_corrupted_member(self):
+        bundle = ActivityBundle(self._create_xo('sample.xo'))
+        install_path = bundle.install()
+
+        corrupted = ActivityBundle(self._create_xo('corrupted.xo',
+                                                   corrupted=True))
+        self.assertRaises(MalformedBundleException, corrupted.install)
+        # The installed version is left in place
+        with open(os.path.join(install_path, 'activity.py')) as f:
+            self.assertEqual(f.read(), 'pass\n' * 1000)
+
+    def test_stale_caches(self):
+        bundle = ActivityBundle(self._create_xo('sample.xo'))
+        old_cache_path = \
+            ActivityBundle(bundle.install(extract=False)).get_cache_path()
+        cache_dir = os.path.dirname(old_cache_path)
+
+        upgrade = ActivityBundle(self._create_xo('upgrade.xo', version='10'))
+        new_cache_path = \
+            ActivityBundle(upgrade.install(extract=False)).get_cache_path()
+        wait_for_trash()
+        self.assertNotEqual(new_cache_path, old_cache_path)
+        self.assertFalse(os.path.exists(old_cache_path))
+        self.assertTrue(os.path.isdir(new_cache_path))
+
+        # Extracted, the bundle does not use the cache anymore
+        upgrade.install()
+        wait_for_trash()
+        self.assertEqual([name for name in os.listdir(cache_dir)
+                          if not name.startswith('.')], [])
+
+    def test_remove_mime_icons(self):
+        xo_bundle = ActivityBundle(self._create_xo('sample.xo'))
+        install_path = xo_bundle.install()
+        bundle = ActivityBundle(install_path)
+        links = []
+        for target in [os.path.join(install_path, 'icon.svg'),
+                       os.path.join(install_path + '-old', 'icon.svg')]:
+            links.append(os.path.join(self._root, 'link%d' % len(links)))
+            os.symlink(target, links[-1])
+
+        bundle._remove_mime_icons(links)
+        # Only the links to the files of the bundle itself
+        self.assertEqual([os.path.lexists(link) for link in links],
+                         [False, True])
+
+        cache_dir = os.path.join(self._root, 'home', 'default',
+                                 'bundle-cache')
+        xo_bundle._remove_mime_icons(links)
+        self.assertFalse(os.path.exists(cache_dir))
+
+    def test_replace_dir_failure(self):
+        destination = os.path.join(self._root, 'Sample.activity')
+        os.mkdir(destination)
+        self.assertRaises(OSError, replace_dir,
+                          os.path.join(self._root, 'missing'), destination)
+        self.assertTrue(os.path.isdir(destination))
+        self.assertEqual(os.listdir(self._root), ['Sample.activity'])
@@ -0,0 +1,104 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle import bundle
+from sugar3.bundle import bundledelta
+
+tests_dir = os.path.dirname(__file__)
+data_dir = os.path.join(tests_dir, "data")
+SAMPLE_ACTIVITY_PATH = os.path.join(data_dir, 'sample.activity')
+
+
+class TestBundleDelta(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        os.environ['SUGAR_HOME'] = os.path.join(self._root, 'home')
+        os.environ['XDG_DATA_HOME'] = os.path.join(self._root, 'share')
+
+    def tearDown(self):
+        bundle.wait_for_trash()
+        shutil.rmtree(self._root)
+
+    def _create_xo(self, name, files):
+        path = os.path.join(self._root, name)
+        xo = zipfile.ZipFile(path, 'w')
+        for file_name, data in sorted(files.items()):
+            xo.writestr('Sample.activity/' + file_name, data)
+        xo.close()
+        return path
+
+    def _create_delta(self):
+        with open(os.path.join(SAMPLE_ACTIVITY_PATH,
+                               'activity', 'activity.info')) as f:
+            info = f.read()
+        old_path = self._create_xo('old.xo',
+                                   {'activity/activity.info': info,
+                                    'same.py': 'same', 'old.py': 'old'})
+        new_path = self._create_xo(
+            'new.xo',
+            {'activity/activity.info': info.replace('activity_version = 1',
+                                                    'activity_version = 2'),
+             'same.py': 'same', 'new.py': 'new'})
+        delta_path = os.path.join(self._root, 'delta')
+        bundledelta.create_delta(old_path, new_path, delta_path)
+        return old_path, new_path, delta_path
+
+    def _install(self, xo_path):
+        zipfile.ZipFile(xo_path).extractall(self._root)
+        return os.path.join(self._root, 'Sample.activity')
+
+    def test_apply_delta(self):
+        old_path, new_path_, delta_path = self._create_delta()
+        self.assertItemsEqual(
+            zipfile.ZipFile(delta_path).namelist(),
+            ['delta.json', 'contents.json', 'files/new.py',
+             'files/activity/activity.info'])
+
+        install_path = self._install(old_path)
+        updated = bundledelta.apply_delta(ActivityBundle(install_path),
+                                          delta_path)
+        self.assertEqual(updated.get_activity_version(), '2')
+        self.assertItemsEqual(os.listdir(install_path),
+                              ['activity', 'same.py', 'new.py'])
+        self.assertIsNotNone(bundledelta.read_contents(updated))
+
+    def test_wrong_version(self):
+        old_path_, new_path, delta_path = self._create_delta()
+        install_path = self._install(new_path)
+        self.assertRaises(bundledelta.InvalidDeltaException,
+                          bundledelta.apply_delta,
+                          ActivityBundle(install_path), delta_path)
+
+    def test_modified_file(self):
+        old_path, new_path_, delta_path = self._create_delta()
+        install_path = self._install(old_path)
+        # Same size, different content
+        with open(os.path.join(install_path, 'same.py'), 'w') as f:
+            f.write('SAME')
+
+        self.assertRaises(bundledelta.InvalidDeltaException,
+                          bundledelta.apply_delta,
+                          ActivityBundle(install_path), delta_path)
+        # The installed version is left untouched
+        self.assertItemsEqual(os.listdir(install_path),
+                              ['activity', 'same.py', 'old.py'])
@@ -0,0 +1,92 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sugar3.bundle.bundleindex import BundleIndex
+
+tests_dir = os.path.dirname(__file__)
+data_dir = os.path.join(tests_dir, "data")
+SAMPLE_ACTIVITY_PATH = os.path.join(data_dir, 'sample.activity')
+
+
+class TestBundleIndex(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._activities_path = os.path.join(self._root, 'Activities')
+        os.mkdir(self._activities_path)
+        self._index_path = os.path.join(self._root, 'bundle-index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _install(self, name):
+        path = os.path.join(self._activities_path, name)
+        shutil.copytree(SAMPLE_ACTIVITY_PATH, path)
+        return path
+
+    def test_scan(self):
+        self._install('Sample.activity')
+        bundles = BundleIndex(self._index_path).scan([self._activities_path])
+        self.assertEqual(len(bundles), 1)
+        self.assertTrue(os.path.exists(self._index_path))
+
+        # Bundles are restored from the index in a new instance
+        bundles = BundleIndex(self._index_path).scan([self._activities_path])
+        self.assertEqual(bundles[0].get_bundle_id(), 'org.sugarlabs.Sample')
+        self.assertEqual(bundles[0].get_name(), 'Sample')
+
+    def test_removed_bundle(self):
+        path = self._install('Sample.activity')
+        index = BundleIndex(self._index_path)
+        index.scan([self._activities_path])
+
+        shutil.rmtree(path)
+        self.assertEqual(index.scan([self._activities_path]), [])
+        self.assertIsNone(index.get_bundle(path))
+
+    def test_edited_translation(self):
+        path = self._install('Sample.activity')
+        linfo_dir = os.path.join(path, 'locale', 'es')
+        os.makedirs(linfo_dir)
+        linfo_path = os.path.join(linfo_dir, 'activity.linfo')
+        with open(linfo_path, 'w') as f:
+            f.write('[Activity]\nname = Muestra\n')
+
+        language = os.environ.get('LANGUAGE')
+        os.environ['LANGUAGE'] = 'es'
+        try:
+            bundles = BundleIndex(self._index_path).scan(
+                [self._activities_path])
+            self.assertEqual(bundles[0].get_name(), 'Muestra')
+
+            # Edited in place, the directories do not change
+            with open(linfo_path, 'w') as f:
+                f.write('[Activity]\nname = Ejemplo\n')
+            mtime = os.stat(linfo_path).st_mtime + 10
+            os.utime(linfo_path, (mtime, mtime))
+
+            bundles = BundleIndex(self._index_path).scan(
+                [self._activities_path])
+            self.assertEqual(bundles[0].get_name(), 'Ejemplo')
+        finally:
+            if language is None:
+                del os.environ['LANGUAGE']
+            else:
+                os.environ['LANGUAGE'] = language
@@ -0,0 +1,108 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import zipfile
+
+from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle.bundle import wait_for_trash
+from sugar3.bundle import bundlestore
+from sugar3.bundle.bundlestore import BundleStore, unshare
+
+tests_dir = os.path.dirname(__file__)
+data_dir = os.path.join(tests_dir, "data")
+SAMPLE_ACTIVITY_PATH = os.path.join(data_dir, 'sample.activity')
+
+
+class TestBundleStore(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._store = BundleStore(os.path.join(self._root, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _create_bundle(self, name, files):
+        path = os.path.join(self._root, name)
+        for file_name, data in files.items():
+            file_path = os.path.join(path, file_name)
+            if not os.path.isdir(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            with open(file_path, 'w') as f:
+                f.write(data)
+        return path
+
+    def test_share_and_gc(self):
+        first = self._create_bundle('First.activity',
+                                    {'icons/a.svg': '<svg/>', 'one': '1'})
+        second = self._create_bundle('Second.activity',
+                                     {'icons/b.svg': '<svg/>', 'two': '2'})
+        self.assertEqual(self._store.add_tree(first), 0)
+        self.assertEqual(self._store.add_tree(second), len('<svg/>'))
+
+        first_icon = os.path.join(first, 'icons', 'a.svg')
+        second_icon = os.path.join(second, 'icons', 'b.svg')
+        self.assertEqual(os.stat(first_icon).st_ino,
+                         os.stat(second_icon).st_ino)
+        self.assertFalse(os.stat(first_icon).st_mode & stat.S_IWUSR)
+
+        unshare(second_icon)
+        self.assertNotEqual(os.stat(first_icon).st_ino,
+                            os.stat(second_icon).st_ino)
+        with open(second_icon) as f:
+            self.assertEqual(f.read(), '<svg/>')
+
+        shutil.rmtree(first)
+        self.assertEqual(self._store.gc(), len('<svg/>') + len('1'))
+        self.assertEqual(self._store.gc(), 0)
+
+
+class TestSharedInstall(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        os.environ['SUGAR_ACTIVITIES_PATH'] = \
+            os.path.join(self._root, 'Activities')
+        os.environ['SUGAR_HOME'] = os.path.join(self._root, 'home')
+        os.environ['XDG_DATA_HOME'] = os.path.join(self._root, 'share')
+        self._store = bundlestore._store
+        bundlestore._store = BundleStore(os.path.join(self._root, 'store'))
+
+    def tearDown(self):
+        wait_for_trash()
+        bundlestore._store = self._store
+        shutil.rmtree(self._root)
+
+    def test_gc_after_uninstall(self):
+        with open(os.path.join(SAMPLE_ACTIVITY_PATH,
+                               'activity', 'activity.info')) as f:
+            info = f.read()
+        xo_path = os.path.join(self._root, 'Sample.xo')
+        xo = zipfile.ZipFile(xo_path, 'w')
+        xo.writestr('Sample.activity/activity/activity.info', info)
+        xo.writestr('Sample.activity/activity.py', 'pass\n')
+        xo.close()
+
+        install_path = ActivityBundle(xo_path).install(share_files=True)
+        store_path = os.path.join(self._root, 'store')
+        self.assertNotEqual(os.listdir(store_path), [])
+
+        ActivityBundle(install_path).uninstall()
+        wait_for_trash()
+        self.assertEqual(os.listdir(store_path), [])
@@ -0,0 +1,80 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle.bundleupdates import Catalog
+
+tests_dir = os.path.dirname(__file__)
+data_dir = os.path.join(tests_dir, "data")
+SAMPLE_ACTIVITY_PATH = os.path.join(data_dir, 'sample.activity')
+
+JSON_CATALOG = '''[
+  {"bundle_id": "org.sugarlabs.Sample", "version": "2",
+   "url": "http://example.org/Sample-2.xo"},
+  {"bundle_id": "org.sugarlabs.Sample", "version": "10",
+   "url": "http://example.org/Sample-10.xo"},
+  {"bundle_id": "org.sugarlabs.Sample", "version": "9.1"},
+  {"bundle_id": "org.sugarlabs.Other", "version": "3"},
+  {"bundle_id": "org.sugarlabs.Broken", "version": "1.02"}
+]
+'''
+
+XML_CATALOG = '''<?xml version="1.0"?>
+<catalog>
+  <bundle bundle_id="org.sugarlabs.Sample" version="1.0"/>
+  <bundle bundle_id="org.sugarlabs.Other" version="4"/>
+</catalog>
+'''
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._bundle = ActivityBundle(SAMPLE_ACTIVITY_PATH)
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _write(self, content):
+        path = os.path.join(self._root, 'catalog')
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_json_catalog(self):
+        catalog = Catalog(self._write(JSON_CATALOG))
+        self.assertEqual(catalog.get_newest('org.sugarlabs.Sample'),
+                         ('10', 'http://example.org/Sample-10.xo'))
+        self.assertEqual(catalog.get_newest('org.sugarlabs.Other'),
+                         ('3', None))
+        self.assertIsNone(catalog.get_newest('org.sugarlabs.Broken'))
+
+        updates = catalog.get_updates([self._bundle])
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0].bundle_id, 'org.sugarlabs.Sample')
+        self.assertEqual(updates[0].version, '10')
+
+    def test_xml_catalog(self):
+        catalog = Catalog(self._write(XML_CATALOG))
+        self.assertEqual(catalog.get_newest('org.sugarlabs.Other'),
+                         ('4', None))
+        # The same version is not an update
+        self.assertEqual(catalog.get_updates([self._bundle]), [])
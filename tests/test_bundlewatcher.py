@@ -0,0 +1,112 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gi.repository import GLib
+
+from sugar3.bundle import bundleindex
+from sugar3.bundle import bundlewatcher
+
+tests_dir = os.path.dirname(__file__)
+data_dir = os.path.join(tests_dir, "data")
+SAMPLE_ACTIVITY_PATH = os.path.join(data_dir, 'sample.activity')
+
+
+class TestBundleWatcher(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._activities_path = os.path.join(self._root, 'Activities')
+        os.mkdir(self._activities_path)
+        library_path = os.path.join(self._root, 'Library')
+        os.mkdir(library_path)
+
+        self._index = bundleindex._index
+        bundleindex._index = bundleindex.BundleIndex(
+            os.path.join(self._root, 'bundle-index.json'))
+        self._debounce_delay = bundlewatcher.DEBOUNCE_DELAY
+        bundlewatcher.DEBOUNCE_DELAY = 50
+
+        self._install('Sample.activity')
+        self._watcher = bundlewatcher.BundleWatcher(self._activities_path,
+                                                    library_path)
+        self._events = []
+        for signal_name in ['bundle-added', 'bundle-updated',
+                            'bundle-removed']:
+            self._watcher.connect(signal_name, self.__bundle_cb, signal_name)
+        self._watcher.start()
+
+    def tearDown(self):
+        self._watcher.stop()
+        bundlewatcher.DEBOUNCE_DELAY = self._debounce_delay
+        bundleindex._index = self._index
+        shutil.rmtree(self._root)
+
+    def __bundle_cb(self, watcher, bundle, signal_name):
+        self._events.append((signal_name,
+                             os.path.basename(bundle.get_path())))
+
+    def _install(self, name):
+        path = os.path.join(self._activities_path, name)
+        shutil.copytree(SAMPLE_ACTIVITY_PATH, path)
+        return path
+
+    def _get_info_path(self, name):
+        return os.path.join(self._activities_path, name, 'activity',
+                            'activity.info')
+
+    def _wait(self):
+        main_loop = GLib.MainLoop()
+        GLib.timeout_add(bundlewatcher.DEBOUNCE_DELAY * 10, main_loop.quit)
+        main_loop.run()
+        events = self._events
+        self._events = []
+        return events
+
+    def test_scan(self):
+        self.assertEqual([os.path.basename(bundle.get_path())
+                          for bundle in self._watcher.get_bundles()],
+                         ['Sample.activity'])
+
+    def test_added_and_removed(self):
+        path = self._install('Other.activity')
+        self.assertEqual(self._wait(), [('bundle-added', 'Other.activity')])
+
+        shutil.rmtree(path)
+        self.assertEqual(self._wait(),
+                         [('bundle-removed', 'Other.activity')])
+        self.assertIsNone(self._watcher.get_bundle(path))
+
+    def test_updated(self):
+        info_path = self._get_info_path('Sample.activity')
+        with open(info_path) as f:
+            info = f.read()
+        with open(info_path, 'w') as f:
+            f.write(info.replace('activity_version = 1',
+                                 'activity_version = 2'))
+        self.assertEqual(self._wait(),
+                         [('bundle-updated', 'Sample.activity')])
+        bundle = self._watcher.get_bundle(
+            os.path.join(self._activities_path, 'Sample.activity'))
+        self.assertEqual(bundle.get_activity_version(), '2')
+
+    def test_attributes_changed(self):
+        # A change of permissions leaves the bundle as it was
+        os.chmod(self._get_info_path('Sample.activity'), 0600)
+        self.assertEqual(self._wait(), [])
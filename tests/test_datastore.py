@@ -0,0 +1,784 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import dbus
+import fcntl
+from gi.repository import GLib
+
+# Keep the import from connecting to the session bus
+_local_path = tempfile.mkdtemp()
+os.environ['SUGAR_LOCAL_DATASTORE'] = _local_path
+
+from sugar3.datastore import datastore
+
+
+class _FakeDataStore(object):
+    """Keeps the asynchronous calls in flight until the test replies"""
+
+    def __init__(self):
+        self.calls = []
+        self.max_in_flight = 0
+        self.failing = set()
+
+    def _call(self, object_id, reply_handler, error_handler):
+        if object_id in self.failing:
+            raise OSError('Cannot reach %s' % object_id)
+        self.calls.append((object_id, reply_handler, error_handler))
+        self.max_in_flight = max(self.max_in_flight, len(self.calls))
+
+    def connect_to_signal(self, signal_name, handler_function,
+                          dbus_interface=None, **kwargs):
+        return None
+
+    def delete(self, object_id, reply_handler, error_handler, timeout):
+        self._call(object_id, reply_handler, error_handler)
+
+    def get_properties(self, object_id, reply_handler, error_handler,
+                       byte_arrays, timeout):
+        self._call(object_id, reply_handler, error_handler)
+
+    def find(self, query, properties, reply_handler, error_handler,
+             byte_arrays, timeout):
+        self._call(query['uid'], reply_handler, error_handler)
+
+    def update(self, object_id, properties, file_path, transfer_ownership,
+               reply_handler, error_handler, timeout):
+        self._call(object_id, reply_handler, error_handler)
+
+    def reply(self, index, *args):
+        object_id, reply_handler, error_handler_ = self.calls.pop(index)
+        reply_handler(*args)
+
+    def fail(self, index, error):
+        object_id, reply_handler_, error_handler = self.calls.pop(index)
+        error_handler(error)
+
+
+class _Metadata(object):
+    def get_dictionary(self):
+        return {}
+
+    def get_complete_dictionary(self):
+        return {}
+
+
+class _Object(object):
+    metadata = _Metadata()
+
+    def __init__(self, object_id, file_path=None):
+        self.object_id = object_id
+        self._file_path = file_path
+
+    def get_file_path(self, fetch=True):
+        if self._file_path is None:
+            raise OSError('No file')
+        return self._file_path
+
+
+class TestPipelinedCalls(unittest.TestCase):
+    def setUp(self):
+        self._store = _FakeDataStore()
+        self._get_data_store = datastore._get_data_store
+        datastore._get_data_store = lambda: self._store
+        self._outcome = []
+
+    def tearDown(self):
+        datastore._get_data_store = self._get_data_store
+
+    def _reply_cb(self, results, errors):
+        self._outcome.extend([results, errors])
+
+    def test_window_limit(self):
+        datastore.delete_many(['a', 'b', 'c', 'd', 'e'], window=2,
+                              reply_handler=self._reply_cb)
+        self.assertEqual([call[0] for call in self._store.calls], ['a', 'b'])
+
+        while self._store.calls:
+            self._store.reply(0)
+        self.assertEqual(self._store.max_in_flight, 2)
+        self.assertEqual(self._outcome, [['a', 'b', 'c', 'd', 'e'], []])
+
+    def test_result_order(self):
+        datastore.get_many(['a', 'b', 'c'], window=3,
+                           reply_handler=self._reply_cb)
+        # Replies arriving in reverse order
+        for index in (2, 1, 0):
+            object_id = self._store.calls[index][0]
+            self._store.reply(index, [{'uid': object_id,
+                                       'title': object_id}], 1)
+
+        ds_objects, errors = self._outcome
+        self.assertEqual(errors, [])
+        self.assertEqual([ds_object.object_id for ds_object in ds_objects],
+                         ['a', 'b', 'c'])
+        self.assertEqual(ds_objects[2].metadata['title'], 'c')
+        for ds_object in ds_objects:
+            ds_object.destroy()
+
+    def test_error_propagation(self):
+        self._store.failing.add('b')
+        datastore.delete_many(['a', 'b', 'c'], window=1,
+                              reply_handler=self._reply_cb)
+        self._store.reply(0)
+        error = Exception('Remote error')
+        self._store.fail(0, error)
+
+        deleted, errors = self._outcome
+        self.assertEqual(deleted, ['a', None, None])
+        self.assertEqual([item for item, error_ in errors], ['b', 'c'])
+        self.assertIs(errors[1][1], error)
+
+    def test_issue_error_does_not_stop_pipeline(self):
+        datastore.write_many([_Object('broken'), _Object('a', '')],
+                             window=1, reply_handler=self._reply_cb)
+        # The write after the one that could not be issued still runs
+        self.assertEqual([call[0] for call in self._store.calls], ['a'])
+        self._store.reply(0)
+
+        object_ids, errors = self._outcome
+        self.assertEqual(object_ids, [None, 'a'])
+        self.assertEqual(errors[0][0].object_id, 'broken')
+        self.assertTrue(isinstance(errors[0][1], OSError))
+
+
+class _FileDataStore(object):
+    def __init__(self, path):
+        self._path = path
+        self.writes = []
+
+    def connect_to_signal(self, signal_name, handler_function,
+                          dbus_interface=None, **kwargs):
+        return None
+
+    def _copy_file(self):
+        file_path = os.path.join(self._path, 'copy')
+        with open(file_path, 'w') as f:
+            f.write('content')
+        return file_path
+
+    def get_filename(self, object_id):
+        return self._copy_file()
+
+    def get_file_descriptor(self, object_id):
+        fd = os.open(os.path.join(self._path, 'entry'), os.O_RDONLY)
+        try:
+            return dbus.types.UnixFd(fd)
+        finally:
+            os.close(fd)
+
+    def _read_fd(self, unix_fd):
+        with os.fdopen(unix_fd.take()) as f:
+            return f.read()
+
+    def create(self, properties, file_path, transfer_ownership):
+        self._write(None, properties, file_path, transfer_ownership)
+        return 'new'
+
+    def update(self, object_id, properties, file_path, transfer_ownership,
+               **kwargs):
+        self._write(object_id, properties, file_path, transfer_ownership)
+
+    def _write(self, object_id, properties, file_path, transfer_ownership):
+        with open(file_path) as f:
+            self.writes.append((object_id, f.read(), transfer_ownership))
+        os.remove(file_path)
+
+    def create_from_file_descriptor(self, properties, unix_fd):
+        self.writes.append((None, self._read_fd(unix_fd), None))
+        return 'new'
+
+    def update_from_file_descriptor(self, object_id, properties, unix_fd,
+                                    **kwargs):
+        self.writes.append((object_id, self._read_fd(unix_fd), None))
+
+
+class TestFileDescriptors(unittest.TestCase):
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        with open(os.path.join(self._path, 'entry'), 'w') as f:
+            f.write('content')
+        self._store = _FileDataStore(self._path)
+        self._get_data_store = datastore._get_data_store
+        datastore._get_data_store = lambda: self._store
+        self._fd_passing_supported = datastore._fd_passing_supported
+        self._sugar_home = os.environ.get('SUGAR_HOME')
+        os.environ['SUGAR_HOME'] = self._path
+
+    def tearDown(self):
+        datastore._get_data_store = self._get_data_store
+        datastore._fd_passing_supported = self._fd_passing_supported
+        if self._sugar_home is None:
+            del os.environ['SUGAR_HOME']
+        else:
+            os.environ['SUGAR_HOME'] = self._sugar_home
+        shutil.rmtree(self._path)
+
+    def _open_file(self):
+        fd = datastore.open_file('a')
+        with os.fdopen(fd) as f:
+            return f.read()
+
+    def _write_from_fd(self, object_id):
+        if object_id is None:
+            ds_object = datastore.create()
+        else:
+            ds_object = datastore.DSObject(
+                object_id, datastore.DSMetadata({'title': 'A'}), None)
+        fd = os.open(os.path.join(self._path, 'entry'), os.O_RDONLY)
+        try:
+            datastore.write_from_fd(ds_object, fd)
+            # The descriptor is left open
+            os.fstat(fd)
+        finally:
+            os.close(fd)
+        self.assertEqual(ds_object.object_id, object_id or 'new')
+        ds_object.destroy()
+
+    def test_open_file_copy(self):
+        datastore._fd_passing_supported = False
+        self.assertEqual(self._open_file(), 'content')
+        # The copy is not left behind
+        self.assertFalse(os.path.exists(os.path.join(self._path, 'copy')))
+
+    def test_write_from_fd_copy(self):
+        datastore._fd_passing_supported = False
+        self._write_from_fd('a')
+        self._write_from_fd(None)
+        self.assertEqual(self._store.writes, [('a', 'content', True),
+                                              (None, 'content', True)])
+
+    @unittest.skipUnless(hasattr(dbus.types, 'UnixFd'),
+                         'No file descriptor passing in dbus')
+    def test_open_file_fd_passing(self):
+        datastore._fd_passing_supported = True
+        self.assertEqual(self._open_file(), 'content')
+
+    @unittest.skipUnless(hasattr(dbus.types, 'UnixFd'),
+                         'No file descriptor passing in dbus')
+    def test_write_from_fd_fd_passing(self):
+        datastore._fd_passing_supported = True
+        self._write_from_fd('a')
+        self._write_from_fd(None)
+        self.assertEqual(self._store.writes, [('a', 'content', None),
+                                              (None, 'content', None)])
+
+
+class TestRawObjectScanner(unittest.TestCase):
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._get_icon_color = datastore._get_icon_color
+        datastore._get_icon_color = lambda: '#000000,#FFFFFF'
+
+    def tearDown(self):
+        datastore._get_icon_color = self._get_icon_color
+        shutil.rmtree(self._path)
+
+    def _write_file(self, name, mtime):
+        file_path = os.path.join(self._path, name)
+        with open(file_path, 'w') as f:
+            f.write(name)
+        os.utime(file_path, (mtime, mtime))
+
+    def _scan(self):
+        entries = []
+        main_loop = GLib.MainLoop()
+        scanner = datastore.RawObjectScanner(self._path, page_size=2)
+        scanner.connect('page-ready',
+                        lambda scanner_, page: entries.extend(page))
+        scanner.connect('finished', lambda scanner_: main_loop.quit())
+        scanner.start()
+        main_loop.run()
+        return dict([(os.path.basename(entry['uid']), entry['timestamp'])
+                     for entry in entries])
+
+    def test_new_changed_removed(self):
+        self._write_file('a.txt', 1000)
+        self._write_file('b.txt', 1000)
+        os.mkdir(os.path.join(self._path, 'dir'))
+        self._write_file(os.path.join('dir', 'c.txt'), 1000)
+        self.assertEqual(self._scan(), {'a.txt': 1000, 'b.txt': 1000,
+                                        'c.txt': 1000})
+
+        self._write_file('d.txt', 1000)
+        self._write_file('b.txt', 2000)
+        os.remove(os.path.join(self._path, 'a.txt'))
+        self.assertEqual(self._scan(), {'b.txt': 2000, 'c.txt': 1000,
+                                        'd.txt': 1000})
+
+
+class TestCopyJob(unittest.TestCase):
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._sugar_home = os.environ.get('SUGAR_HOME')
+        os.environ['SUGAR_HOME'] = os.path.join(self._path, 'home')
+        self._mount_point = os.path.join(self._path, 'mount')
+        os.mkdir(self._mount_point)
+
+    def tearDown(self):
+        if self._sugar_home is None:
+            del os.environ['SUGAR_HOME']
+        else:
+            os.environ['SUGAR_HOME'] = self._sugar_home
+        shutil.rmtree(self._path)
+
+    def _create_entry(self):
+        file_path = os.path.join(self._path, 'source')
+        with open(file_path, 'w') as f:
+            f.write('content')
+        ds_object = datastore.create()
+        ds_object.metadata['title'] = 'Notes'
+        ds_object.metadata['mime_type'] = 'text/plain'
+        ds_object.metadata['custom'] = 'kept'
+        ds_object.file_path = file_path
+        datastore.write(ds_object)
+        object_id = ds_object.object_id
+        ds_object.destroy()
+        return object_id
+
+    def test_copy_to_mount_point(self):
+        # Through the local datastore, as the metadata is not complete
+        ds_object = datastore.get(self._create_entry())
+        errors = []
+        main_loop = GLib.MainLoop()
+        job = datastore.copy_async(ds_object, self._mount_point)
+
+        def finished_cb(job_, error):
+            errors.append(error)
+            main_loop.quit()
+
+        job.connect('finished', finished_cb)
+        main_loop.run()
+        ds_object.destroy()
+
+        self.assertEqual(errors, [None])
+        self.assertEqual(os.path.dirname(job.destination_path),
+                         self._mount_point)
+        with open(job.destination_path) as f:
+            self.assertEqual(f.read(), 'content')
+
+        metadata_path = os.path.join(
+            self._mount_point, '.Sugar-Metadata',
+            os.path.basename(job.destination_path) + '.metadata')
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata['title'], 'Notes')
+        self.assertEqual(metadata['custom'], 'kept')
+        self.assertFalse('uid' in metadata)
+
+
+class TestFacetIndex(unittest.TestCase):
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._local_path = os.environ['SUGAR_LOCAL_DATASTORE']
+        os.environ['SUGAR_LOCAL_DATASTORE'] = self._path
+        self._data_store = datastore._data_store
+        datastore._data_store = None
+
+    def tearDown(self):
+        datastore._data_store = self._data_store
+        os.environ['SUGAR_LOCAL_DATASTORE'] = self._local_path
+        shutil.rmtree(self._path)
+
+    def _write(self, ds_object, activity):
+        ds_object.metadata['activity'] = activity
+        ds_object.metadata['mime_type'] = 'text/plain'
+        datastore.write(ds_object)
+
+    def test_signals(self):
+        first = datastore.create()
+        self._write(first, 'org.laptop.Read')
+        changes = []
+        index = datastore.FacetIndex()
+        index.connect('changed', lambda index_: changes.append(None))
+        self.assertEqual(index.get_counts('activity'),
+                         {'org.laptop.Read': 1})
+
+        second = datastore.create()
+        self._write(second, 'org.laptop.Read')
+        self.assertEqual(index.get_counts('activity'),
+                         {'org.laptop.Read': 2})
+        self.assertEqual(index.get_counts('mime_type'), {'text/plain': 2})
+
+        self._write(second, 'org.laptop.Write')
+        self.assertEqual(index.get_counts('activity'),
+                         {'org.laptop.Read': 1, 'org.laptop.Write': 1})
+        self.assertEqual(sorted(index.get_values('activity')),
+                         ['org.laptop.Read', 'org.laptop.Write'])
+
+        datastore.delete(first.object_id)
+        self.assertEqual(index.get_counts('activity'),
+                         {'org.laptop.Write': 1})
+        self.assertEqual(index.get_counts('mime_type'), {'text/plain': 1})
+        self.assertEqual(len(changes), 3)
+
+        # Writes that do not change the facets are not reported
+        second.metadata['title'] = 'Other title'
+        datastore.write(second)
+        self.assertEqual(len(changes), 3)
+
+        first.destroy()
+        second.destroy()
+
+
+class _FindDataStore(object):
+    def __init__(self, entries):
+        self.entries = entries
+        self.finds = []
+        self.updates = []
+
+    def connect_to_signal(self, signal_name, handler_function,
+                          dbus_interface=None, **kwargs):
+        return None
+
+    def find(self, query, properties, byte_arrays):
+        self.finds.append((query, properties))
+        entries = []
+        for entry in self.entries:
+            if 'uid' in query and entry['uid'] != query['uid']:
+                continue
+            entries.append(dict([(key, entry[key]) for key in entry
+                                 if key in properties or key == 'uid']))
+        return entries, len(entries)
+
+    def get_properties(self, object_id, byte_arrays):
+        self.finds.append(({'uid': object_id}, None))
+        for entry in self.entries:
+            if entry['uid'] == object_id:
+                return dict(entry)
+
+    def update(self, object_id, properties, file_path, transfer_ownership):
+        self.updates.append((object_id, dict(properties)))
+
+
+class TestLazyProperties(unittest.TestCase):
+    def setUp(self):
+        self._store = _FindDataStore([
+            {'uid': 'a', 'title': 'A', 'tags': 'old', 'preview': 'png data',
+             'custom': 'kept'},
+            {'uid': 'b', 'title': 'B'}])
+        self._get_data_store = datastore._get_data_store
+        datastore._get_data_store = lambda: self._store
+        self._ds_objects = []
+
+    def tearDown(self):
+        for ds_object in self._ds_objects:
+            ds_object.destroy()
+        datastore._lazy_cache.clear()
+        datastore._get_data_store = self._get_data_store
+
+    def _get(self, object_id, properties=None):
+        ds_object = datastore.get(object_id, properties)
+        self._ds_objects.append(ds_object)
+        return ds_object
+
+    def test_preview_not_fetched(self):
+        metadata = self._get('a').metadata
+        query, properties = self._store.finds[0]
+        self.assertEqual(query, {'uid': 'a'})
+        self.assertTrue('title' in properties)
+        self.assertFalse('preview' in properties)
+        self.assertFalse('preview' in metadata.get_dictionary())
+        self.assertEqual(len(self._store.finds), 1)
+
+    def test_fetch_on_access(self):
+        metadata = self._get('a').metadata
+        self.assertEqual(metadata['preview'], 'png data')
+        self.assertEqual(self._store.finds[1], ({'uid': 'a'}, ['preview']))
+        # Fetched values are written back
+        self.assertEqual(metadata.get_dictionary()['preview'], 'png data')
+
+    def test_contains(self):
+        metadata = self._get('a').metadata
+        self.assertTrue('preview' in metadata)
+        self.assertTrue('preview' in metadata.keys())
+        self.assertFalse('custom' in metadata)
+
+        metadata = self._get('b').metadata
+        self.assertFalse('preview' in metadata)
+        self.assertFalse('preview' in metadata.keys())
+        self.assertRaises(KeyError, metadata.__getitem__, 'preview')
+        # A single fetch of the preview per entry
+        self.assertEqual(len(self._store.finds), 4)
+
+    def test_requested_properties(self):
+        metadata = self._get('a', ['uid', 'preview']).metadata
+        self.assertEqual(self._store.finds[0][1], ['uid', 'preview'])
+        self.assertEqual(metadata['preview'], 'png data')
+        self.assertFalse('title' in metadata)
+        self.assertEqual(len(self._store.finds), 1)
+
+    def test_find_is_not_lazy(self):
+        self._ds_objects, count_ = datastore.find({}, properties=['title'])
+        metadata = self._ds_objects[0].metadata
+        self.assertFalse('preview' in metadata)
+        self.assertRaises(KeyError, metadata.__getitem__, 'preview')
+        self.assertEqual(len(self._store.finds), 1)
+
+    def test_write_sends_all_properties(self):
+        ds_object = self._get('a')
+        ds_object.metadata['title'] = 'New title'
+        del ds_object.metadata['tags']
+        datastore.write(ds_object, update_mtime=False)
+        object_id, properties = self._store.updates[0]
+        self.assertEqual(object_id, 'a')
+        self.assertEqual(properties['title'], 'New title')
+        self.assertEqual(properties['preview'], 'png data')
+        self.assertEqual(properties['custom'], 'kept')
+        self.assertFalse('tags' in properties)
+
+
+class TestResultSet(unittest.TestCase):
+    def setUp(self):
+        self._store = _FindDataStore([
+            {'uid': 'a', 'title': 'Same', 'keep': '1', 'filesize': 1},
+            {'uid': 'b', 'title': u'Same', 'filesize': True},
+            {'uid': 'c', 'title': ''.join(['Sa', 'me']), 'keep': '1'}])
+        self._get_data_store = datastore._get_data_store
+        datastore._get_data_store = lambda: self._store
+
+    def tearDown(self):
+        datastore._get_data_store = self._get_data_store
+
+    def _find_rows(self):
+        return datastore.find_rows({}, ['title', 'keep', 'filesize'])
+
+    def test_rows(self):
+        result_set, count = self._find_rows()
+        self.assertEqual(count, 3)
+        self.assertEqual(len(result_set), 3)
+        self.assertEqual([row.object_id for row in result_set],
+                         ['a', 'b', 'c'])
+        self.assertEqual(result_set[-1].object_id, 'c')
+        self.assertRaises(IndexError, result_set.__getitem__, 3)
+        self.assertEqual(result_set.get_column('keep'), ['1', None, '1'])
+
+        row = result_set.get_row('b')
+        self.assertEqual(row['title'], u'Same')
+        self.assertFalse('keep' in row)
+        self.assertRaises(KeyError, row.__getitem__, 'keep')
+        self.assertEqual(row.get('keep', '0'), '0')
+        self.assertEqual(sorted(row.keys()), ['filesize', 'title', 'uid'])
+        self.assertEqual(result_set.get_row('a').get_dictionary(),
+                         {'uid': 'a', 'title': 'Same', 'keep': '1',
+                          'filesize': 1})
+        self.assertIs(result_set.get_row('d'), None)
+
+    def test_shared_values(self):
+        result_set, count_ = self._find_rows()
+        titles = result_set.get_column('title')
+        self.assertIs(titles[0], titles[2])
+        # Equal values of other types are not merged
+        self.assertTrue(isinstance(titles[0], str))
+        self.assertTrue(isinstance(titles[1], unicode))
+        self.assertIs(result_set.get_value(0, 'filesize'), 1)
+        self.assertIs(result_set.get_value(1, 'filesize'), True)
+
+    def test_to_ds_object(self):
+        result_set, count_ = self._find_rows()
+        ds_object = result_set[0].to_ds_object()
+        self.assertEqual(ds_object.object_id, 'a')
+        ds_object.destroy()
+
+
+class TestMetadata(unittest.TestCase):
+    def test_shared_keys(self):
+        first = datastore.DSMetadata({u'title': 'A'})
+        second = datastore.DSMetadata()
+        second[u'title'] = 'B'
+        first_key = [key for key in first.keys() if key == 'title'][0]
+        second_key = [key for key in second.keys() if key == 'title'][0]
+        self.assertTrue(isinstance(first_key, str))
+        self.assertIs(first_key, second_key)
+
+    def test_single_notification(self):
+        changes = []
+        metadata = datastore.DSMetadata({'title': 'A'})
+        metadata.connect('properties-updated',
+                         lambda metadata_, keys: changes.append(keys))
+        metadata.update({u'title': 'B', 'keep': '1'})
+        self.assertEqual(changes, [set(['title', 'keep'])])
+
+
+class _QueueDataStore(object):
+    def __init__(self):
+        self.calls = []
+
+    def update(self, object_id, properties, file_path, transfer_ownership,
+               reply_handler, error_handler):
+        self.calls.append((object_id, dict(properties), reply_handler,
+                           error_handler))
+
+    def create(self, properties, file_path, transfer_ownership,
+               reply_handler, error_handler):
+        self.calls.append((None, dict(properties), reply_handler,
+                           error_handler))
+
+    def reply(self, *args):
+        object_id_, properties_, reply_handler, error_handler_ = \
+            self.calls.pop(0)
+        reply_handler(*args)
+
+    def fail(self, error):
+        object_id_, properties_, reply_handler_, error_handler = \
+            self.calls.pop(0)
+        error_handler(error)
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+    def setUp(self):
+        self._store = _QueueDataStore()
+        self._get_data_store = datastore._get_data_store
+        datastore._get_data_store = lambda: self._store
+        self._sugar_home = os.environ.get('SUGAR_HOME')
+        self._home_path = tempfile.mkdtemp()
+        os.environ['SUGAR_HOME'] = self._home_path
+        self._queue = datastore._WriteBehindQueue()
+        self._replies = []
+        self._errors = []
+
+    def tearDown(self):
+        datastore._get_data_store = self._get_data_store
+        if self._sugar_home is None:
+            del os.environ['SUGAR_HOME']
+        else:
+            os.environ['SUGAR_HOME'] = self._sugar_home
+        shutil.rmtree(self._home_path)
+
+    def _reply_cb(self):
+        self._replies.append(None)
+
+    def _error_cb(self, error):
+        self._errors.append(error)
+
+    def _write(self, ds_object, title):
+        self._queue.add(ds_object, {'title': title}, None, False,
+                        self._reply_cb, self._error_cb)
+
+    def test_merged_handlers(self):
+        ds_object = _Object('a')
+        self._write(ds_object, '1')
+        self._write(ds_object, '2')
+        self._write(ds_object, '3')
+        self._store.reply()
+        self.assertEqual(self._store.calls[0][1], {'title': '3'})
+        self._store.reply()
+        self.assertEqual(len(self._replies), 2)
+
+    def test_failed_write_is_not_overtaken(self):
+        retries = datastore.WRITE_BEHIND_RETRIES
+        datastore.WRITE_BEHIND_RETRIES = 1
+        try:
+            ds_object = _Object('a')
+            self._write(ds_object, '1')
+            self._write(ds_object, '2')
+            error = Exception('Service unavailable')
+            self._store.fail(error)
+        finally:
+            datastore.WRITE_BEHIND_RETRIES = retries
+
+        # The later write is folded into the log left for the next process
+        self.assertEqual(self._store.calls, [])
+        self.assertEqual(self._errors, [error])
+        queue_path = os.path.join(self._home_path, 'default',
+                                  'datastore-queue')
+        logs = [name for name in os.listdir(queue_path)
+                if name.endswith('.json')]
+        self.assertEqual(len(logs), 1)
+        self.assertTrue(self._queue.has_pending(ds_object))
+
+        # A new write tries again, with the newest data
+        self._write(ds_object, '3')
+        self.assertEqual(self._store.calls[0][:2], ('a', {'title': '3'}))
+        self._store.reply()
+        self.assertEqual(os.listdir(queue_path), [])
+        self.assertFalse(self._queue.has_pending(ds_object))
+
+
+class _CrashingMetadata(object):
+    def get_dictionary(self):
+        return {}
+
+    def __setitem__(self, key, value):
+        raise RuntimeError('Crash')
+
+
+class TestWriteBehindLog(unittest.TestCase):
+    def setUp(self):
+        self._store = _QueueDataStore()
+        self._get_data_store = datastore._get_data_store
+        datastore._get_data_store = lambda: self._store
+        self._sugar_home = os.environ.get('SUGAR_HOME')
+        self._home_path = tempfile.mkdtemp()
+        os.environ['SUGAR_HOME'] = self._home_path
+        self._queue_path = os.path.join(self._home_path, 'default',
+                                        'datastore-queue')
+
+    def tearDown(self):
+        datastore._get_data_store = self._get_data_store
+        if self._sugar_home is None:
+            del os.environ['SUGAR_HOME']
+        else:
+            os.environ['SUGAR_HOME'] = self._sugar_home
+        shutil.rmtree(self._home_path)
+
+    def _get_logs(self):
+        return sorted(name for name in os.listdir(self._queue_path)
+                      if name.endswith('.json'))
+
+    def test_seq_taken_by_another_process(self):
+        queue = datastore._WriteBehindQueue()
+        time_function = datastore.time.time
+        lock_fd = os.open(os.path.join(self._queue_path, '1000000.lock'),
+                          os.O_RDONLY | os.O_CREAT)
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        datastore.time.time = lambda: 1.0
+        try:
+            queue.add(_Object('a'), {'title': 'A'}, None, False, None, None)
+        finally:
+            datastore.time.time = time_function
+            os.close(lock_fd)
+        self.assertEqual(self._get_logs(), ['1000001.json'])
+        self._store.reply()
+
+    def test_created_object_id_is_logged(self):
+        queue = datastore._WriteBehindQueue()
+        ds_object = _Object(None)
+        ds_object.metadata = _CrashingMetadata()
+        queue.add(ds_object, {'title': 'A'}, None, False, None, None)
+        operation = queue._queue[0]
+        # The process dies while handling the reply
+        self.assertRaises(RuntimeError, self._store.reply, 'created')
+        log_name = self._get_logs()[0]
+        with open(os.path.join(self._queue_path, log_name)) as f:
+            self.assertEqual(json.load(f)['object_id'], 'created')
+
+        operation.release(delete=False)
+        # The next process updates the entry instead of creating another
+        datastore._WriteBehindQueue()
+        self.assertEqual(self._store.calls[0][:2],
+                         ('created', {'title': 'A'}))
+        self._store.reply()
+        self.assertEqual(self._get_logs(), [])
+
+
+def tearDownModule():
+    shutil.rmtree(_local_path)
@@ -0,0 +1,118 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sugar3.datastore.localstore import LocalDataStore, DataStoreError
+
+
+class TestLocalDataStore(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._store = LocalDataStore(os.path.join(self._root, 'datastore'))
+
+    def tearDown(self):
+        self._store.close()
+        shutil.rmtree(self._root)
+
+    def _create(self, title, timestamp, activity='org.sugarlabs.Write'):
+        return self._store.create({'title': title, 'timestamp': timestamp,
+                                   'activity': activity}, '', False)
+
+    def test_create_and_get_properties(self):
+        uid = self._store.create({'title': 'Drawing', 'preview': '\x89PNG'},
+                                 '', False)
+        props = self._store.get_properties(uid, byte_arrays=True)
+        self.assertEqual(props['uid'], uid)
+        self.assertEqual(props['title'], 'Drawing')
+        self.assertEqual(props['preview'], '\x89PNG')
+
+    def test_update_replaces_properties(self):
+        uid = self._create('One', 1)
+        self._store.update(uid, {'title': 'Two'}, '', False)
+        props = self._store.get_properties(uid)
+        self.assertEqual(props['title'], 'Two')
+        self.assertNotIn('activity', props)
+
+    def test_find_sorting_limit_offset(self):
+        for timestamp in range(5):
+            self._create('Entry %d' % timestamp, timestamp)
+
+        entries, count = self._store.find({'order_by': ['+timestamp'],
+                                           'limit': 2, 'offset': 1},
+                                          ['title'])
+        self.assertEqual(count, 5)
+        self.assertEqual([entry['title'] for entry in entries],
+                         ['Entry 1', 'Entry 2'])
+        self.assertEqual(sorted(entries[0].keys()), ['title', 'uid'])
+
+    def test_find_query(self):
+        self._create('Blue sky', 1)
+        self._create('Red sun', 2, activity='org.laptop.Paint')
+
+        entries, count = self._store.find({'query': 'blue*'}, [])
+        self.assertEqual(count, 1)
+        self.assertEqual(entries[0]['title'], 'Blue sky')
+
+        entries, count = self._store.find(
+            {'activity': 'org.laptop.Paint'}, [])
+        self.assertEqual(entries[0]['title'], 'Red sun')
+
+        entries, count = self._store.find(
+            {'timestamp': {'start': 2, 'end': 10}}, [])
+        self.assertEqual(count, 1)
+
+    def test_files(self):
+        file_path = os.path.join(self._root, 'content')
+        with open(file_path, 'w') as f:
+            f.write('hello')
+
+        uid = self._store.create({}, file_path, True)
+        self.assertFalse(os.path.exists(file_path))
+        self.assertEqual(self._store.get_properties(uid)['filesize'], 5)
+
+        copy_path = self._store.get_filename(uid)
+        with open(copy_path) as f:
+            self.assertEqual(f.read(), 'hello')
+        os.remove(copy_path)
+
+    def test_delete_and_signals(self):
+        received = []
+        self._store.connect_to_signal('Created', received.append)
+        match = self._store.connect_to_signal('Deleted', received.append)
+
+        uid = self._create('Gone', 1)
+        self._store.delete(uid)
+        match.remove()
+        self.assertEqual(received, [uid, uid])
+        self.assertRaises(DataStoreError, self._store.get_properties, uid)
+
+    def test_unique_values(self):
+        self._create('One', 1)
+        self._create('Two', 2)
+        self._create('Three', 3, activity='org.laptop.Paint')
+        values = self._store.get_uniquevaluesfor('activity', {})
+        self.assertEqual(sorted(values),
+                         ['org.laptop.Paint', 'org.sugarlabs.Write'])
+
+    def test_async_errors(self):
+        errors = []
+        self._store.get_properties('missing', reply_handler=None,
+                                   error_handler=errors.append)
+        self.assertEqual(len(errors), 1)
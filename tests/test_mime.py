@@ -17,7 +17,10 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import json
 import os
+import shutil
+import tempfile
 import unittest
 
 from sugar3 import mime
@@ -35,6 +38,15 @@ class TestMime(unittest.TestCase):
         self.assertListEqual(mime.get_mime_parents("image/svg+xml"),
                              ["application/xml"])
 
+    def test_get_mime_icon(self):
+        self.assertEqual(mime.get_mime_icon('application/pdf'),
+                         'text-x-generic')
+        # text/x-python is a subclass of text/plain
+        self.assertEqual(mime.get_mime_icon('text/x-python'),
+                         'text-x-generic')
+        self.assertEqual(mime.get_mime_icon('application/x-unknown-type'),
+                         'application-x-unknown-type')
+
     def test_get_for_file(self):
         self.assertEqual(mime.get_for_file(os.path.join(data_dir, "mime.svg")),
                          'image/svg+xml')
@@ -43,6 +55,14 @@ class TestMime(unittest.TestCase):
         self.assertEqual(mime.get_from_file_name('test.pdf'),
                          'application/pdf')
 
+    def test_primary_extension(self):
+        self.assertEqual(mime.get_primary_extension('application/pdf'),
+                         'pdf')
+        self.assertEqual(mime.get_primary_extension('audio/ogg'), 'ogg')
+        self.assertEqual(mime.get_for_extension('PDF'), 'application/pdf')
+        self.assertEqual(mime.get_for_extension('.pdf'), 'application/pdf')
+        self.assertIsNone(mime.get_for_extension('no-such-extension'))
+
     def test_choose_most_significant(self):
         # Mozilla's text in dnd
         mime_type = mime.choose_most_significant(
@@ -103,3 +123,84 @@ class TestMime(unittest.TestCase):
              'text/plain;charset=utf-8', 'text/plain;charset=UTF-8',
              'text/plain'])
         self.assertEqual(mime_type, 'text/plain')
+
+
+class TestGetForFiles(unittest.TestCase):
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._sugar_home = os.environ.get('SUGAR_HOME')
+        os.environ['SUGAR_HOME'] = self._path
+        mime._sniff_cache = None
+        self._sniff = mime._sniff
+        self._databases = []
+
+        def sniff(file_name, database=None):
+            self._databases.append(database)
+            return self._sniff(file_name, database)
+
+        mime._sniff = sniff
+
+    def tearDown(self):
+        mime._sniff = self._sniff
+        mime._sniff_cache = None
+        if self._sugar_home is None:
+            del os.environ['SUGAR_HOME']
+        else:
+            os.environ['SUGAR_HOME'] = self._sugar_home
+        shutil.rmtree(self._path)
+
+    def _write_file(self, name):
+        file_path = os.path.join(self._path, name)
+        with open(file_path, 'w') as f:
+            f.write('Some text\n')
+        return file_path
+
+    def _get_cache(self):
+        with open(os.path.join(self._path, 'default',
+                               'mime-types.json')) as f:
+            return json.load(f)
+
+    def test_get_for_files(self):
+        svg_path = os.path.join(data_dir, 'mime.svg')
+        text_path = self._write_file('notes')
+        missing_path = os.path.join(self._path, 'missing')
+        results = dict(mime.get_for_files(
+            [svg_path, 'file://' + text_path, missing_path], workers=2))
+        self.assertEqual(results, {svg_path: 'image/svg+xml',
+                                   'file://' + text_path: 'text/plain',
+                                   missing_path: None})
+
+    def test_same_backend_as_get_for_file(self):
+        text_path = self._write_file('notes')
+        mime.get_for_file(text_path)
+        list(mime.get_for_files([text_path]))
+        self.assertEqual(len(self._databases), 2)
+        self.assertIs(self._databases[0], self._databases[1])
+
+    def test_persisted_cache(self):
+        text_path = self._write_file('notes')
+        list(mime.get_for_files([text_path]))
+        self.assertEqual(self._get_cache().values(), ['text/plain'])
+
+        # Read back by the next process, without sniffing again
+        mime._sniff_cache = None
+        self.assertEqual(list(mime.get_for_files([text_path])),
+                         [(text_path, 'text/plain')])
+        self.assertEqual(len(self._databases), 1)
+
+    def test_least_recently_used_dropped(self):
+        cache_size = mime.SNIFF_CACHE_SIZE
+        mime.SNIFF_CACHE_SIZE = 2
+        try:
+            first, second, third = [self._write_file(name)
+                                    for name in ('a', 'b', 'c')]
+            list(mime.get_for_files([first]))
+            list(mime.get_for_files([second]))
+            # A hit makes the first file the most recently used
+            list(mime.get_for_files([first]))
+            list(mime.get_for_files([third]))
+        finally:
+            mime.SNIFF_CACHE_SIZE = cache_size
+        self.assertEqual(sorted(self._get_cache().keys()),
+                         sorted([mime._get_sniff_key(first),
+                                 mime._get_sniff_key(third)]))
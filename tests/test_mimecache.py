@@ -0,0 +1,71 @@
+# Copyright (C) 2026, agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import unittest
+
+from sugar3 import mimecache
+
+tests_dir = os.path.dirname(__file__)
+data_dir = os.path.join(tests_dir, "data")
+
+
+class TestMimeCache(unittest.TestCase):
+    def setUp(self):
+        self._database = mimecache.get_database()
+        if self._database is None:
+            self.skipTest('No mime.cache file')
+
+    def test_get_for_file_name(self):
+        self.assertEqual(self._database.get_for_file_name('test.pdf'),
+                         ['application/pdf'])
+        self.assertEqual(self._database.get_for_file_name('/tmp/TEST.PDF'),
+                         ['application/pdf'])
+        self.assertEqual(self._database.get_for_file_name('Makefile'),
+                         ['text/x-makefile'])
+        self.assertEqual(self._database.get_for_file_name('no-extension'), [])
+
+    def test_aliases_and_parents(self):
+        self.assertEqual(self._database.unalias('application/x-pdf'),
+                         'application/pdf')
+        self.assertEqual(self._database.get_parents('image/svg+xml'),
+                         ['application/xml'])
+        self.assertTrue(self._database.is_subclass('text/x-python',
+                                                   'text/plain'))
+        self.assertFalse(self._database.is_subclass('image/png',
+                                                    'text/plain'))
+
+    def test_get_for_data(self):
+        self.assertEqual(self._database.get_for_data('%PDF-1.4\n'),
+                         'application/pdf')
+        self.assertEqual(self._database.get_for_data('\x89PNG\r\n\x1a\n'),
+                         'image/png')
+        self.assertIsNone(self._database.get_for_data('\x00\x01'))
+
+    def test_get_for_file(self):
+        self.assertEqual(
+            self._database.get_for_file(os.path.join(data_dir, 'mime.svg')),
+            'image/svg+xml')
+
+    def test_unicode_file_name(self):
+        name = u'r\xe9sum\xe9.PDF'
+        self.assertEqual(self._database.get_for_file_name(name),
+                         ['application/pdf'])
+        self.assertEqual(
+            self._database.get_for_file_name(name.encode('utf-8')),
+            ['application/pdf'])
+        self.assertEqual(self._database.get_for_file_name(u'\u30e1\u30e2'),
+                         [])